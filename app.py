@@ -3,15 +3,22 @@ import vertexai
 from vertexai.generative_models import GenerativeModel, Content, Part, SafetySetting, HarmCategory, HarmBlockThreshold
 from google.oauth2 import service_account
 from datetime import datetime, timedelta
-import json, re, pytz, time
+import json, re, pytz, time, hashlib, gzip, threading, codecs, csv, itertools
 import pandas as pd
 import firebase_admin
 from firebase_admin import credentials, firestore
 import requests
+import prompt_store
+import post_classifier
+import szturchacz_parser
+import wiezowiec_parser
+import country_grupa
+import ew_case_store
+import bulk_ops
 
 # --- MODUŁ FORUM ---
 try:
-    from forum_module import execute_forum_actions, forum_read, discover_roots, auto_load_forum_context, save_forum_memory, load_forum_memory, check_forum_answer
+    from forum_module import execute_forum_actions, forum_read, discover_roots, auto_load_forum_context, save_forum_memory, load_forum_memory, check_forum_answer, FORUM_CLIENT, forum_cache_stats, start_forum_indexer, check_forum_answers_bulk, start_forum_outbox, forum_log_timings, forum_log_records, phone_log_entry, forum_outbox_failed, forum_outbox_retry
     FORUM_ENABLED = True
 except ImportError:
     FORUM_ENABLED = False
@@ -32,6 +39,11 @@ if not firebase_admin._apps:
     firebase_admin.initialize_app(creds)
 db = firestore.client()
 
+# --- INDEKS FORUM NrZam → wpisy (wątek w tle, raz na proces) ---
+if FORUM_ENABLED:
+    start_forum_indexer(db, col)
+    start_forum_outbox(db, col)  # wysyłacz kolejki wpisów forum (autopilot nie czeka na CreatePost)
+
 # --- AUTO-SEED (test mode) ---
 if TEST_MODE:
     _seed_doc = db.collection(col("operator_configs")).document("Sylwia").get()
@@ -89,12 +101,11 @@ for name, url in custom_data.items():
     WIEZOWIEC_PROMPT_URLS[name] = url
 
 
-@st.cache_data(ttl=3600)
 def get_remote_prompt(url):
+    """Prompt z prompt_store — z pamięci/dysku od razu, rewalidacja (ETag) w tle (jak app_vertex_ew).
+    Bez known_sha z _fetch_github_prompts — ta woła API GitHuba (do 10 s) po wygaśnięciu cache."""
     try:
-        r = requests.get(url)
-        r.raise_for_status()
-        return r.text
+        return prompt_store.get(url)
     except Exception as e:
         st.error(f"Błąd pobierania promptu: {e}")
         return ""
@@ -104,29 +115,528 @@ def get_remote_prompt(url):
 # FIRESTORE: ZARZĄDZANIE WSADAMI
 # ==========================================
 # Kolekcja: ew_wsady
-# Dokumenty: "swinka", "uszki", "szturchacz"
-# Pole: "data" = tekst wsadu, "updated_at" = timestamp
+# Dokumenty: "swinka", "uszki" — tekst wsadu + "updated_at" = timestamp
+# "szturchacz" = NAGŁÓWEK puli: "count", "updated_at" (tylko do unieważniania pamięci procesu);
+#   bloki w podkolekcji ew_wsady/szturchacz/blocks — jeden dokument na NrZam
+#   ({"nrzam", tekst, "sha", "norm", "seq"}). Manifest (kolejność + hashe) to zapytanie po blokach
+#   z .select(["nrzam", "sha", "norm", "seq"]) posortowane po seq — żadna tablica per zamówienie nie
+#   siedzi w jednym dokumencie, więc pula nie ma limitu 1 MiB. Dopełnienie puli zapisuje tylko
+#   nowe/zmienione bloki (blok = od razu wpis manifestu, nagłówek na końcu). Starsze formaty
+#   (cała pula w "data"; tablice "order"/"hashes" w nagłówku) są czytane dalej i migrowane
+#   przy pierwszym dopełnieniu.
+#   "norm" (na bloku) — hash bloku po normalizacji białych znaków: zmiana samego formatowania
+#   nie jest zmianą bloku. Case zapamiętuje "wsad_norm" bloku, z którego go wygenerowano —
+#   Generuj przelicza wolny case tylko, gdy norm jego bloku w puli jest inny (niezależnie od tego,
+#   którego dnia wsad go zmienił i ile razy Generuj puszczono). Delta dnia (nowe/zmienione NrZam)
+#   w ew_wsady/szturchacz/delty/{dzień} — podsumowanie wsadów dnia (podgląd, szacunek pracy LLM).
+# Tekst: gzip w polu bajtowym "{pole}_gz" + "enc": "gzip" (krótkie teksty i stare dokumenty —
+#   jawnie w "{pole}"). Odczyt w pamięci procesu: dokument pobieramy ponownie tylko, gdy
+#   zmienił się jego updated_at (sprawdzenie = odczyt jednego pola); bloki — gdy zmienił się sha.
 
 WSADY_COLLECTION = "ew_wsady"
+SZTURCHACZ_BLOCKS = "blocks"
+SZTURCHACZ_DELTY = "delty"  # ew_wsady/szturchacz/delty/{YYYY-MM-DD} — co wsady dnia zmieniły w puli
+EW_BATCH_SIZE = 60  # max zamówień na jedno wywołanie AI (Generuj)
+_FS_BATCH_MAX = 450  # operacji na batch (limit Firestore 500)
+WSAD_MIN_COMPRESS = 1024  # bajtów — krótsze teksty zapisujemy jawnie (gzip by nic nie dał)
+TEL_BULK_TTL = 300  # s — migawka odpowiedzi telefonistów dla woreczka (check_forum_answers_bulk)
+
+
+@st.cache_resource
+def _wsady_memory():
+    """Pamięć procesu (wspólna dla sesji): docs: nazwa -> (updated_at, wartość),
+    blocks: NrZam -> (sha, tekst, cechy)."""
+    return {"lock": threading.Lock(), "docs": {}, "blocks": {}}
+
+
+def _wsad_encode(text, field="data"):
+    """Pola dokumentu z tekstem: gzip (bajty + znacznik enc) albo jawnie dla krótkich."""
+    raw = text.encode("utf-8")
+    if len(raw) < WSAD_MIN_COMPRESS:
+        return {field: text}
+    return {"enc": "gzip", f"{field}_gz": gzip.compress(raw, compresslevel=6)}
+
+
+def _wsad_decode(d, field="data"):
+    """Odwrotność _wsad_encode — dokumenty bez znacznika enc (stary format) czytane wprost."""
+    if d.get("enc") == "gzip":
+        return gzip.decompress(bytes(d.get(f"{field}_gz") or b"")).decode("utf-8")
+    return d.get(field, "") or ""
+
+
+def _wsad_docs_cached(names, parse):
+    """Dokumenty ew_wsady z pamięci procesu. Najpierw jedno get_all z samym updated_at;
+    pełne (skompresowane) dokumenty ściągamy tylko dla zmienionych. parse(dict) -> wartość."""
+    mem = _wsady_memory()
+    refs = {n: db.collection(WSADY_COLLECTION).document(n) for n in names}
+    out = {}
+    with mem["lock"]:
+        cached = {n: mem["docs"].get(n) for n in names}
+    if any(cached.values()):
+        for snap in db.get_all([refs[n] for n in names if cached[n]], field_paths=["updated_at"]):
+            n = snap.id
+            if snap.exists and (snap.to_dict() or {}).get("updated_at") == cached[n][0]:
+                out[n] = cached[n][1]
+    stale = [n for n in names if n not in out]
+    if stale:
+        fresh = {}
+        for snap in db.get_all([refs[n] for n in stale]):
+            d = (snap.to_dict() or {}) if snap.exists else None
+            fresh[snap.id] = (d.get("updated_at") if d else None, parse(d))
+        with mem["lock"]:
+            for n in stale:
+                upd, val = fresh.get(n, (None, parse(None)))
+                if upd is not None:
+                    mem["docs"][n] = (upd, val)
+                else:
+                    mem["docs"].pop(n, None)
+                out[n] = val
+    return out
+
+
+def _wsad_forget(*names):
+    mem = _wsady_memory()
+    with mem["lock"]:
+        for n in names:
+            mem["docs"].pop(n, None)
+        if not names:
+            mem["docs"].clear()
+            mem["blocks"].clear()
+
+
+def load_wsady(*names):
+    """Kilka wsadów naraz (jedno sprawdzenie updated_at dla wszystkich) — teksty w kolejności names."""
+    got = _wsad_docs_cached(list(names), lambda d: _wsad_decode(d) if d else "")
+    return [got[n] for n in names]
+
 
 def load_wsad(name):
-    """Pobierz wsad z bazy"""
-    doc = db.collection(WSADY_COLLECTION).document(name).get()
-    if doc.exists:
-        return doc.to_dict().get("data", "")
-    return ""
+    """Pobierz wsad z bazy (szturchacz — złożony z bloków, jak dawniej jeden tekst)"""
+    if name == "szturchacz":
+        return '\n\n'.join(load_szturchacz_blocks().values())
+    return load_wsady(name)[0]
 
 def save_wsad(name, data):
-    """Zapisz wsad (nadpisz)"""
+    """Zapisz wsad (nadpisz) — skompresowany"""
     db.collection(WSADY_COLLECTION).document(name).set({
-        "data": data,
+        **_wsad_encode(data),
         "updated_at": firestore.SERVER_TIMESTAMP,
     })
+    _wsad_forget(name)
 
 def clear_all_wsady():
-    """Wyczyść wszystkie wsady"""
+    """Wyczyść wszystkie wsady (razem z blokami i deltami puli szturchacza)"""
+    _sz = db.collection(WSADY_COLLECTION).document("szturchacz")
+    _refs = (list(_sz.collection(SZTURCHACZ_BLOCKS).list_documents())
+             + list(_sz.collection(SZTURCHACZ_DELTY).list_documents()))
+    for i in range(0, len(_refs), _FS_BATCH_MAX):
+        _b = db.batch()
+        for _ref in _refs[i:i + _FS_BATCH_MAX]:
+            _b.delete(_ref)
+        _b.commit()
     for name in ["swinka", "uszki", "szturchacz"]:
         db.collection(WSADY_COLLECTION).document(name).delete()
+    _wsad_forget()
+
+
+# --- MASOWE CZYSZCZENIE (bulk_ops) ---
+# Stan zadań w col("bulk_jobs")/{nazwa}: przerwane (zamknięta karta, restart) wznawia się
+# od punktu kontrolnego przy ponownym kliknięciu.
+
+def _bulk_job_ref(name):
+    return db.collection(col("bulk_jobs")).document(name)
+
+
+def run_bulk_job(name, query, mutate, label, dry_run=False, select=None, before=None):
+    """bulk_ops.run_query_job z paskiem postępu (przy dry_run bez paska — samo liczenie)."""
+    bar = None if dry_run else st.progress(0.0, text=label)
+
+    def _progress(done, total):
+        if bar is not None:
+            bar.progress(min(1.0, done / max(total, 1)), text=f"{label}: {done}/{total}")
+
+    return bulk_ops.run_query_job(db, query, mutate, _bulk_job_ref(name), dry_run=dry_run,
+                                  select=select, before=before, progress=_progress)
+
+
+def bulk_job_interrupted(name):
+    """Komunikat o przerwanym zadaniu (albo None)."""
+    s = bulk_ops.job_state(_bulk_job_ref(name))
+    if s.get("state") != "running":
+        return None
+    return f"⚠️ Poprzednie czyszczenie przerwane po {s.get('scanned', 0)}/{s.get('total', '?')} — kliknij, aby dokończyć."
+
+
+def _sz_block_id(nrzam):
+    """ID dokumentu bloku — NrZam wprost, a dla nietypowych (ukośnik, kropki, "__x__") hash."""
+    if re.fullmatch(r'[\w\-]{1,200}', nrzam) and not nrzam.startswith("__"):
+        return nrzam
+    return "h_" + hashlib.sha1(nrzam.encode("utf-8")).hexdigest()[:24]
+
+
+def _sz_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _sz_norm_hash(text):
+    """Hash treści bloku po normalizacji białych znaków (CRLF, spacje/taby, puste linie) —
+    ten sam blok z innego eksportu nie liczy się jako zmieniony."""
+    norm = "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()[:16]
+
+
+def load_szturchacz_manifest():
+    """Manifest puli: {"order": [NrZam...], "hashes": [...], "norm": [...], "next_seq", "migrate",
+    "legacy": bloki|None}. norm — hashe po normalizacji (_sz_norm_hash); starsze bloki ich nie
+    mają ("" — uzupełniane przy dopełnieniu). legacy != None → pula jeszcze w starym formacie (cały tekst w polu "data");
+    migrate → manifest z tablic nagłówka (bloki bez seq), przepisywany przy dopełnieniu."""
+    return _wsad_docs_cached(["szturchacz"], _sz_parse_manifest)["szturchacz"]
+
+
+def _sz_parse_manifest(d):
+    if not d:
+        return {"order": [], "hashes": [], "norm": [], "next_seq": 0, "migrate": False, "legacy": None}
+    if "order" in d:
+        order = list(d.get("order") or [])
+        return {"order": order, "hashes": list(d.get("hashes") or []),
+                "norm": list(d.get("norm") or []), "next_seq": len(order), "migrate": True, "legacy": None}
+    if "data" in d or "data_gz" in d:
+        legacy = parse_szturchacz_blocks(_wsad_decode(d))
+        return {"order": list(legacy), "hashes": [_sz_hash(t) for t in legacy.values()],
+                "norm": [_sz_norm_hash(t) for t in legacy.values()], "next_seq": len(legacy),
+                "migrate": False, "legacy": legacy}
+    order, hashes, norm = [], [], []
+    next_seq = 0
+    for snap in (db.collection(WSADY_COLLECTION).document("szturchacz").collection(SZTURCHACZ_BLOCKS)
+                 .select(["nrzam", "sha", "norm", "seq"]).order_by("seq").stream()):
+        b = snap.to_dict() or {}
+        order.append(b.get("nrzam"))
+        hashes.append(b.get("sha"))
+        norm.append(b.get("norm") or "")
+        next_seq = max(next_seq, int(b.get("seq") or 0) + 1)
+    return {"order": order, "hashes": hashes, "norm": norm, "next_seq": next_seq,
+            "migrate": False, "legacy": None}
+
+
+def _sz_unchanged(nrzam, h, nh, raw, norm):
+    """Blok bez zmian względem puli: ten sam hash po normalizacji, a gdy puli brak
+    hasha znormalizowanego (stary manifest) — identyczny tekst."""
+    if norm.get(nrzam):
+        return norm[nrzam] == nh
+    return raw.get(nrzam) == h
+
+
+def _sz_delta(manifest, final):
+    """Klasyfikacja wsadu względem puli. final: {NrZam: (hash, hash_norm)} z wsadu.
+    removed — NrZam z puli nieobecne w tym wsadzie (z puli NIE są usuwane)."""
+    raw = dict(zip(manifest["order"], manifest["hashes"]))
+    norm = dict(zip(manifest["order"], manifest["norm"]))
+    new, changed, unchanged = [], [], []
+    for nrzam, (h, nh) in final.items():
+        if nrzam not in raw:
+            new.append(nrzam)
+        elif _sz_unchanged(nrzam, h, nh, raw, norm):
+            unchanged.append(nrzam)
+        else:
+            changed.append(nrzam)
+    removed = [n for n in manifest["order"] if n not in final and n != "_RAW_"]
+    return {"new": new, "changed": changed, "unchanged": unchanged, "removed": removed}
+
+
+def szturchacz_delta_preview(blocks, manifest=None):
+    """Co zmieni dopełnienie puli blokami (NrZam, tekst) — BEZ zapisu (czyta tylko manifest).
+    Zwraca słownik jak _sz_delta + "llm": szacunek zamówień do przeliczenia i partii."""
+    manifest = manifest or load_szturchacz_manifest()
+    final = {nrzam: (_sz_hash(text), _sz_norm_hash(text)) for nrzam, text in blocks}
+    delta = _sz_delta(manifest, final)
+    delta["llm"] = _sz_llm_estimate(delta)
+    return delta
+
+
+def _sz_llm_estimate(delta):
+    """Górny szacunek pracy LLM w Generuj: nowe + zmienione (bez zakończonych z bazy,
+    które Generuj przelicza niezależnie od wsadu)."""
+    n = len(delta["new"]) + len(delta["changed"])
+    return {"zamowienia": n, "partie": -(-n // EW_BATCH_SIZE)}
+
+
+def load_szturchacz_blocks(nrzams=None, manifest=None):
+    """Bloki puli {NrZam: tekst} w kolejności puli — wszystkie albo tylko wskazane NrZam."""
+    manifest = manifest or load_szturchacz_manifest()
+    if nrzams is None:
+        wanted = manifest["order"]
+    else:
+        _w = set(nrzams)
+        wanted = [n for n in manifest["order"] if n in _w]
+    if manifest["legacy"] is not None:
+        return {n: manifest["legacy"][n] for n in wanted}
+    # Bloki z pamięci procesu, jeśli sha z manifestu się zgadza — z bazy tylko brakujące/zmienione
+    sha = dict(zip(manifest["order"], manifest["hashes"]))
+    mem = _wsady_memory()
+    got = {}
+    with mem["lock"]:
+        for n in wanted:
+            hit = mem["blocks"].get(n)
+            if hit and hit[0] == sha.get(n):
+                got[n] = hit[1]
+    base = db.collection(WSADY_COLLECTION).document("szturchacz").collection(SZTURCHACZ_BLOCKS)
+    refs = [base.document(_sz_block_id(n)) for n in wanted if n not in got]
+    for i in range(0, len(refs), 300):
+        for snap in db.get_all(refs[i:i + 300]):
+            if snap.exists:
+                d = snap.to_dict() or {}
+                got[d.get("nrzam")] = _wsad_decode(d, "text")
+                # bloki zapisane przed cechami — liczone przy odczycie
+                _c = d.get("cechy") or country_grupa.cechy(got[d.get("nrzam")])
+                with mem["lock"]:
+                    mem["blocks"][d.get("nrzam")] = (d.get("sha"), got[d.get("nrzam")], _c)
+    return {n: got[n] for n in wanted if n in got}
+
+
+def load_szturchacz_cechy(nrzams, manifest=None):
+    """Cechy bloków {NrZam: {"grupa_kraj", "email", "zablokowany"}} — zapisane z blokiem
+    (country_grupa.cechy przy upsert); bloki czytane przez load_szturchacz_blocks (pamięć procesu)."""
+    manifest = manifest or load_szturchacz_manifest()
+    blocks = load_szturchacz_blocks(nrzams, manifest=manifest)
+    sha = dict(zip(manifest["order"], manifest["hashes"]))
+    mem = _wsady_memory()
+    out = {}
+    with mem["lock"]:
+        for n, text in blocks.items():
+            hit = mem["blocks"].get(n)
+            out[n] = hit[2] if hit and hit[0] == sha.get(n) else None
+    return {n: c or country_grupa.cechy(blocks[n]) for n, c in out.items()}
+
+
+def collapse_generation_blocks(parts, cechy, existing_cases_map):
+    """Pre-pass Generuj: zwija bloki zablokowanych klientów (ten sam email) do jednego reprezentanta
+    i usuwa powtórzone NrZam — na całym generowaniu, przed podziałem na partie.
+
+    parts — [(NrZam, blok)], cechy — {NrZam: country_grupa.cechy}, existing_cases_map — casy z bazy.
+    Reprezentant: NrZam z casem w bazie (jeśli jest w grupie), inaczej pierwszy w kolejności.
+    Zwraca (parts_bez_zwiniętych, {email: {"nrzamy", "zapisany"}}, {reprezentant: [zwinięte NrZam]})."""
+    seen = set()
+    groups = {}  # email -> [NrZam] w kolejności parts
+    for nrzam, _ in parts:
+        c = cechy.get(nrzam) or {}
+        if nrzam not in seen and c.get("zablokowany") and c.get("email"):
+            groups.setdefault(c["email"], []).append(nrzam)
+        seen.add(nrzam)
+    email_index = {}
+    powiazane = {}
+    zwiniete = set()
+    for email, nrzamy in groups.items():
+        rep = next((n for n in nrzamy if n in existing_cases_map), nrzamy[0])
+        email_index[email] = {"nrzamy": nrzamy, "zapisany": None}
+        if len(nrzamy) > 1:
+            powiazane[rep] = [n for n in nrzamy if n != rep]
+            zwiniete.update(powiazane[rep])
+    out = []
+    seen = set()
+    for nrzam, block in parts:
+        if nrzam in seen or nrzam in zwiniete:
+            continue
+        seen.add(nrzam)
+        out.append((nrzam, block))
+    return out, email_index, powiazane
+
+
+def upsert_szturchacz(new_text):
+    """Dopełnij pulę szturchacza tekstem (wklejka) — patrz upsert_szturchacz_blocks."""
+    return upsert_szturchacz_blocks(parse_szturchacz_blocks(new_text).items())
+
+
+def upsert_szturchacz_blocks(blocks, progress=None):
+    """Dopełnij pulę szturchacza: zapisuje TYLKO bloki nowe/zmienione (po hashu) + nagłówek.
+    To samo NrZam = aktualizacja (zachowuje seq), nowe NrZam dopisane na końcu (jak merge_szturchacz).
+    Blok różniący się tylko białymi znakami nie jest nadpisywany (_sz_norm_hash).
+
+    blocks — iterowalne (NrZam, tekst), także generator ze strumienia pliku: bloki idą do bazy
+    batchami po _FS_BATCH_MAX w trakcie czytania, nagłówek na końcu. Każdy blok niesie swoje
+    sha i seq — przerwany zapis zostawia pulę spójną (bez części nowych bloków). Powtórzony NrZam
+    w jednym wsadzie — wygrywa ostatni blok. progress(n_bloków) po każdym batchu.
+    Zwraca deltę (_sz_delta) + "total" i "llm"; delta dnia zapisywana (save_szturchacz_delta)."""
+    manifest = load_szturchacz_manifest()
+    order = list(manifest["order"])
+    known = dict(zip(order, manifest["hashes"]))     # stan bieżący (po zapisanych batchach)
+    known_norm = dict(zip(order, manifest["norm"]))
+    seq = {n: i for i, n in enumerate(order)} if manifest["migrate"] or manifest["legacy"] is not None else None
+    next_seq = manifest["next_seq"]
+    base = db.collection(WSADY_COLLECTION).document("szturchacz").collection(SZTURCHACZ_BLOCKS)
+    mem = _wsady_memory()
+    pending = {}
+    new_seq = {}  # NrZam dopisane tym wsadem -> seq
+    norm_fill = []  # bloki bez zmian, którym brakuje hasha norm
+    final = {}  # NrZam -> (hash, hash_norm) z tego wsadu — do klasyfikacji względem manifestu
+    n_blocks = 0
+
+    def _flush():
+        items = list(pending.items())
+        # kraj → grupa, email, "Zablokowany klient" — raz na blok, zapisywane z blokiem
+        cechy = {nrzam: country_grupa.cechy(text) for nrzam, text in items}
+        for i in range(0, len(items), _FS_BATCH_MAX):
+            batch = db.batch()
+            for nrzam, text in items[i:i + _FS_BATCH_MAX]:
+                doc = {
+                    "nrzam": nrzam, "sha": known[nrzam], "norm": known_norm[nrzam],
+                    **_wsad_encode(text, "text"),
+                    "cechy": cechy[nrzam],
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                }
+                if nrzam in new_seq:
+                    doc["seq"] = new_seq[nrzam]
+                elif seq is not None:
+                    doc["seq"] = seq[nrzam]
+                # merge — istniejący blok zachowuje swoje seq
+                batch.set(base.document(_sz_block_id(nrzam)), doc, merge=True)
+            batch.commit()
+        with mem["lock"]:
+            for nrzam, text in items:
+                mem["blocks"][nrzam] = (known[nrzam], text, cechy[nrzam])
+        pending.clear()
+        if progress:
+            progress(n_blocks)
+
+    if manifest["legacy"] is not None:
+        # migracja starego formatu — wszystkie bloki lądują w podkolekcji
+        pending.update(manifest["legacy"])
+        _flush()
+    elif manifest["migrate"]:
+        # manifest z tablic nagłówka → seq na blokach (jednorazowo)
+        for i in range(0, len(order), _FS_BATCH_MAX):
+            batch = db.batch()
+            for nrzam in order[i:i + _FS_BATCH_MAX]:
+                batch.set(base.document(_sz_block_id(nrzam)), {
+                    "nrzam": nrzam, "sha": known[nrzam], "norm": known_norm.get(nrzam, ""),
+                    "seq": seq[nrzam]}, merge=True)
+            batch.commit()
+    for nrzam, text in blocks:
+        n_blocks += 1
+        h, nh = _sz_hash(text), _sz_norm_hash(text)
+        final[nrzam] = (h, nh)
+        if nrzam not in known:
+            order.append(nrzam)
+            new_seq[nrzam] = next_seq
+            next_seq += 1
+        elif _sz_unchanged(nrzam, h, nh, known, known_norm):
+            if not known_norm.get(nrzam):
+                known_norm[nrzam] = nh  # blok sprzed norm — uzupełnij na bloku
+                norm_fill.append(nrzam)
+            continue
+        known[nrzam] = h
+        known_norm[nrzam] = nh
+        pending[nrzam] = text
+        if len(pending) >= _FS_BATCH_MAX:
+            _flush()
+    _flush()
+    for i in range(0, len(norm_fill), _FS_BATCH_MAX):
+        batch = db.batch()
+        for nrzam in norm_fill[i:i + _FS_BATCH_MAX]:
+            batch.set(base.document(_sz_block_id(nrzam)), {"norm": known_norm[nrzam]}, merge=True)
+        batch.commit()
+
+    delta = _sz_delta(manifest, final)
+    # Nagłówek na końcu — nowy updated_at unieważnia manifest w pamięci procesów
+    db.collection(WSADY_COLLECTION).document("szturchacz").set({
+        "count": len([n for n in order if n != "_RAW_"]),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+    _wsad_forget("szturchacz")
+    delta["total"] = len(order)
+    delta["llm"] = _sz_llm_estimate(delta)
+    if final:
+        save_szturchacz_delta(delta)
+    return delta
+
+
+def _sz_delta_ref(dzien):
+    return (db.collection(WSADY_COLLECTION).document("szturchacz")
+            .collection(SZTURCHACZ_DELTY).document(dzien))
+
+
+def save_szturchacz_delta(delta):
+    """Dopisz deltę wsadu do delty dnia (Europe/Warsaw): nowe i zmienione sumowane przez
+    wszystkie wsady dnia (NrZam nowy rano i zmieniony wieczorem zostaje nowym);
+    liczniki bez_zmian/nieobecne — z ostatniego wsadu."""
+    dzien = datetime.now(pytz.timezone("Europe/Warsaw")).strftime("%Y-%m-%d")
+    prev = load_szturchacz_delta(dzien) or {"new": set(), "changed": set()}
+    new = prev["new"] | set(delta["new"])
+    changed = (prev["changed"] | set(delta["changed"])) - new
+    _sz_delta_ref(dzien).set({
+        "dzien": dzien,
+        **_wsad_encode(json.dumps({"new": sorted(new), "changed": sorted(changed)}), "nrzamy"),
+        "n_new": len(new),
+        "n_changed": len(changed),
+        "ostatni_wsad": {k: len(delta[k]) for k in ("new", "changed", "unchanged", "removed")},
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+
+
+def load_szturchacz_delta(dzien=None):
+    """Delta dnia {"dzien", "new": set, "changed": set, "ostatni_wsad": {...}} — dla dzien=None
+    najnowsza zapisana. None, gdy brak."""
+    if dzien:
+        snap = _sz_delta_ref(dzien).get()
+    else:
+        snaps = list(db.collection(WSADY_COLLECTION).document("szturchacz").collection(SZTURCHACZ_DELTY)
+                     .order_by("dzien", direction=firestore.Query.DESCENDING).limit(1).get())
+        snap = snaps[0] if snaps else None
+    if snap is None or not snap.exists:
+        return None
+    d = snap.to_dict() or {}
+    nrzamy = json.loads(_wsad_decode(d, "nrzamy") or "{}")
+    return {"dzien": d.get("dzien", snap.id), "new": set(nrzamy.get("new", [])),
+            "changed": set(nrzamy.get("changed", [])), "ostatni_wsad": d.get("ostatni_wsad", {})}
+
+
+WSAD_UPLOAD_TYPES = ["txt", "tsv", "csv", "gz"]
+_UPLOAD_CHUNK = 1 << 20  # 1 MiB
+
+
+def iter_upload_lines(uploaded, on_progress=None):
+    """Linie wgranego pliku wsadu, czytane kawałkami (bez ładowania całości do pamięci).
+    .gz rozpoznawany po nagłówku; kodowanie UTF-8 albo — gdy próbka się nie dekoduje —
+    cp1250 (eksporty z Windows). CSV → kolumny łączone tabulatorem, jak wklejka z arkusza.
+    on_progress(ułamek) — postęp po bajtach pliku."""
+    uploaded.seek(0)
+    is_gz = uploaded.read(2) == b"\x1f\x8b"
+    uploaded.seek(0)
+    stream = gzip.GzipFile(fileobj=uploaded) if is_gz else uploaded
+    total = getattr(uploaded, "size", 0) or 0
+
+    first = stream.read(_UPLOAD_CHUNK)
+    try:
+        codecs.getincrementaldecoder("utf-8-sig")().decode(first, final=False)
+        enc = "utf-8-sig"
+    except UnicodeDecodeError:
+        enc = "cp1250"
+    decoder = codecs.getincrementaldecoder(enc)(errors="replace")
+
+    def _raw_lines():
+        rest = ""
+        chunk = first
+        while chunk:
+            text = rest + decoder.decode(chunk)
+            *lines, rest = text.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+            if on_progress and total:
+                on_progress(min(1.0, uploaded.tell() / total))
+            chunk = stream.read(_UPLOAD_CHUNK)
+        rest += decoder.decode(b"", final=True)
+        if rest:
+            yield rest.rstrip("\r")
+
+    name = (getattr(uploaded, "name", "") or "").lower()
+    if name.endswith(".csv") or name.endswith(".csv.gz"):
+        lines = _raw_lines()
+        head = next(lines, "")
+        delim = ";" if head.count(";") > head.count(",") else ","
+        for row in csv.reader(itertools.chain([head], lines), delimiter=delim):
+            yield "\t".join(row)
+    else:
+        yield from _raw_lines()
+
 
 def parse_szturchacz_blocks(text):
     """Dzieli tekst szturchacza na bloki per zamówienie (NrZam → tekst bloku).
@@ -135,64 +645,17 @@ def parse_szturchacz_blocks(text):
     - NrZam: 366000 (z prefiksem)
     - ZN366000 (z prefiksem ZN)
     - 366000 (gołe 6+ cyfrowe numery na początku linii — format tabeli)
+    Parser w szturchacz_parser (skompilowane wzorce, pamięć po hashu tekstu) — tu kopia
+    słownika, bo wynik w pamięci parsera jest współdzielony.
     """
-    if not text or not text.strip():
-        return {}
-    
-    blocks = {}
-    lines = text.split('\n')
-    current_block = []
-    current_nr = None
-    
-    for line in lines:
-        stripped = line.strip()
-        
-        # Szukaj NrZam w różnych formatach
-        nr_match = None
-        
-        # Format 1: NrZam: XXXXX lub NrZam XXXXX
-        nr_match = re.search(r'NrZam[:\s]+(\S+)', line, re.IGNORECASE)
-        
-        # Format 2: ZN + cyfry
-        if not nr_match:
-            nr_match = re.match(r'^(ZN\d+)', stripped)
-        
-        # Format 3: gołe 5-7 cyfrowe numery na początku linii (format tabeli szturchacza)
-        # Nie łap numerów listów przewozowych (13+ cyfr) ani dat (8 cyfr z myślnikami)
-        if not nr_match:
-            nr_match = re.match(r'^(\d{5,7})\s', stripped)
-        
-        if nr_match:
-            # Zapisz poprzedni blok
-            if current_nr and current_block:
-                blocks[current_nr] = '\n'.join(current_block)
-            # Rozpocznij nowy blok
-            candidate = nr_match.group(1).strip().rstrip(',').rstrip('|')
-            # Filtruj fałszywe matche (nagłówki tabeli itp.)
-            if candidate.lower() in ('data', 'zama', 'nr', 'nrzam', 'mail', 'tel', 'kraj'):
-                current_block.append(line) if current_block is not None else None
-            else:
-                current_nr = candidate
-                current_block = [line]
-        else:
-            if current_block is not None:
-                current_block.append(line)
-    
-    # Zapisz ostatni blok
-    if current_nr and current_block:
-        blocks[current_nr] = '\n'.join(current_block)
-    
-    # Jeśli parser nie znalazł bloków, zwróć cały tekst jako jeden blok
-    if not blocks and text.strip():
-        blocks["_RAW_"] = text.strip()
-    
-    return blocks
+    return dict(szturchacz_parser.parse_blocks(text))
 
 def merge_szturchacz(existing_text, new_text):
     """
     Dopełnij istniejący wsad szturchacza nowymi zamówieniami.
     Jeśli zamówienie o tym samym NrZam istnieje — nadpisz nowszą wersją.
     Jeśli nie istnieje — dodaj.
+    updated liczy tylko bloki o zmienionej treści (po normalizacji białych znaków).
     """
     existing_blocks = parse_szturchacz_blocks(existing_text)
     new_blocks = parse_szturchacz_blocks(new_text)
@@ -201,7 +664,8 @@ def merge_szturchacz(existing_text, new_text):
     merged = {**existing_blocks, **new_blocks}
     
     added = len([k for k in new_blocks if k not in existing_blocks])
-    updated = len([k for k in new_blocks if k in existing_blocks])
+    updated = len([k for k in new_blocks if k in existing_blocks
+                   and _sz_norm_hash(new_blocks[k]) != _sz_norm_hash(existing_blocks[k])])
     
     # Złóż z powrotem w tekst
     merged_text = '\n\n'.join(merged.values())
@@ -209,122 +673,20 @@ def merge_szturchacz(existing_text, new_text):
     return merged_text, added, updated, len(merged)
 
 def count_lines(text):
-    """Policz ile zamówień (bloków) jest w tekście"""
+    """Policz ile zamówień (bloków) jest w tekście — bez składania bloków"""
     if not text or not text.strip():
         return 0
-    blocks = parse_szturchacz_blocks(text)
-    # Nie licz klucza _RAW_ jako zamówienia
-    count = len([k for k in blocks if k != "_RAW_"])
-    return max(count, 1 if text.strip() and count == 0 else 0)
+    # _RAW_ (brak rozpoznanych NrZam) liczony jako jedno zamówienie — jak dawniej
+    return max(szturchacz_parser.count(text), 1)
 
 
 # ==========================================
-# PARSER WYJŚCIA WIEŻOWCA (bez zmian)
+# PARSER WYJŚCIA WIEŻOWCA
 # ==========================================
 def parse_wiezowiec_output(text):
-    cases = []
-    current_grupa = None
-    grupa_patterns = {
-        "DE": r'▬+\s*OPERATORZY\s+DE',
-        "FR": r'▬+\s*OPERATORZY\s+FR',
-        # \b: "OPERATORZY UK" nie złapie "OPERATORZY UKPL" (po K jest P)
-        "UK": r'▬+\s*OPERATORZY\s+UK\b',
-        "PL": r'▬+\s*OPERATORZY\s+PL\b',
-        "UKPL": r'▬+\s*OPERATORZY\s+UKPL',   # LEGACY → normalizowane do UK niżej
-    }
-    lines = text.split('\n')
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        for grupa, pattern in grupa_patterns.items():
-            if re.search(pattern, line):
-                # LEGACY: stary wsad z sekcją UKPL → traktujemy jako UK (PL wyodrębniona osobno)
-                current_grupa = "UK" if grupa == "UKPL" else grupa
-                break
-        # Nagłówek: [SCORE=XXX] ikona | ...
-        score_match = re.match(r'^\[SCORE=(\d+)\]\s*([🔴🟡⚪📦])\s*\|\s*(.*)', line)
-        if not score_match:
-            # Alternatywny format: ikona [score] | ...
-            score_match = re.match(r'^([🔴🟡⚪📦])\s*\[(\d+)\]\s*\|\s*(.*)', line)
-            if score_match:
-                icon = score_match.group(1)
-                score = int(score_match.group(2))
-                label = score_match.group(3).strip()
-            else:
-                score_match = None
-        else:
-            score = int(score_match.group(1))
-            icon = score_match.group(2)
-            label = score_match.group(3).strip()
-        
-        if score_match and current_grupa:
-            naglowek = line
-            i += 1
-            blok_lines = []
-            # Zbierz linie: punktacja + pełna linia szturchacza
-            while i < len(lines):
-                nl = lines[i].strip()
-                if nl == '---' or nl.startswith('▬') or nl.startswith('═══'):
-                    break
-                if re.match(r'^\[SCORE=\d+\]', nl) or re.match(r'^[🔴🟡⚪📦]\s*\[\d+\]', nl):
-                    break
-                if nl:
-                    blok_lines.append(lines[i])
-                i += 1
-            
-            pelna_linia = '\n'.join(blok_lines).strip()
-            
-            # Wyciągnij numer zamówienia
-            numer = None
-            for p in [r'NrZam[:\s]+(\S+)', r'Nr\s*Zam[:\s]+(\S+)', r'(ZN\d+)', r'(ZW\d+[/]\d+)']:
-                m = re.search(p, pelna_linia, re.IGNORECASE)
-                if m:
-                    numer = m.group(1).strip().rstrip(',').rstrip('|')
-                    break
-            
-            # Fallback: szukaj gołego 5-7 cyfrowego numeru na początku linii (format tabeli)
-            if not numer:
-                for bl in blok_lines:
-                    m = re.match(r'^\s*(\d{5,7})\s', bl)
-                    if m:
-                        numer = m.group(1)
-                        break
-            
-            # Fallback 2: szukaj gołego numeru gdziekolwiek w nagłówku lub label
-            if not numer:
-                for src in [naglowek, label]:
-                    m = re.search(r'(\d{5,7})', src)
-                    if m:
-                        numer = m.group(1)
-                        break
-            
-            idx_m = re.search(r'Index:\s*(\S+)', label)
-            index_handlowy = idx_m.group(1) if idx_m else ""
-            if not index_handlowy:
-                lindx_m = re.search(r'lindexy[:\s]+(\S+)', pelna_linia, re.IGNORECASE)
-                if lindx_m:
-                    index_handlowy = lindx_m.group(1)
-            
-            if pelna_linia and numer:
-                cases.append({
-                    "numer_zamowienia": numer,
-                    "score": score,
-                    "priority_icon": icon,
-                    "priority_label": label,
-                    "grupa": current_grupa,
-                    "index_handlowy": index_handlowy,
-                    "pelna_linia_szturchacza": pelna_linia,
-                    "naglowek_priorytetowy": naglowek,
-                })
-            continue
-        
-        if 'ALERT' in line and 'BRAK W SZTURCHACZU' in line:
-            i += 1
-            while i < len(lines) and not lines[i].strip().startswith('═══'):
-                i += 1
-            continue
-        i += 1
-    return cases
+    """Casy z odpowiedzi Wieżowca — wiezowiec_parser (jeden przebieg; tryb przyrostowy
+    IncrementalParser składa casy w trakcie strumieniowania odpowiedzi)."""
+    return wiezowiec_parser.parse(text)
 
 
 # ==========================================
@@ -353,7 +715,7 @@ GRUPA_MAP_GLOBAL = {"DE": "Operatorzy_DE", "FR": "Operatorzy_FR", "UK": "OPERATO
 
 def build_autopilot_queue(percent, obsada, ap_work_date_str):
     """Buduje kolejkę autopilota: top X% casów globalnie po score, round-robin per grupa."""
-    all_wolne_docs = db.collection(col("ew_cases")).where("status", "==", "wolny").get()
+    all_wolne_docs = db.collection(col("ew_cases")).where("status", "==", "wolny").select(ew_case_store.INDEX_FIELDS).get()
     wolne = []
     for cdoc in all_wolne_docs:
         cdata = cdoc.to_dict()
@@ -627,7 +989,7 @@ def _render_group_box(label, d):
 def render_group_summary_now():
     """Kafelek grupowy — STAN BIEŻĄCY z żywej puli ew_cases (per grupa + cała firma)."""
     try:
-        docs = db.collection(col("ew_cases")).limit(8000).get()
+        docs = db.collection(col("ew_cases")).select(ew_case_store.INDEX_FIELDS).limit(8000).get()
     except Exception:
         docs = []
     g = {x: {"total": 0, "odroczony": 0, "zakonczony": 0, "pominiety": 0} for x in _GRUPA_KEYS}
@@ -670,7 +1032,7 @@ def _group_counts_from_pool():
     """Per-grupa liczby z ŻYWEJ puli ew_cases — dla DZIŚ (pula jest kompletna do czyszczenia).
     Zwraca strukturę zgodną z trybem zakresu: total/odsiane/obrabialne/zakonczone/pominiete."""
     try:
-        docs = db.collection(col("ew_cases")).limit(8000).get()
+        docs = db.collection(col("ew_cases")).select(ew_case_store.INDEX_FIELDS).limit(8000).get()
     except Exception:
         docs = []
     raw = {x: {"total": 0, "odroczony": 0, "zakonczony": 0, "pominiety": 0} for x in _GRUPA_KEYS}
@@ -749,14 +1111,15 @@ def render_operator_table(d_from, d_to, key_prefix=""):
     # "W toku" — migawka z żywej puli (nie sumujemy po dniach)
     wtoku = {}
     try:
-        for d in db.collection(col("ew_cases")).where("status", "in", ["przydzielony", "w_toku"]).limit(8000).get():
+        for d in (db.collection(col("ew_cases")).where("status", "in", ["przydzielony", "w_toku"])
+                  .select(ew_case_store.INDEX_FIELDS).limit(8000).get()):
             dd = d.to_dict()
             if dd.get("assigned_to"):
                 wtoku[dd["assigned_to"]] = wtoku.get(dd["assigned_to"], 0) + 1
     except Exception:
         # fallback: pełny skan (gdyby filtr 'in' wymagał indeksu w danym projekcie)
         try:
-            for d in db.collection(col("ew_cases")).limit(8000).get():
+            for d in db.collection(col("ew_cases")).select(ew_case_store.INDEX_FIELDS).limit(8000).get():
                 dd = d.to_dict()
                 if dd.get("status") in ("przydzielony", "w_toku") and dd.get("assigned_to"):
                     wtoku[dd["assigned_to"]] = wtoku.get(dd["assigned_to"], 0) + 1
@@ -1133,6 +1496,21 @@ def save_zastepstwa_map(mapa, kto="admin"):
 # ==========================================
 # 📂 ZAKŁADKA: WSADY
 # ==========================================
+def _render_sz_delta(delta):
+    """Podsumowanie delty wsadu szturchacza + szacunek pracy LLM w Generuj."""
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("🆕 Nowe", len(delta["new"]))
+    c2.metric("✏️ Zmienione", len(delta["changed"]))
+    c3.metric("⏸️ Bez zmian", len(delta["unchanged"]))
+    c4.metric("➖ Nieobecne we wsadzie", len(delta["removed"]), help="Zostają w puli — nic nie jest usuwane.")
+    llm = delta["llm"]
+    st.info(f"🤖 Generuj przeliczy do **{llm['zamowienia']}** zamówień z tego wsadu "
+            f"(~{llm['partie']} partii po {EW_BATCH_SIZE}) — plus zakończone z bazy.")
+    if delta["changed"]:
+        with st.expander(f"✏️ Zmienione NrZam ({len(delta['changed'])})", expanded=False):
+            st.text(", ".join(delta["changed"][:200]) + (" …" if len(delta["changed"]) > 200 else ""))
+
+
 with tab_wsady:
     st.subheader("📂 Zarządzanie wsadami")
     st.markdown("**Świnka / Uszki** → nowy plik NADPISUJE poprzedni  \n"
@@ -1142,9 +1520,8 @@ with tab_wsady:
     st.markdown("---")
     st.markdown("### 📊 Aktualny stan wsadów w bazie")
     
-    cur_swinka = load_wsad("swinka")
-    cur_uszki = load_wsad("uszki")
-    cur_szturchacz = load_wsad("szturchacz")
+    cur_swinka, cur_uszki = load_wsady("swinka", "uszki")
+    sz_manifest = load_szturchacz_manifest()  # sam manifest — bloki czytamy tylko do podglądu
     
     cs1, cs2, cs3 = st.columns(3)
     with cs1:
@@ -1153,8 +1530,8 @@ with tab_wsady:
     with cs2:
         st.metric("📦 Uszki", "Załadowane" if cur_uszki else "Brak")
     with cs3:
-        n_sz = count_lines(cur_szturchacz)
-        st.metric("📋 Szturchacz (pula)", f"{n_sz} zamówień" if cur_szturchacz else "Brak")
+        n_sz = len([n for n in sz_manifest["order"] if n != "_RAW_"]) or (1 if sz_manifest["order"] else 0)
+        st.metric("📋 Szturchacz (pula)", f"{n_sz} zamówień" if sz_manifest["order"] else "Brak")
     
     st.markdown("---")
     
@@ -1173,6 +1550,15 @@ with tab_wsady:
                 st.rerun()
             else:
                 st.error("Pole jest puste!")
+        plik_swinka = st.file_uploader("…albo plik świnki:", type=WSAD_UPLOAD_TYPES, key="file_swinka")
+        if plik_swinka is not None and st.button("📂 Załaduj świnkę z pliku", key="btn_file_swinka"):
+            _txt = "\n".join(iter_upload_lines(plik_swinka)).strip()
+            if _txt:
+                save_wsad("swinka", _txt)
+                st.success(f"✅ Świnka załadowana z pliku ({count_lines(_txt)} zamówień). Poprzednia nadpisana.")
+                st.rerun()
+            else:
+                st.error("Plik jest pusty!")
     
     with col_w2:
         st.markdown("**📦 USZKI** (nadpisuje)")
@@ -1184,20 +1570,60 @@ with tab_wsady:
                 st.rerun()
             else:
                 st.error("Pole jest puste!")
+        plik_uszki = st.file_uploader("…albo plik uszek:", type=WSAD_UPLOAD_TYPES, key="file_uszki")
+        if plik_uszki is not None and st.button("📂 Załaduj uszki z pliku", key="btn_file_uszki"):
+            _txt = "\n".join(iter_upload_lines(plik_uszki)).strip()
+            if _txt:
+                save_wsad("uszki", _txt)
+                st.success("✅ Uszki załadowane z pliku. Poprzednie nadpisane.")
+                st.rerun()
+            else:
+                st.error("Plik jest pusty!")
     
     with col_w3:
         st.markdown("**📋 SZTURCHACZ** (dopełnia pulę)")
         wsad_szturchacz = st.text_area("Wklej szturchacza:", height=250, key="input_szturchacz")
+        if st.button("🔍 Podgląd zmian (bez zapisu)", key="btn_szturchacz_delta"):
+            if wsad_szturchacz.strip():
+                _render_sz_delta(szturchacz_delta_preview(
+                    parse_szturchacz_blocks(wsad_szturchacz.strip()).items(), manifest=sz_manifest))
+            else:
+                st.error("Pole jest puste!")
         if st.button("💾 Załaduj szturchacza (dopełnij)", key="btn_szturchacz"):
             if wsad_szturchacz.strip():
-                existing = load_wsad("szturchacz")
-                merged, added, updated, total = merge_szturchacz(existing, wsad_szturchacz.strip())
-                save_wsad("szturchacz", merged)
-                st.success(f"✅ Szturchacz dopełniony — dodano {added} nowych, "
-                           f"zaktualizowano {updated} istniejących. Pula razem: {total} zamówień.")
+                _delta = upsert_szturchacz(wsad_szturchacz.strip())
+                st.success(f"✅ Szturchacz dopełniony — dodano {len(_delta['new'])} nowych, "
+                           f"zmieniono {len(_delta['changed'])} istniejących "
+                           f"({len(_delta['unchanged'])} bez zmian). Pula razem: {_delta['total']} zamówień.")
                 st.rerun()
             else:
                 st.error("Pole jest puste!")
+        # 🟥 Duże pule z pliku: czytanie kawałkami → parser linii → zapis bloków batchami w locie
+        plik_sz = st.file_uploader("…albo plik szturchacza (txt/tsv/csv, także .gz):",
+                                   type=WSAD_UPLOAD_TYPES, key="file_szturchacz")
+        if plik_sz is not None and st.button("🔍 Podgląd zmian z pliku (bez zapisu)", key="btn_file_szturchacz_delta"):
+            _render_sz_delta(szturchacz_delta_preview(
+                szturchacz_parser.iter_blocks_lines(iter_upload_lines(plik_sz)), manifest=sz_manifest))
+        if plik_sz is not None and st.button("📂 Załaduj szturchacza z pliku (dopełnij)", key="btn_file_szturchacz"):
+            _bar = st.progress(0.0, text="Wczytywanie pliku…")
+            _stan = {"frac": 0.0}
+
+            def _on_bytes(frac):
+                _stan["frac"] = frac
+
+            def _on_blocks(n):
+                _bar.progress(min(_stan["frac"], 1.0), text=f"Zapisano {n} bloków…")
+
+            _delta = upsert_szturchacz_blocks(
+                szturchacz_parser.iter_blocks_lines(iter_upload_lines(plik_sz, _on_bytes)),
+                progress=_on_blocks,
+            )
+            _bar.progress(1.0, text="Gotowe")
+            if not (_delta["new"] or _delta["changed"] or _delta["unchanged"]):
+                st.error("W pliku nie znaleziono żadnego NrZam — sprawdź format (NrZam / ZN / numer na początku wiersza).")
+            else:
+                st.success(f"✅ Szturchacz dopełniony z pliku — pula razem: {_delta['total']} zamówień.")
+                _render_sz_delta(_delta)
     
     st.markdown("---")
     
@@ -1210,36 +1636,67 @@ with tab_wsady:
             st.success("🗑️ Wszystkie wsady wyczyszczone (świnka + uszki + szturchacz).")
             st.rerun()
     with col_clr2:
-        if st.button("🗑️ Wyczyść kolejkę casów (ew_cases)"):
-            # Pobierz WSZYSTKIE casy z bazy (nie po batch_id)
-            all_ew = db.collection(col("ew_cases")).limit(5000).get()
-            deleted = 0
-            archived = 0
-            for c in all_ew:
-                cdata = c.to_dict()
-                # Case z nienaprawionym komentarzem → archiwizuj
-                if cdata.get("skip_reason") and not cdata.get("skip_fixed"):
-                    cdata["archived_at"] = firestore.SERVER_TIMESTAMP
-                    cdata["archived_from_batch"] = cdata.get("batch_id", "unknown")
-                    db.collection(col("ew_cases_archived")).document(c.id).set(cdata)
-                    archived += 1
-                db.collection(col("ew_cases")).document(c.id).delete()
-                deleted += 1
-            # Wyczyść też wszystkie batche
-            all_batches = db.collection(col("ew_batches")).get()
-            for bdoc in all_batches:
-                db.collection(col("ew_batches")).document(bdoc.id).delete()
-            msg = f"🗑️ Usunięto {deleted} casów i {len(all_batches)} batchy. Czysta baza."
+        _arc_page = {}  # payloady pominiętych casów bieżącej strony (jeden get_all na stronę)
+
+        def _is_skipped(c):
+            # Case z nienaprawionym komentarzem → archiwizuj
+            d = c.to_dict()
+            return bool(d.get("skip_reason") and not d.get("skip_fixed"))
+
+        def _load_arc_page(snaps):
+            _arc_page.clear()
+            _arc_page.update(ew_case_store.load_payloads(db, [c.reference for c in snaps if _is_skipped(c)]))
+
+        def _archive(writer, c):
+            if not _is_skipped(c):
+                return 0
+            # archiwum trzyma pełny case (indeks + payload) w jednym dokumencie
+            cdata = {**c.to_dict(), **_arc_page.get(c.id, {})}
+            cdata["archived_at"] = firestore.SERVER_TIMESTAMP
+            cdata["archived_from_batch"] = cdata.get("batch_id", "unknown")
+            writer.set(db.collection(col("ew_cases_archived")).document(c.id), cdata)
+            return 1
+
+        def _delete(writer, c):
+            # faza po zapisaniu archiwum — case z nieudaną kopią nie dochodzi tu wcale
+            ew_case_store.delete_case(c.reference, batch=writer)
+            return 2
+
+        def _clear_queue(dry_run):
+            # Wszystkie casy z bazy (nie po batch_id), potem wszystkie batche
+            r = run_bulk_job("clear_ew_cases", db.collection(col("ew_cases")), [_archive, _delete],
+                             "Casy", dry_run=dry_run, before=_load_arc_page)
+            rb = run_bulk_job("clear_ew_batches", db.collection(col("ew_batches")),
+                              lambda w, b: w.delete(b.reference) or 1, "Batche", dry_run=dry_run, select=[])
+            archived = r["phase_ops"][0]
+            return r, rb, archived
+
+        _clr_warn = bulk_job_interrupted("clear_ew_cases") or bulk_job_interrupted("clear_ew_batches")
+        if _clr_warn:
+            st.warning(_clr_warn)
+        _clr_b1, _clr_b2 = st.columns(2)
+        if _clr_b2.button("🔢 Policz (dry-run)", key="_clr_queue_dry"):
+            r, rb, archived = _clear_queue(dry_run=True)
+            st.info(f"Do usunięcia: {r['docs']} casów i {rb['docs']} batchy; "
+                    f"⏭️ {archived} pominiętych trafi do archiwum ({r['ops'] + rb['ops']} zapisów).")
+        if _clr_b1.button("🗑️ Wyczyść kolejkę casów (ew_cases)"):
+            r, rb, archived = _clear_queue(dry_run=False)
+            msg = f"🗑️ Usunięto {r['phase_ops'][1] // 2} casów i {rb['docs']} batchy w {r['seconds'] + rb['seconds']:.1f}s. Czysta baza."
             if archived > 0:
                 msg += f" ⏭️ {archived} pominiętych (nienaprawionych) przeniesiono do archiwum."
-            st.success(msg)
-            st.rerun()
+            if r["failed"] or rb["failed"]:
+                st.error(f"❌ {r['failed'] + rb['failed']} zapisów nieudanych — kliknij ponownie, aby dokończyć.")
+            else:
+                st.success(msg)
+                st.rerun()
     
     # Podgląd
     st.markdown("---")
     with st.expander("👀 Podgląd aktualnej puli szturchacza"):
-        if cur_szturchacz:
-            st.text(cur_szturchacz[:5000] + ("\n\n... (obcięto podgląd)" if len(cur_szturchacz) > 5000 else ""))
+        if sz_manifest["order"]:
+            # podgląd z pierwszych bloków — nie ściągamy całej puli
+            _prev = '\n\n'.join(load_szturchacz_blocks(sz_manifest["order"][:50], manifest=sz_manifest).values())
+            st.text(_prev[:5000] + ("\n\n... (obcięto podgląd)" if len(_prev) > 5000 or len(sz_manifest["order"]) > 50 else ""))
         else:
             st.info("Pula szturchacza jest pusta.")
 
@@ -1252,9 +1709,10 @@ with tab_generuj:
     st.caption("Używa aktualnie załadowanych wsadów z zakładki Wsady")
     
     # Sprawdź co jest załadowane
-    cur_swinka = load_wsad("swinka")
-    cur_uszki = load_wsad("uszki")
-    cur_szturchacz = load_wsad("szturchacz")
+    cur_swinka, cur_uszki = load_wsady("swinka", "uszki")
+    # Szturchacz: tylko manifest — bloki doczytujemy niżej, wyłącznie dla NrZam do przeliczenia
+    sz_manifest = load_szturchacz_manifest()
+    cur_szturchacz = bool(sz_manifest["order"])
     
     s1, s2, s3 = st.columns(3)
     with s1:
@@ -1262,7 +1720,8 @@ with tab_generuj:
     with s2:
         st.metric("📦 Uszki", "✅" if cur_uszki else "⚠️ Opcjonalnie")
     with s3:
-        st.metric("📋 Szturchacz", f"✅ ({count_lines(cur_szturchacz)})" if cur_szturchacz else "❌ Brak")
+        _n_sz = len([n for n in sz_manifest["order"] if n != "_RAW_"]) or 1
+        st.metric("📋 Szturchacz", f"✅ ({_n_sz})" if cur_szturchacz else "❌ Brak")
     
     if not cur_swinka or not cur_szturchacz:
         st.warning("⚠️ Potrzebujesz minimum świnki i szturchacza. Załaduj wsady w zakładce 📂 Wsady.")
@@ -1435,10 +1894,11 @@ with tab_generuj:
         now = datetime.now(tz_pl)
         
         # --- TRYB INKREMENTALNY: sprawdź istniejące casy w bazie ---
-        existing_docs = db.collection(col("ew_cases")).limit(5000).get()
-        existing_cases_map = {}  # NrZam → {status, score, priority_icon, priority_label, naglowek, grupa, ...}
+        existing_docs = db.collection(col("ew_cases")).select(ew_case_store.INDEX_FIELDS).limit(5000).get()
+        existing_cases_map = {}  # NrZam → indeks casa {status, score, grupa, ...} + "_ref"
         for edoc in existing_docs:
             ed = edoc.to_dict()
+            ed["_ref"] = edoc.reference
             enr = ed.get("numer_zamowienia", "")
             if enr:
                 # Priorytet: w_toku > przydzielony > zakonczony > wolny
@@ -1449,20 +1909,37 @@ with tab_generuj:
                 else:
                     existing_cases_map[enr] = ed
         
+        # NrZamy zwinięte w poprzednich generowaniach do reprezentanta (zablokowany klient,
+        # powiazane_nrzam na casie) — dopóki reprezentant nie jest zakończony, nie przeliczamy ich
+        nrzam_pokryte = {}  # NrZam → NrZam reprezentanta
+        for enr, ed in existing_cases_map.items():
+            if ed.get("status") != "zakonczony":
+                for _pnr in ed.get("powiazane_nrzam") or []:
+                    nrzam_pokryte[_pnr] = enr
+        
         # Rozdziel NrZamy z puli szturchacza na kategorie
-        # Używamy tego samego parsera co merge_szturchacz
-        szturchacz_blocks = parse_szturchacz_blocks(cur_szturchacz)
-        szturchacz_nrzams = set(szturchacz_blocks.keys())
+        # NrZamy z manifestu puli (ten sam parser przy zapisie — upsert_szturchacz)
+        szturchacz_nrzams = set(sz_manifest["order"])
         # Usuń klucz _RAW_ jeśli parser nie rozpoznał bloków
         szturchacz_nrzams.discard("_RAW_")
         
+        # Hash bloku w puli (po normalizacji) per NrZam — porównywany z "wsad_norm" zapisanym na casie
+        sz_norm = {n: h for n, h in zip(sz_manifest["order"], sz_manifest["norm"]) if h}
+        
         # Kategorie:
         # DO_PRZELICZENIA: nowe (nie ma w bazie) + zakończone (mogły się zmienić) + wspólne-zakończone
-        # GOTOWE: wolne z bazy (score się nie zmienił) + przydzielone + w_toku
+        #                  + wolne, których blok w puli różni się od bloku z generowania (wsad_norm)
+        # GOTOWE: wolne z bazy (blok bez zmian) + przydzielone + w_toku
         nrzam_do_przeliczenia = set()
         nrzam_gotowe = {}  # NrZam → dane z bazy
+        nrzam_zmienione = set()  # wolne przeliczane z powodu zmiany bloku
+        n_pokryte = 0  # pominięte — zwinięte do żyjącego reprezentanta
         
         for nrzam in szturchacz_nrzams:
+            if nrzam not in existing_cases_map and nrzam in nrzam_pokryte:
+                # Zwinięty do reprezentanta, który wciąż jest w kolejce — wynik reprezentanta obowiązuje
+                n_pokryte += 1
+                continue
             if nrzam not in existing_cases_map:
                 # Nowy case — nie było go w bazie
                 nrzam_do_przeliczenia.add(nrzam)
@@ -1471,6 +1948,13 @@ with tab_generuj:
                 if status == "zakonczony":
                     # Zakończony — przelicz od nowa (operator mógł zmienić dane)
                     nrzam_do_przeliczenia.add(nrzam)
+                elif (status == "wolny" and existing_cases_map[nrzam].get("wsad_norm")
+                      and sz_norm.get(nrzam) not in (None, existing_cases_map[nrzam]["wsad_norm"])):
+                    # Wolny, ale blok w puli jest inny niż ten, z którego go wygenerowano — stary
+                    # score nieaktualny. Case sprzed wsad_norm (albo blok bez norm) = bez zmian;
+                    # hash dostanie przy najbliższym generowaniu.
+                    nrzam_do_przeliczenia.add(nrzam)
+                    nrzam_zmienione.add(nrzam)
                 else:
                     # Wolny / przydzielony / w_toku — gotowy wynik, nie przeliczaj
                     nrzam_gotowe[nrzam] = existing_cases_map[nrzam]
@@ -1491,7 +1975,8 @@ with tab_generuj:
                     st.text(f"...+{len(szturchacz_nrzams)-30} więcej")
             else:
                 st.warning("⚠️ Parser nie znalazł żadnych NrZam! Sprawdź format wsadu szturchacza.")
-                st.text(f"Pierwsze 500 znaków puli:\n{cur_szturchacz[:500]}")
+                _raw = load_szturchacz_blocks(["_RAW_"], manifest=sz_manifest).get("_RAW_", "")
+                st.text(f"Pierwsze 500 znaków puli:\n{_raw[:500]}")
             
             if existing_cases_map:
                 st.text(f"\nCasy w bazie ({len(existing_cases_map)}): {', '.join(sorted(list(existing_cases_map.keys()))[:30])}")
@@ -1499,22 +1984,32 @@ with tab_generuj:
                 st.text("\nBrak casów w bazie (pierwszy wsad).")
             
             st.text(f"\nDo przeliczenia: {len(nrzam_do_przeliczenia)}")
+            if nrzam_zmienione:
+                st.text(f"Wolne z blokiem innym niż przy generowaniu (wsad_norm): {len(nrzam_zmienione)}")
             st.text(f"Gotowe (z bazy): {len(nrzam_gotowe)}")
+            if n_pokryte:
+                st.text(f"Zwinięte do reprezentantów (zablokowani klienci): {n_pokryte}")
         
         # Wyświetl info o trybie
         if is_incremental:
             st.info(
                 f"🔄 **Tryb inkrementalny:**\n"
-                f"- **{len(nrzam_do_przeliczenia)}** zamówień do przeliczenia (nowe + zakończone)\n"
+                f"- **{len(nrzam_do_przeliczenia)}** zamówień do przeliczenia (nowe + zakończone"
+                + (f" + {len(nrzam_zmienione)} wolnych ze zmienionym blokiem" if nrzam_zmienione else "") + ")\n"
                 f"- **{len(nrzam_gotowe)}** zamówień z gotowym wynikiem (wolne/przydzielone/w toku)"
             )
         else:
             st.info(f"🆕 **Pierwszy wsad:** {len(szturchacz_nrzams)} zamówień do przeliczenia od zera.")
         
         # --- Buduj partie zamówień do przeliczenia ---
-        BATCH_SIZE = 60  # max zamówień na jedno wywołanie AI
+        BATCH_SIZE = EW_BATCH_SIZE
         
-        # Zbierz bloki szturchacza do przeliczenia
+        # Zbierz bloki szturchacza do przeliczenia — z bazy tylko te, których potrzebujemy
+        szturchacz_blocks = load_szturchacz_blocks(nrzam_do_przeliczenia & szturchacz_nrzams, manifest=sz_manifest)
+        # Zakończone spoza puli — ich zapisany wsad jest w payloadzie casa
+        _spoza = [existing_cases_map[n]["_ref"] for n in nrzam_do_przeliczenia - szturchacz_nrzams
+                  if n in existing_cases_map]
+        _spoza_payload = ew_case_store.load_payloads(db, _spoza)
         nowe_szturchacz_parts = []
         nrzam_order = []  # zachowaj kolejność
         for nrzam in nrzam_do_przeliczenia:
@@ -1522,13 +2017,49 @@ with tab_generuj:
             if nrzam in szturchacz_blocks:
                 block = szturchacz_blocks[nrzam]
             elif nrzam in existing_cases_map:
-                saved_line = existing_cases_map[nrzam].get("pelna_linia_szturchacza", "")
+                saved_line = _spoza_payload.get(existing_cases_map[nrzam]["_ref"].id, {}).get("pelna_linia_szturchacza", "")
                 if saved_line:
                     block = saved_line
             if block:
                 nowe_szturchacz_parts.append((nrzam, block))
                 nrzam_order.append(nrzam)
         
+        # Cechy bloków (kraj → grupa, email, zablokowany) — zapisane z blokiem w puli; dla
+        # zakończonych spoza puli liczone z zapisanej linii.
+        gen_cechy = load_szturchacz_cechy(nrzam_do_przeliczenia & szturchacz_nrzams, manifest=sz_manifest)
+        for nrzam, block in nowe_szturchacz_parts:
+            if not gen_cechy.get(nrzam):
+                gen_cechy[nrzam] = country_grupa.cechy(block)
+        
+        # === PRE-PASS GENEROWANIA (przed podziałem na partie) ===
+        # Zablokowany klient z kilkoma zamówieniami → do AI idzie JEDEN reprezentant (ten, który
+        # już ma case w bazie, inaczej pierwszy w kolejności puli), reszta NrZam zapisana na jego
+        # casie (powiazane_nrzam) — kolejne generowania ich nie przeliczają, dopóki reprezentant żyje.
+        # Mniej bloków w promptach = mniej tokenów; działa ponad granicami partii.
+        nowe_szturchacz_parts, gen_email_index, gen_powiazane = collapse_generation_blocks(
+            nowe_szturchacz_parts, gen_cechy, existing_cases_map)
+        n_zwiniete = sum(len(v) for v in gen_powiazane.values())
+        if n_zwiniete:
+            st.info(f"🔗 Pre-pass: **{n_zwiniete}** zamówień zablokowanych klientów zwiniętych do "
+                    f"{len(gen_powiazane)} reprezentantów — nie idą do AI.")
+        # Id generowania = hash zamówień i ich bloków po pre-passie. Kontynuacja TEGO SAMEGO
+        # generowania (to samo id) — zachowaj, kogo wcześniejsze partie już zapisały; inne
+        # generowanie (nawet z tą samą liczbą partii) zaczyna od czystego indeksu i postępu.
+        _gen_h = hashlib.blake2b(digest_size=16)
+        for _nr, _blk in nowe_szturchacz_parts:
+            _gen_h.update(f"{_nr}\x00{_blk}\x01".encode("utf-8"))
+        gen_id = _gen_h.hexdigest()
+        same_generation = st.session_state.get("_ew_gen_id") == gen_id
+        if same_generation:
+            for email, wpis in st.session_state.get("_ew_email_index", {}).items():
+                if email in gen_email_index:
+                    gen_email_index[email]["zapisany"] = wpis.get("zapisany")
+        st.session_state["_ew_cechy"] = gen_cechy
+        st.session_state["_ew_email_index"] = gen_email_index
+        st.session_state["_ew_powiazane"] = gen_powiazane
+        st.session_state["_ew_sz_norm"] = sz_norm  # → "wsad_norm" na zapisywanych casach
+        # === KONIEC PRE-PASS ===
+        
         # Podziel na partie
         batches_to_process = []
         for i in range(0, len(nowe_szturchacz_parts), BATCH_SIZE):
@@ -1541,10 +2072,10 @@ with tab_generuj:
             st.stop()
         
         # Zapisz przygotowane partycje do session_state
-        old_total = len(st.session_state.get("_ew_batches_to_process", []))
         st.session_state["_ew_batches_to_process"] = batches_to_process
-        # Resetuj postęp tylko jeśli partycje się zmieniły (inny wsad)
-        if total_batches != old_total:
+        st.session_state["_ew_gen_id"] = gen_id
+        # Resetuj postęp tylko jeśli partycje się zmieniły (inne generowanie)
+        if not same_generation:
             st.session_state["_ew_batches_done"] = 0
             st.session_state["_ew_all_cases"] = []
             st.session_state["_ew_all_raw_outputs"] = []
@@ -1568,34 +2099,40 @@ with tab_generuj:
     def _save_cases_to_db(batch_cases, batch_num, total_batches):
         """Zapisz casy z jednej paczki do bazy natychmiast."""
         
+        # Cechy z puli (Generuj → session_state); case spoza mapy — z jego linii
+        gen_cechy = st.session_state.get("_ew_cechy", {})
+        email_index = st.session_state.setdefault("_ew_email_index", {})
+        powiazane = st.session_state.get("_ew_powiazane", {})
+        sz_norm = st.session_state.get("_ew_sz_norm", {})
+
+        def case_cechy(case):
+            return gen_cechy.get(case.get("numer_zamowienia", "")) or country_grupa.cechy(
+                case.get("pelna_linia_szturchacza", ""))
+
         # === W1: KOMPRESJA ZABLOKOWANYCH KLIENTÓW ===
         # Jeśli case ma "Zablokowany klient" w danych, grupuj po emailu.
         # Z grupy bierz tylko jeden (najwyższy score), resztę oznacz jako zablokowane.
-        def extract_email(text):
-            """Wyciągnij email z pelna_linia_szturchacza"""
-            m = re.search(r'[\w.+-]+@[\w.-]+\.\w+', text)
-            return m.group(0).lower() if m else None
-        
+        # Indeks email → NrZamy jest wspólny dla całego generowania: klient, którego case
+        # zapisała już wcześniejsza partia, nie dostaje drugiego.
         blocked_by_email = {}  # email -> [cases]
         normal_cases = []
         
         for case in batch_cases:
-            linia = case.get("pelna_linia_szturchacza", "")
-            if "zablokowany klient" in linia.lower() or "Zablokowany klient" in linia:
-                email = extract_email(linia)
-                if email:
-                    if email not in blocked_by_email:
-                        blocked_by_email[email] = []
-                    blocked_by_email[email].append(case)
-                else:
-                    normal_cases.append(case)
+            c = case_cechy(case)
+            if c["zablokowany"] and c["email"]:
+                blocked_by_email.setdefault(c["email"], []).append(case)
             else:
                 normal_cases.append(case)
         
-        # Z każdej grupy zablokowanych bierz tylko najwyższy score
+        # Z każdej grupy zablokowanych bierz tylko najwyższy score (o ile inna partia nie zapisała już tego klienta)
         compressed_count = 0
         for email, cases_group in blocked_by_email.items():
             cases_group.sort(key=lambda c: c.get("score", 0), reverse=True)
+            wpis = email_index.setdefault(email, {"nrzamy": [], "zapisany": None})
+            if wpis["zapisany"] and wpis["zapisany"] != cases_group[0].get("numer_zamowienia", ""):
+                compressed_count += len(cases_group)
+                continue
+            wpis["zapisany"] = cases_group[0].get("numer_zamowienia", "")
             normal_cases.append(cases_group[0])  # najwyższy score
             compressed_count += len(cases_group) - 1
         
@@ -1606,46 +2143,12 @@ with tab_generuj:
         # === KONIEC W1 ===
         
         # === W2: KOREKTA GRUPY PO KRAJU ===
-        DE_COUNTRIES = {"germany", "austria", "switzerland", "liechtenstein"}
-        FR_COUNTRIES = {"france", "belgium", "spain", "italy"}
-        # PL = tylko Polska. UK = cała reszta (Luxembourg, Portugal, Sweden, Netherlands, UK, itd.)
-        PL_COUNTRIES = {"poland", "polska", "polen", "pologne"}
-        
-        def detect_country_grupa(text):
-            """Wykryj kraj z pelna_linia_szturchacza i zwróć poprawną grupę.
-            DE/FR/PL — jawne listy. Każdy inny wykryty kraj → UK. Brak kraju → None."""
-            text_lower = text.lower()
-            # Szukaj DE
-            for country in DE_COUNTRIES:
-                if country in text_lower:
-                    return "DE"
-            # Szukaj FR
-            for country in FR_COUNTRIES:
-                if country in text_lower:
-                    return "FR"
-            # Polska → własna grupa PL (wyodrębniona z UK)
-            for country in PL_COUNTRIES:
-                if country in text_lower:
-                    return "PL"
-            # Szukaj znanych krajów → UK
-            known_countries = [
-                "luxembourg", "portugal", "netherlands", "sweden", "denmark",
-                "finland", "norway", "ireland", "united kingdom", "uk", "england",
-                "czech", "slovakia", "hungary", "romania", "bulgaria", "croatia",
-                "slovenia", "greece", "turkey", "serbia", "estonia", "latvia",
-                "lithuania", "malta", "cyprus", "scotland", "wales",
-            ]
-            for country in known_countries:
-                if country in text_lower:
-                    return "UK"
-            # Nie wykryto żadnego kraju
-            return None
-        
+        # country_grupa: DE/FR/PL — jawne listy, każdy inny wykryty kraj → UK, brak kraju → None.
+        # Dopasowanie całych słów ("uk" nie trafia w "bukiet"); cechy bloku policzone przy zapisie puli.
         corrected = 0
         no_country = 0
         for case in batch_cases:
-            linia = case.get("pelna_linia_szturchacza", "")
-            detected = detect_country_grupa(linia)
+            detected = case_cechy(case)["grupa_kraj"]
             if detected:
                 if detected != case.get("grupa") or not case.get("grupa"):
                     case["grupa"] = detected
@@ -1663,7 +2166,7 @@ with tab_generuj:
         batch_id = f"batch_{now.strftime('%Y%m%d_%H%M%S')}_p{batch_num}"
         
         # Pobierz istniejące casy — zbierz WSZYSTKIE doc_id per NrZam (nie tylko jeden)
-        existing_cases_docs = db.collection(col("ew_cases")).limit(5000).get()
+        existing_cases_docs = db.collection(col("ew_cases")).select(["numer_zamowienia", "status"]).limit(5000).get()
         existing_by_nrzam = {}  # NrZam → [{"doc_id": ..., "status": ...}, ...]
         for edoc in existing_cases_docs:
             edata = edoc.to_dict()
@@ -1695,7 +2198,7 @@ with tab_generuj:
             # Usuń WSZYSTKIE stare wolne/zakończone z tym NrZam
             for e in existing_list:
                 if e["status"] in ("wolny", "zakonczony"):
-                    db.collection(col("ew_cases")).document(e["doc_id"]).delete()
+                    ew_case_store.delete_case(db.collection(col("ew_cases")).document(e["doc_id"]))
                     deleted += 1
             
             # ID DETERMINISTYCZNE po numerze → ponowny zapis tego samego numeru NADPISUJE, nie duplikuje.
@@ -1712,7 +2215,7 @@ with tab_generuj:
                 case_status = "zakonczony"
             # data_obrobki (dzień planu) — trwale na casie; baza tabeli wsad-per-dzień.
             _data_obrobki_str = data_obrobki.strftime("%Y-%m-%d") if data_obrobki else None
-            db.collection(col("ew_cases")).document(case_id).set({
+            ew_case_store.write_case(db.collection(col("ew_cases")).document(case_id), {
                 "batch_id": batch_id,
                 "numer_zamowienia": nrzam,
                 "score": case.get("score", 0),
@@ -1724,6 +2227,10 @@ with tab_generuj:
                 "naglowek_priorytetowy": case.get("naglowek_priorytetowy", ""),
                 "status": case_status,
                 "data_obrobki": _data_obrobki_str,
+                # NrZamy zwinięte do tego casu w pre-passie (ten sam zablokowany klient)
+                "powiazane_nrzam": powiazane.get(nrzam, []),
+                # blok puli, z którego liczono ten case — Generuj porównuje z puli (wsad_norm)
+                "wsad_norm": sz_norm.get(nrzam, ""),
                 "assigned_to": None,
                 "assigned_at": None,
                 "completed_at": None,
@@ -1767,8 +2274,7 @@ with tab_generuj:
             st.error("Brak kluczy GCP!")
             return
         
-        cur_swinka = load_wsad("swinka")
-        cur_uszki = load_wsad("uszki")
+        cur_swinka, cur_uszki = load_wsady("swinka", "uszki")
         
         tz_pl = pytz.timezone('Europe/Warsaw')
         now = datetime.now(tz_pl)
@@ -1833,17 +2339,31 @@ Przelicz priorytety dla poniższych zamówień.
                 try:
                     model = GenerativeModel(try_model, system_instruction=WIEZOWIEC_PROMPT)
                     chat = model.start_chat(response_validation=False)
-                    resp = chat.send_message(
+                    # Strumień: casy składane w trakcie generowania (parser przyrostowy),
+                    # postęp widoczny na pasku zamiast czekania na całą odpowiedź
+                    stream_parser = wiezowiec_parser.IncrementalParser()
+                    _parts = []
+                    for chunk in chat.send_message(
                         user_msg,
                         generation_config={"temperature": 0.0, "max_output_tokens": 65536},
                         safety_settings=safety_settings,
-                    )
-                    if resp.candidates:
-                        candidate = resp.candidates[0]
-                        if candidate.content and candidate.content.parts:
-                            ai_text = candidate.content.parts[0].text
-                    else:
-                        ai_text = resp.text
+                        stream=True,
+                    ):
+                        _piece = ""
+                        if chunk.candidates:
+                            candidate = chunk.candidates[0]
+                            if candidate.content and candidate.content.parts:
+                                _piece = candidate.content.parts[0].text
+                        if _piece:
+                            _parts.append(_piece)
+                            if stream_parser.feed(_piece):
+                                progress_bar.progress(
+                                    min(0.95, len(stream_parser.cases) / max(len(batch_chunk), 1)),
+                                    text=f"🏢 Partia {batch_num}/{total_batches}: "
+                                         f"{len(stream_parser.cases)}/{len(batch_chunk)} casów...")
+                    ai_text = "".join(_parts) or None
+                    if ai_text:
+                        stream_parser.close()
                     
                     if ai_text:
                         if is_fallback:
@@ -1878,7 +2398,7 @@ Przelicz priorytety dla poniższych zamówień.
         
         if ai_text:
             all_raw_outputs.append(f"=== PARTIA {batch_num}/{total_batches} ({len(batch_chunk)} zam.) ===\n{ai_text}")
-            batch_cases = parse_wiezowiec_output(ai_text)
+            batch_cases = stream_parser.cases  # złożone w trakcie strumienia (= parse_wiezowiec_output(ai_text))
             all_cases.extend(batch_cases)
             if batch_cases:
                 st.toast(f"✅ Partia {batch_num}: {len(batch_cases)} casów")
@@ -2017,7 +2537,8 @@ Przelicz priorytety dla poniższych zamówień.
                 _ds_plan = data_obrobki.strftime("%Y-%m-%d")
                 if st.session_state.get("_ew_plan_written_for") != _ds_plan:
                     try:
-                        _plan_docs = db.collection(col("ew_cases")).where("data_obrobki", "==", _ds_plan).limit(8000).get()
+                        _plan_docs = (db.collection(col("ew_cases")).where("data_obrobki", "==", _ds_plan)
+                                      .select(ew_case_store.INDEX_FIELDS).limit(8000).get())
                         _plan_count = {g: {"total": 0, "odsiane": 0} for g in ["DE", "FR", "UK", "PL"]}
                         for _pd in _plan_docs:
                             _pdd = _pd.to_dict()
@@ -2183,7 +2704,7 @@ with tab_autopilot:
     st.markdown("### 🛢️ Bak — przeliczone casy w rezerwie per grupa")
     st.caption("Ile casów autopilotem przeliczonych jeszcze czeka na operatorów (wolne + calculated)")
     
-    bak_docs = db.collection(col("ew_cases")).where("status", "==", "wolny").get()
+    bak_docs = db.collection(col("ew_cases")).where("status", "==", "wolny").select(ew_case_store.INDEX_FIELDS).get()
     bak_data = {"DE": {"w_baku": 0, "do_dolania": 0}, "FR": {"w_baku": 0, "do_dolania": 0},
                 "UK": {"w_baku": 0, "do_dolania": 0}, "PL": {"w_baku": 0, "do_dolania": 0}}
     
@@ -2348,6 +2869,33 @@ with tab_autopilot:
         total = ap_status.get("total", 0)
         st.success(f"✅ **Autopilot zakończony** — przeliczono {processed}/{total} casów")
         st.progress(1.0)
+        if FORUM_ENABLED and FORUM_CLIENT.latency_stats():
+            with st.expander("📡 Forum API — czasy odpowiedzi"):
+                _fc = forum_cache_stats()
+                _fc_total = _fc["hit"] + _fc["miss"]
+                st.caption(f"🗃️ Cache GetPostTree: trafienia **{_fc['hit']}** / {_fc_total} "
+                           f"({(100 * _fc['hit'] / _fc_total) if _fc_total else 0:.0f}%), "
+                           f"unieważnione: {_fc['invalidated']}, wpisów: {_fc['entries']}")
+                for _ep, _h in FORUM_CLIENT.latency_stats().items():
+                    st.caption(f"**{_ep}**: {_h['count']} wywołań, śr. {_h['avg']:.2f}s, błędy: {_h['errors']}")
+                    st.bar_chart(pd.Series(_h["buckets"]))
+                # Z logu sesji (ostatnie FORUM_LOG_SIZE wpisów): HTTP + całe odczyty/zapisy z podziałem na strony
+                _ft = forum_log_timings()
+                if _ft:
+                    st.dataframe(pd.DataFrame(_ft).T.round(0), use_container_width=True)
+                _fw = forum_log_records(min_level="WARNING", limit=20)
+                if _fw:
+                    st.caption("⚠️ Ostatnie ostrzeżenia/błędy forum:")
+                    _fw_df = pd.DataFrame(_fw)
+                    _fw_df["ts"] = pd.to_datetime(_fw_df["ts"], unit="s")
+                    st.dataframe(_fw_df, use_container_width=True)
+                # Wątki w tle (indekser, wysyłacz kolejki, prefetch) — bufor procesu, nie sesji
+                _fp = forum_log_records(min_level="WARNING", limit=20, process=True)
+                if _fp:
+                    st.caption("🧵 Ostrzeżenia/błędy wątków w tle (indekser, kolejka forum):")
+                    _fp_df = pd.DataFrame(_fp)
+                    _fp_df["ts"] = pd.to_datetime(_fp_df["ts"], unit="s")
+                    st.dataframe(_fp_df, use_container_width=True)
         if st.button("🔄 Reset (nowa sesja)"):
             set_autopilot_status({"state": "idle", "processed": 0, "total": 0, "current_nrzam": "", "last_error": ""})
             st.rerun()
@@ -2355,43 +2903,77 @@ with tab_autopilot:
     else:  # idle
         st.info("💤 Autopilot nieaktywny. Uruchom z zakładki 'Generuj + Autopilot' lub użyj dolewki powyżej.")
     
+    # --- KOLEJKA FORUM: wpisy, których wysyłacz nie dostarczył ---
+    if FORUM_ENABLED:
+        try:
+            _ob_failed = forum_outbox_failed(db, col)
+        except Exception as _e:
+            _ob_failed = []
+            st.caption(f"⚠️ Kolejka forum niedostępna: {_e}")
+        if _ob_failed:
+            with st.expander(f"📮 Kolejka forum — nieudane wpisy ({len(_ob_failed)})", expanded=True):
+                st.caption("Wpisy nie poszły na forum — flagi casa (woreczek, last_action) NIE zostały ustawione.")
+                for _ob in _ob_failed:
+                    _ob_c1, _ob_c2 = st.columns([6, 1])
+                    _ob_c1.markdown(f"**{_ob.get('numer_zamowienia') or '?'}** → {_ob.get('cel')} "
+                                    f"({_ob.get('user_do') or '—'}), prób: {_ob.get('attempts', 0)} — "
+                                    f"`{str(_ob.get('last_error') or '?')[:200]}`")
+                    if _ob_c2.button("🔁 Ponów", key=f"_ob_retry_{_ob['id']}"):
+                        forum_outbox_retry(db, col, _ob["id"])
+                        st.rerun()
+
     # --- CZYSZCZENIE ---
     st.markdown("---")
     with st.expander("🧹 Zarządzanie przeliczeniami nocnymi"):
         st.caption("Wyczyść nocne przeliczenia (autopilot_messages) z casów w bazie.")
+        def _clear_nocne(writer, doc):
+            d = doc.to_dict()
+            if not (d.get("autopilot_status") or d.get("autopilot_assigned_to")):
+                return 0
+            # rozmowa w payloadzie (i w indeksie starych casów), reszta pól w indeksie
+            ew_case_store.clear_payload(doc.reference, ["autopilot_messages"], {
+                "autopilot_status": firestore.DELETE_FIELD,
+                "autopilot_operator": firestore.DELETE_FIELD,
+                "autopilot_date": firestore.DELETE_FIELD,
+                "autopilot_calculated_at": firestore.DELETE_FIELD,
+                "autopilot_model": firestore.DELETE_FIELD,
+                "autopilot_project": firestore.DELETE_FIELD,
+                "autopilot_assigned_to": firestore.DELETE_FIELD,
+            }, batch=writer)
+            return 2
+
+        def _nocne_job(dry_run):
+            return run_bulk_job("clear_nocne", db.collection(col("ew_cases")), _clear_nocne,
+                                "Przeliczenia nocne", dry_run=dry_run,
+                                select=["autopilot_status", "autopilot_assigned_to"])
+
+        _nocne_warn = bulk_job_interrupted("clear_nocne")
+        if _nocne_warn:
+            st.warning(_nocne_warn)
         col_clean1, col_clean2 = st.columns(2)
         with col_clean1:
             if st.button("🧹 Wyczyść przeliczenia nocne", type="secondary"):
-                all_docs = db.collection(col("ew_cases")).limit(5000).get()
-                cleared = 0
-                for doc in all_docs:
-                    d = doc.to_dict()
-                    if d.get("autopilot_messages") or d.get("autopilot_status") == "calculated":
-                        db.collection(col("ew_cases")).document(doc.id).update({
-                            "autopilot_messages": firestore.DELETE_FIELD,
-                            "autopilot_status": firestore.DELETE_FIELD,
-                            "autopilot_operator": firestore.DELETE_FIELD,
-                            "autopilot_date": firestore.DELETE_FIELD,
-                            "autopilot_calculated_at": firestore.DELETE_FIELD,
-                            "autopilot_model": firestore.DELETE_FIELD,
-                            "autopilot_project": firestore.DELETE_FIELD,
-                            "autopilot_assigned_to": firestore.DELETE_FIELD,
-                        })
-                        cleared += 1
+                r = _nocne_job(dry_run=False)
                 set_autopilot_status({"state": "idle", "processed": 0, "total": 0})
                 try:
                     db.collection(col("autopilot_config")).document("queue").delete()
                 except:
                     pass
-                st.success(f"✅ Wyczyszczono nocne przeliczenia z {cleared} casów.")
-                st.rerun()
+                if r["failed"]:
+                    st.error(f"❌ {r['failed']} zapisów nieudanych — kliknij ponownie, aby dokończyć.")
+                else:
+                    st.success(f"✅ Wyczyszczono nocne przeliczenia z {r['docs']} casów ({r['seconds']:.1f}s).")
+                    st.rerun()
         with col_clean2:
             try:
-                all_docs_check = db.collection(col("ew_cases")).limit(5000).get()
-                with_autopilot = sum(1 for d in all_docs_check if d.to_dict().get("autopilot_status") == "calculated")
+                with_autopilot = bulk_ops.count(
+                    db.collection(col("ew_cases")).where("autopilot_status", "==", "calculated"))
                 st.info(f"🤖 Casów z nocnym przeliczeniem: **{with_autopilot}**")
             except:
                 pass
+            if st.button("🔢 Policz (dry-run)", key="_nocne_dry"):
+                r = _nocne_job(dry_run=True)
+                st.info(f"Do wyczyszczenia: {r['docs']} z {r['scanned']} casów.")
 
     # ===========================================
     # PĘTLA AUTOPILOTA (działa gdy state=running)
@@ -2429,6 +3011,24 @@ with tab_autopilot:
                 st.balloons()
                 st.rerun()
             else:
+                # MODUŁ TELEFONY: odpowiedzi telefonistów dla całego woreczka jednym przebiegiem
+                # (get_all pamięci forum + jeden odczyt na korzeń wątku). Wynik migawki (też „brak")
+                # jest ostateczny — odświeżana co TEL_BULK_TTL, pojedynczo tylko numery spoza migawki.
+                _tel_bulk = {}
+                if FORUM_ENABLED:
+                    _tb = st.session_state.get("_tel_bulk") or {}
+                    if _tb.get("key") != (work_date, total) or time.time() - _tb.get("ts", 0) > TEL_BULK_TTL:
+                        try:
+                            _woreczek = [str(d.to_dict().get("numer_zamowienia") or "") for d in
+                                         db.collection(col("ew_cases")).where("telefon_do_wykonania", "==", True)
+                                         .select(["numer_zamowienia"]).limit(1000).stream()]
+                            _tb = {"key": (work_date, total), "ts": time.time(),
+                                   "answers": check_forum_answers_bulk(db, col, [n for n in _woreczek if n])}
+                        except Exception:
+                            _tb = {"key": (work_date, total), "ts": time.time(), "answers": {}}
+                        st.session_state["_tel_bulk"] = _tb
+                    _tel_bulk = _tb.get("answers", {})
+
                 # Znajdź następny case do przeliczenia (skip pominiętych)
                 idx = processed
                 case_info = None
@@ -2441,6 +3041,8 @@ with tab_autopilot:
                         idx += 1
                         continue
                     case_data = case_doc.to_dict()
+                    if case_data.get("status") == "wolny" and case_data.get("autopilot_status") != "calculated":
+                        case_data = ew_case_store.with_payload(db, case_doc.reference, case_data)
                     if case_data.get("status") != "wolny":
                         st.caption(f"⏭️ {candidate['nrzam']}: status={case_data.get('status')} — pomijam")
                         idx += 1
@@ -2466,7 +3068,9 @@ with tab_autopilot:
                         _tel_ans = {"answered": False}
                         if FORUM_ENABLED:
                             try:
-                                _tel_ans = check_forum_answer(db, col, candidate['nrzam'])
+                                _tel_ans = _tel_bulk.get(str(candidate['nrzam']))
+                                if _tel_ans is None:  # token we wsadzie bez flagi woreczka — spoza migawki
+                                    _tel_ans = check_forum_answer(db, col, candidate['nrzam'])
                             except Exception:
                                 _tel_ans = {"answered": False}
                         if _tel_ans.get("answered"):
@@ -2664,6 +3268,24 @@ zamawianie_kurierow={_ap_kurier_mode}
                                     "bump": _detected_bump_ap,
                                 }
                                 
+                                # Flagi casa zależne od wpisu na forum — przy wpisie w kolejce ustawia je
+                                # wysyłacz dopiero po dostarczeniu (nieudany wpis niczego nie oznacza).
+                                # MODUŁ TELEFONY: autopilot zlecił telefon → wpnij case do woreczka (lustro app operatora).
+                                # ES/IT → brak operatora dzwoniącego → NIE do woreczka (delegacja do telefonistów + zamknięcie).
+                                # telefon_jezyk = REALNY język delegacji (nie grupa!), żeby filtr woreczka po języku działał.
+                                _case_upd_ap = {"last_action_source": "autoszturchacz"}
+                                _case_upd_ts_ap = ["last_action_at"]
+                                if _had_tel_deleg_ap and _tel_lang_ma_operatora_ap:
+                                    _case_upd_ap.update({
+                                        "telefon_do_wykonania": True,
+                                        "telefon_status": "czeka",
+                                        "telefon_zlecil": "autoszturchacz",
+                                        "telefon_pz": _detected_pz_ap or "",
+                                        "telefon_jezyk": _tel_deleg_lang_ap or _grupa_short,
+                                        "telefon_wsad": wsad,
+                                    })
+                                    _case_upd_ts_ap.append("telefon_flagged_at")
+
                                 # PRYWATNOŚĆ (brief §6.3): autopilot = sesja BEZ operatora → user_od=grupa (FromUser, typ 2),
                                 # faktyczny autor = konto AI "chatoszturek" → UserRzeczywisty. AiUser i tak stałe "chatoszturek".
                                 forum_result = execute_forum_actions(
@@ -2676,6 +3298,19 @@ zamawianie_kurierow={_ap_kurier_mode}
                                     diamond_prefix=_COL_PREFIX,
                                     is_diamond_candidate=_is_diamond_ap,
                                     diamond_meta=_diamond_meta_ap,
+                                    outbox={
+                                        "col_fn": col,
+                                        "numer_zamowienia": nrzam,
+                                        # Rejestr telefonów — wysyłacz dopisze wpis po dostarczeniu delegacji
+                                        "phone_log": {
+                                            "zlecil": "chatoszturek (automat)",
+                                            "zlecil_dzwoniacy": False,
+                                            "grupa": str(case_grupa_op or "?").replace("OPERATORZY_", ""),
+                                            "bot": True,
+                                        },
+                                        "case_update": ({"case_id": doc_id, "fields": _case_upd_ap,
+                                                         "timestamps": _case_upd_ts_ap} if doc_id else None),
+                                    },
                                 )
                                 ai_response = forum_result["response"]
                                 autopilot_conversation[-1]["content"] = ai_response
@@ -2683,7 +3318,11 @@ zamawianie_kurierow={_ap_kurier_mode}
                                 # FORUM_WRITE → loguj wyniki + ZAPISZ DO PAMIĘCI
                                 _any_success_e3 = False
                                 for fw in forum_result.get("forum_writes", []):
-                                    if fw.get("success"):
+                                    if fw.get("queued"):
+                                        # Outbox: pamięć forum, rejestr telefonów i flagi casa zapisze
+                                        # wysyłacz po dostarczeniu — tu nic nie oznaczamy
+                                        st.caption(f"  📨 Forum WRITE: w kolejce ({fw.get('cel')}, {fw['outbox_id'][:8]})")
+                                    elif fw.get("success"):
                                         _any_success_e3 = True
                                         _pid_ap = fw.get("new_post_id") or fw.get("FORUM_ID")
                                         st.caption(f"  📤 Forum WRITE: post {_pid_ap or '?'} wysłany")
@@ -2697,40 +3336,13 @@ zamawianie_kurierow={_ap_kurier_mode}
                                             _tr_ap = str(fw.get("tresc_skrot") or "")
                                             _ud_ap = str(fw.get("user_do") or fw.get("fallback_user_do") or "")
                                             if (nrzam and _pid_ap and _ud_ap.lower().startswith("telefoni")):
-                                                _tz_ap = pytz.timezone("Europe/Warsaw")
-                                                _now_ap = datetime.now(_tz_ap)
-                                                _ds_ap = _now_ap.strftime("%Y-%m-%d")
-                                                _nr_ap = str(nrzam).strip()
-                                                # czy w tej sprawie jest już wpis → wtedy PONAGLENIE
-                                                _byl_ap = False
-                                                for _i_ap in range(14):
-                                                    _dd_ap = (_now_ap - timedelta(days=_i_ap)).strftime("%Y-%m-%d")
-                                                    try:
-                                                        _h_ap = db.collection(col("ew_phone_log")).document(_dd_ap) \
-                                                                  .collection("delegacje") \
-                                                                  .where("numer_zamowienia", "==", _nr_ap).limit(5).stream()
-                                                        if any(True for _ in _h_ap):
-                                                            _byl_ap = True
-                                                            break
-                                                    except Exception:
-                                                        pass
-                                                _jest_del_ap = bool(re.search(r"delegacja telefonu", _tr_ap, re.IGNORECASE))
-                                                db.collection(col("ew_phone_log")).document(_ds_ap) \
-                                                  .collection("delegacje").add({
-                                                      "numer_zamowienia": _nr_ap,
-                                                      "typ": ("zlecenie" if (_jest_del_ap and not _byl_ap) else "ponaglenie"),
-                                                      "zlecil": "chatoszturek (automat)",
-                                                      "zlecil_dzwoniacy": False,
-                                                      "grupa": str(case_grupa_op or "?").replace("OPERATORZY_", ""),
-                                                      "do_kogo": _ud_ap,
-                                                      "id_postu": str(_pid_ap),
-                                                      "link": fw.get("link") or "",
-                                                      "tresc": _tr_ap[:300],
-                                                      "data_str": _ds_ap,
-                                                      "godzina": _now_ap.strftime("%H:%M"),
-                                                      "bot": True,
-                                                      "created_at": firestore.SERVER_TIMESTAMP,
-                                                  })
+                                                _deleg_ap, _pl_ap = phone_log_entry(db, col, nrzam, {
+                                                    "zlecil": "chatoszturek (automat)",
+                                                    "zlecil_dzwoniacy": False,
+                                                    "grupa": str(case_grupa_op or "?").replace("OPERATORZY_", ""),
+                                                    "bot": True,
+                                                }, _ud_ap, _pid_ap, fw.get("link"), _tr_ap)
+                                                _deleg_ap.add(_pl_ap)
                                         except Exception:
                                             pass
                                     else:
@@ -2738,29 +3350,11 @@ zamawianie_kurierow={_ap_kurier_mode}
                                 
                                 # --- v1.5.7c: last_action_source w ew_cases (autoszturchacz) ---
                                 # Spójność z patchem szturchacza — tabela 'Stan operatorów' widzi nocne ruchy bota.
+                                # Wpis wysłany od razu (bez kolejki) → flagi casa teraz (+ woreczek, jak wyżej).
                                 if _any_success_e3 and doc_id:
                                     try:
-                                        db.collection(col("ew_cases")).document(doc_id).update({
-                                            "last_action_source": "autoszturchacz",
-                                            "last_action_at": firestore.SERVER_TIMESTAMP,
-                                        })
-                                    except Exception:
-                                        pass  # nie wywróć autopilota
-
-                                # MODUŁ TELEFONY: autopilot zlecił telefon → wpnij case do woreczka (lustro app operatora).
-                                # ES/IT → brak operatora dzwoniącego → NIE do woreczka (delegacja do telefonistów + zamknięcie).
-                                # telefon_jezyk = REALNY język delegacji (nie grupa!), żeby filtr woreczka po języku działał.
-                                if _had_tel_deleg_ap and _tel_lang_ma_operatora_ap and _any_success_e3 and doc_id:
-                                    try:
-                                        db.collection(col("ew_cases")).document(doc_id).update({
-                                            "telefon_do_wykonania": True,
-                                            "telefon_status": "czeka",
-                                            "telefon_zlecil": "autoszturchacz",
-                                            "telefon_pz": _detected_pz_ap or "",
-                                            "telefon_jezyk": _tel_deleg_lang_ap or _grupa_short,
-                                            "telefon_wsad": wsad,
-                                            "telefon_flagged_at": firestore.SERVER_TIMESTAMP,
-                                        })
+                                        db.collection(col("ew_cases")).document(doc_id).update(dict(
+                                            _case_upd_ap, **{k: firestore.SERVER_TIMESTAMP for k in _case_upd_ts_ap}))
                                     except Exception:
                                         pass  # nie wywróć autopilota
                                 
@@ -2806,9 +3400,10 @@ zamawianie_kurierow={_ap_kurier_mode}
                                     break  # Tylko WRITE, bez READ → nie trzeba ponownie pytać AI
                         # --- KONIEC E3 ---
                         
-                        db.collection(col("ew_cases")).document(doc_id).update({
-                            "autopilot_status": "calculated",
+                        ew_case_store.update_payload(db.collection(col("ew_cases")).document(doc_id), {
                             "autopilot_messages": autopilot_conversation,
+                        }, {
+                            "autopilot_status": "calculated",
                             "autopilot_calculated_at": firestore.SERVER_TIMESTAMP,
                             "autopilot_model": used_ap_model,
                             "autopilot_project": project,
@@ -2862,7 +3457,7 @@ with tab_batches:
                     st.metric("Casów", b.get("total_cases", 0))
                     st.caption(f"Prompt: {b.get('prompt_used', '?')} | Model: {b.get('model_used', '?')}")
                 with c2:
-                    batch_cases = db.collection(col("ew_cases")).where("batch_id", "==", bid).get()
+                    batch_cases = db.collection(col("ew_cases")).where("batch_id", "==", bid).select(["status"]).get()
                     sc = {"wolny": 0, "przydzielony": 0, "w_toku": 0, "zakonczony": 0}
                     for c in batch_cases:
                         s = c.to_dict().get("status", "wolny")
@@ -2887,12 +3482,15 @@ with tab_batches:
 with tab_cases:
     st.subheader("📋 Przegląd casów")
     
-    # Pobierz WSZYSTKIE casy raz (dla filtrów i statystyk)
+    # Pobierz WSZYSTKIE casy raz (dla filtrów i statystyk) — sam indeks; treść (wsad, przeliczenie)
+    # doczytywana niżej tylko dla wyświetlanej strony
     try:
-        all_cases_raw = db.collection(col("ew_cases")).order_by("score", direction=firestore.Query.DESCENDING).limit(2000).get()
+        all_cases_raw = (db.collection(col("ew_cases")).select(ew_case_store.INDEX_FIELDS)
+                         .order_by("score", direction=firestore.Query.DESCENDING).limit(2000).get())
     except Exception:
         all_cases_raw = []
     all_cases_data = [(d.id, d.to_dict()) for d in all_cases_raw]
+    _case_refs = {d.id: d.reference for d in all_cases_raw}
     
     # Zbierz unikalne wartości do selectboxów
     all_operators = sorted(set(d.get("assigned_to", "") for _, d in all_cases_data if d.get("assigned_to")))
@@ -2933,7 +3531,10 @@ with tab_cases:
         filtered = [(did, d) for did, d in filtered if d.get("skip_fixed")]
     if f_index and f_index.strip():
         idx_q = f_index.strip().lower()
-        filtered = [(did, d) for did, d in filtered if idx_q in d.get("index_handlowy", "").lower() or idx_q in d.get("pelna_linia_szturchacza", "").lower()]
+        # szukanie także we wsadzie — payloady tylko przy aktywnym wyszukiwaniu
+        _pl = ew_case_store.load_payloads(db, [_case_refs[did] for did, _ in filtered])
+        filtered = [(did, d) for did, d in filtered if idx_q in d.get("index_handlowy", "").lower()
+                    or idx_q in (_pl.get(did, {}).get("pelna_linia_szturchacza") or "").lower()]
     
     if not filtered:
         st.info("Brak casów.")
@@ -2960,7 +3561,7 @@ with tab_cases:
             with col_unk2:
                 if st.button(f"🗑️ Usuń {len(unknown_cases)} UNKNOWN", key="del_unknown"):
                     for did, _ in unknown_cases:
-                        db.collection(col("ew_cases")).document(did).delete()
+                        ew_case_store.delete_case(_case_refs[did])
                     st.success(f"✅ Usunięto {len(unknown_cases)} UNKNOWN z bazy!")
                     st.rerun()
         
@@ -2998,7 +3599,9 @@ with tab_cases:
             end = min(start + PAGE_SIZE, total)
             st.caption(f"Strona {page}/{total_pages} (pozycje {start+1}–{end} z {total})")
         
+        _page_payload = ew_case_store.load_payloads(db, [_case_refs[did] for did, _ in filtered[start:end]])
         for doc_id, c in filtered[start:end]:
+            c = {**c, **_page_payload.get(doc_id, {})}
             smap = {"wolny": "🔵", "przydzielony": "🟡", "w_toku": "🟠", "zakonczony": "🟢", "odroczony": "⏸️", "pominiety": "⏭️"}
             si = smap.get(c.get("status"), "❓")
             ap_mark = "🤖" if c.get("autopilot_status") == "calculated" else ""
@@ -3121,11 +3724,18 @@ with tab_skipped:
         
         # Przycisk wyczyść całe archiwum
         st.markdown("---")
+        # całe archiwum (także ponad 500 wyświetlanych) — BulkWriter, wznawialne
+        _arc_warn = bulk_job_interrupted("clear_archive")
+        if _arc_warn:
+            st.warning(_arc_warn)
         if st.button("🗑️ Wyczyść całe archiwum pominiętych", key="clear_archive"):
-            for doc_id, _ in archived_data:
-                db.collection(col("ew_cases_archived")).document(doc_id).delete()
-            st.success(f"🗑️ Usunięto {len(archived_data)} casów z archiwum.")
-            st.rerun()
+            r = run_bulk_job("clear_archive", db.collection(col("ew_cases_archived")),
+                             lambda w, d: w.delete(d.reference) or 1, "Archiwum", select=[])
+            if r["failed"]:
+                st.error(f"❌ {r['failed']} zapisów nieudanych — kliknij ponownie, aby dokończyć.")
+            else:
+                st.success(f"🗑️ Usunięto {r['docs']} casów z archiwum.")
+                st.rerun()
 
 
 
@@ -3155,6 +3765,7 @@ with tab_prompty:
     with _col_refresh2:
         if st.button("🔄 Odśwież", key="refresh_prompts_list"):
             _fetch_github_prompts.clear()
+            prompt_store.forget()
             st.rerun()
     
     # Gdy lista promptow pusta (np. rate limit GitHub) -> pokaz komunikat (juz wyzej) i POMIN
@@ -4636,15 +5247,11 @@ with tab_telefony:
     # 🟥 FILTR PRZY WYŚWIETLANIU (nie przy zapisie): wpisy niebędące prośbą o telefon
     #    — zmiana kanału, anulowanie, informacja o zakończeniu telefonów — zostają
     #    w bazie, ale nie tworzą wierszy. Błąd w filtrze da złą tabelę, nie utratę danych.
-    _NIE_TELEFON = re.compile(
-        r"kana[łl] telefoniczny wyczerpany|przechodzimy na komunikacj[ęe] pisemn|"
-        r"anulowanie delegacji|telefon nie jest ju[żz] potrzebny|"
-        r"prosimy nie wykonywa[ćc] telefonu|pro[śs]ba o telefon[^\n]{0,20}nieaktualna",
-        re.IGNORECASE)
-
+    #    Wzorce w post_classifier (cecha "nie_telefon") — wynik pamiętany po treści,
+    #    więc kolejne rerendery nie skanują tych samych delegacji od nowa.
     def _jest_telefoniczny(_d):
         _tr = str(_d.get("tresc") or _d.get("tresc_skrot") or "")
-        return not (_tr and _NIE_TELEFON.search(_tr))
+        return not (_tr and post_classifier.classify(_tr)["nie_telefon"])
 
     # 🟥 Numery zamówień, dla których w rejestrze JEST korzeń (typ=zlecenie).
     #    Podbicie sprawy BEZ korzenia musi stworzyć własny wiersz — inaczej nocny wpis
@@ -2,14 +2,24 @@ import requests
 import streamlit as st
 import vertexai
 from vertexai.generative_models import GenerativeModel, ChatSession, Content, Part
-from vertexai.preview import caching as vertex_caching
 import google.auth
 from google.oauth2 import service_account
 from datetime import datetime, timedelta
-import locale, time, json, re, pytz, hashlib, random
+import locale, time, json, re, pytz, hashlib, random, uuid
 import firebase_admin
 from firebase_admin import credentials, firestore
 from streamlit_cookies_manager import EncryptedCookieManager
+import ew_prefetch
+import ew_case_store
+import prompt_store
+import vertex_cache
+
+# --- MODUŁ FORUM (prefetch kontekstu następnego case'a) ---
+try:
+    from forum_module import auto_load_forum_context, start_forum_indexer
+    FORUM_ENABLED = True
+except ImportError:
+    FORUM_ENABLED = False
 
 # --- 0. KONFIGURACJA ŚRODOWISKA ---
 try: locale.setlocale(locale.LC_TIME, "pl_PL.UTF-8")
@@ -84,21 +94,70 @@ def parse_pz(text):
     if match: return match.group(1).upper()
     return None
 
-def log_stats(op_name, start_pz, end_pz, proj_idx):
-    tz_pl = pytz.timezone('Europe/Warsaw')
-    today = datetime.now(tz_pl).strftime("%Y-%m-%d")
-    time_str = datetime.now(tz_pl).strftime("%H:%M")
+# --- STATYSTYKI: jeden batch na akcję ---
+STATS_SHARDS = 8  # key_usage/{dzień} piszą wszyscy operatorzy → licznik rozbity na shardy
+# Stary układ (key_usage/{dzień}.{n}, tablice session_times / completion_times "HH:MM") — domyślnie
+# wyłączony; nowy: suma key_usage/{dzień}/shards/* (read_key_usage) i .../operators/{op}/log/*.
+# True tylko na czas przejścia zewnętrznego zestawienia — gorący dokument dnia idzie wtedy osobnym
+# zapisem, poza batchem akcji (jego rywalizacja nie wywraca statystyk operatora).
+STATS_LEGACY_FIELDS = False
+
+def _stats_day_time():
+    now = datetime.now(pytz.timezone('Europe/Warsaw'))
+    return now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")
+
+def _stats_commit(batch, own):
+    """Commit batcha, jeśli funkcja sama go utworzyła (wołający z własnym batchem commituje sam)."""
+    if own:
+        batch.commit()
+
+def _stats_log_event(batch, coll, today, op_name, kind, time_str):
+    """Append-only log zdarzeń: {coll}/{dzień}/operators/{op}/log/{auto} — zamiast rosnącej tablicy."""
+    ref = (db.collection(coll).document(today).collection("operators").document(op_name)
+           .collection("log").document())
+    batch.set(ref, {"t": time_str, "k": kind})
+
+@st.cache_data(ttl=120, show_spinner=False)
+def read_key_usage(today):
+    """Suma shardów key_usage/{dzień}/shards/* → {"1": n, "2": n, ...} (sesje per klucz projektu)."""
+    totals = {}
+    for shard in db.collection("key_usage").document(today).collection("shards").stream():
+        for k, v in (shard.to_dict() or {}).items():
+            if isinstance(v, (int, float)):
+                totals[k] = totals.get(k, 0) + v
+    return totals
+
+def _stats_legacy_key_usage(today, proj_idx):
+    """Stary licznik key_usage/{dzień} (STATS_LEGACY_FIELDS) — osobny zapis, błąd nie blokuje akcji."""
+    try:
+        db.collection("key_usage").document(today).set({str(proj_idx + 1): firestore.Increment(1)}, merge=True)
+    except Exception as e:
+        print(f"[STATS] key_usage (stary układ): {e}")
+
+def log_stats(op_name, start_pz, end_pz, proj_idx, batch=None):
+    """Statystyki sesji (stats / global_stats / key_usage) — wszystkie zapisy w jednym batchu.
+    batch=None → własny batch + commit; przekazany batch → commit po stronie wołającego.
+    """
+    own = batch is None
+    if own:
+        batch = db.batch()
+    today, time_str = _stats_day_time()
     doc_ref = db.collection("stats").document(today).collection("operators").document(op_name)
-    upd = {
-        "sessions_completed": firestore.Increment(1),
-        "session_times": firestore.ArrayUnion([time_str])
-    }
+    upd = {"sessions_completed": firestore.Increment(1)}
+    if STATS_LEGACY_FIELDS:
+        upd["session_times"] = firestore.ArrayUnion([time_str[:5]])
     if start_pz and end_pz:
         upd[f"pz_transitions.{start_pz}_to_{end_pz}"] = firestore.Increment(1)
         if end_pz == "PZ6":
-            db.collection("global_stats").document("totals").collection("operators").document(op_name).set({"total_diamonds": firestore.Increment(1)}, merge=True)
-    doc_ref.set(upd, merge=True)
-    db.collection("key_usage").document(today).set({str(proj_idx + 1): firestore.Increment(1)}, merge=True)
+            batch.set(db.collection("global_stats").document("totals").collection("operators").document(op_name),
+                      {"total_diamonds": firestore.Increment(1)}, merge=True)
+    batch.set(doc_ref, upd, merge=True)
+    _stats_log_event(batch, "stats", today, op_name, "session", time_str)
+    shard = db.collection("key_usage").document(today).collection("shards").document(str(random.randrange(STATS_SHARDS)))
+    batch.set(shard, {str(proj_idx + 1): firestore.Increment(1)}, merge=True)
+    _stats_commit(batch, own)
+    if STATS_LEGACY_FIELDS:
+        _stats_legacy_key_usage(today, proj_idx)
 
 
 # ==========================================
@@ -111,14 +170,23 @@ OPERATORS_TEL = {
     "EwelinaG": False, "Andrzej": False, "Romana": False,
 }
 
-def ew_get_next_case(grupa, op_name):
-    """Pobiera najwyższy wolny case z grupy wg priorytetów:
+def _col_prod(name):
+    """Koordynator pracuje na kolekcjach bez prefiksu (col_fn dla forum_module)."""
+    return name
+
+# Indeks NrZam → wpisy forum dla zimnej ścieżki auto_load_forum_context (raz na proces)
+if FORUM_ENABLED:
+    start_forum_indexer(db, _col_prod)
+
+def _ew_pick_candidate(grupa, op_name, skipped_ids):
+    """Wybiera najwyższy wolny case z grupy wg priorytetów (BEZ rezerwacji):
     1. Moje przeliczone (autopilot_assigned_to == ja)
     2. Cudze przeliczone, pełna zgodność TEL (TEL→TEL, nieTEL→nieTEL)
     3. Nieprzeliczone z mojej grupy
     4. Cudze przeliczone, jednostronna zgodność (TEL może wziąć nieTEL, ale nie odwrotnie)
+    Nie dotyka st.session_state — wołane też z wątku prefetchu.
+    Zwraca DocumentSnapshot albo None.
     """
-    skipped_ids = st.session_state.get("ew_skipped_ids", set())
     my_tel = OPERATORS_TEL.get(op_name, False)
     
     # Pobierz wszystkie wolne z mojej grupy (jedno query, filtrowanie po stronie klienta)
@@ -127,6 +195,7 @@ def ew_get_next_case(grupa, op_name):
              .where("grupa", "==", grupa)
              .where("status", "==", "wolny")
              .order_by("score", direction=firestore.Query.DESCENDING)
+             .select(ew_case_store.INDEX_FIELDS)
              .limit(100))
         all_free = [d for d in q.get() if d.id not in skipped_ids]
     except Exception:
@@ -163,25 +232,161 @@ def ew_get_next_case(grupa, op_name):
             prio3.append(d)
     
     # Wybierz wg priorytetów
-    doc = None
     for candidates in [prio1, prio2, prio3, prio4]:
         if candidates:
-            doc = candidates[0]  # najwyższy score (już posortowane)
-            break
-    
-    if not doc:
+            return candidates[0]  # najwyższy score (już posortowane)
+    return None
+
+def _ew_reserve(doc_id, op_name, expected_update_time=None, payload=None):
+    """Rezerwuje case w transakcji — tylko jeśli nadal 'wolny'.
+    expected_update_time (z prefetchu): jeśli dokument zmienił się od odczytu w tle → odrzuć.
+    payload (z prefetchu) — treść casa; bez niego doczytywana po rezerwacji.
+    Zwraca dict casa (z _doc_id, z treścią) albo None (ktoś był szybszy / case zmieniony).
+    """
+    ref = db.collection("ew_cases").document(doc_id)
+
+    @firestore.transactional
+    def _txn(transaction):
+        snap = ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        data = snap.to_dict() or {}
+        if data.get("status", "wolny") != "wolny":
+            return None
+        if expected_update_time is not None and snap.update_time != expected_update_time:
+            return None
+        transaction.update(ref, {
+            "status": "przydzielony",
+            "assigned_to": op_name,
+            "assigned_at": firestore.SERVER_TIMESTAMP,
+        })
+        data["_doc_id"] = doc_id
+        return data
+
+    try:
+        data = _txn(db.transaction())
+    except Exception as e:
+        print(f"[EW] Rezerwacja {doc_id} nieudana: {e}")
         return None
-    
-    # Zarezerwuj atomowo
-    db.collection("ew_cases").document(doc.id).update({
-        "status": "przydzielony",
-        "assigned_to": op_name,
-        "assigned_at": firestore.SERVER_TIMESTAMP,
-    })
-    data = doc.to_dict()
-    data["_doc_id"] = doc.id
+    if data is not None:
+        if payload is not None:
+            data.update(payload)
+        else:
+            ew_case_store.with_payload(db, ref, data)
     return data
 
+def _ew_forum_preview(nrzam):
+    """Podgląd kontekstu forum casa — tylko odczyt (bez skanu i zapisu high-water), ten sam
+    dla casa z prefetchu i z kliknięcia."""
+    if not (FORUM_ENABLED and nrzam):
+        return ""
+    try:
+        return auto_load_forum_context(db, _col_prod, nrzam, persist=False) or ""
+    except Exception as e:
+        print(f"[EW] forum ctx {nrzam}: {e}")
+        return ""
+
+def _ew_full_prompt(system_prompt, tryb, notag, analizbior):
+    """System prompt + PARAMETRY STARTOWE — ten sam tekst (a więc i klucz cache Vertex) w czacie
+    i przy rozgrzewaniu modelu w prefetchu."""
+    now = datetime.now(pytz.timezone('Europe/Warsaw'))
+    return system_prompt + f"""
+# PARAMETRY STARTOWE
+domyslny_operator={op_name}
+domyslna_data={now.strftime('%d.%m')}
+Grupa_Operatorska={cfg.get('role', 'Operatorzy_DE')}
+domyslny_tryb={tryb}
+notag={"TAK" if notag else "NIE"}
+analizbior={"TAK" if analizbior else "NIE"}
+"""
+
+def _ew_warm_model(warm):
+    """Rozgrzewa współdzielony CachedContent (vertex_cache) pod następny case — create() nie czeka
+    wtedy na pierwszą odpowiedź AI. warm: parametry promptu zebrane w wątku głównym."""
+    system_prompt = prompt_store.get(warm["prompt_url"]) if warm.get("prompt_url") else ""
+    if not system_prompt:
+        return
+    vertex_cache.acquire(current_gcp_project, warm["model_id"],
+                         _ew_full_prompt(system_prompt, warm["tryb"], warm["notag"], warm["analizbior"]),
+                         warm["holder"])
+
+def _ew_prefetch_loader(grupa, op_name, skipped_ids, warm=None):
+    """Buduje pakiet następnego case'a w tle: kandydat + podgląd kontekstu forum (tylko odczyt)
+    + rozgrzany model z cache. Bez rezerwacji — ta dopiero przy kliknięciu (transakcja w ew_get_next_case).
+    """
+    skipped_ids = set(skipped_ids)
+    doc = _ew_pick_candidate(grupa, op_name, skipped_ids)
+    if not doc:
+        return None
+    data = doc.to_dict() or {}
+    nrzam = str(data.get("numer_zamowienia", "") or "").strip()
+    bundle = {
+        "doc_id": doc.id,
+        "update_time": doc.update_time,
+        # treść casa (wsad, przeliczenie) — aktualna, dopóki update_time się zgadza
+        # (autopilot zapisuje rozmowę razem ze zmianą indeksu)
+        "payload": ew_case_store.load_payloads(db, [doc.reference]).get(doc.id),
+        "grupa": grupa,
+        "skipped_ids": skipped_ids,
+        "nrzam": nrzam,
+        "forum_ctx": _ew_forum_preview(nrzam),
+    }
+    if warm:
+        try:
+            _ew_warm_model(warm)
+        except Exception as e:
+            print(f"[EW_PREFETCH] cache modelu: {e}")  # czat sam utworzy cache albo pójdzie bez
+    return bundle
+
+def ew_schedule_prefetch(grupa, op_name, current_doc_id, tryb):
+    """Odpala w tle przygotowanie następnego case'a (gdy operator pracuje nad bieżącym).
+    Parametry rozgrzania modelu czytane tutaj — wątek w tle nie dotyka st.session_state."""
+    skipped = set(st.session_state.get("ew_skipped_ids", set()))
+    skipped.add(current_doc_id)  # bieżący case nie może być swoim następcą
+    warm = None
+    if caching_enabled and st.session_state.get("_ew_active_model"):
+        if "_vertex_cache_holder" not in st.session_state:
+            st.session_state._vertex_cache_holder = uuid.uuid4().hex
+        warm = {
+            "prompt_url": PROMPT_URL,
+            "model_id": st.session_state._ew_active_model,
+            "tryb": tryb,
+            "notag": st.session_state.get("notag_val", True),
+            "analizbior": st.session_state.get("analizbior_val", False),
+            "holder": st.session_state._vertex_cache_holder,
+        }
+    ew_prefetch.schedule(op_name,
+                         lambda: _ew_prefetch_loader(grupa, op_name, skipped, warm),
+                         tag=current_doc_id)
+
+def ew_get_next_case(grupa, op_name):
+    """Pobiera najwyższy wolny case z grupy (priorytety: _ew_pick_candidate) i rezerwuje go.
+    Najpierw próbuje pakietu z prefetchu (walidacja w transakcji), potem zwykła ścieżka.
+    """
+    skipped_ids = st.session_state.get("ew_skipped_ids", set())
+
+    # 1. Pakiet przygotowany w tle
+    bundle = ew_prefetch.take(op_name)
+    if (bundle and bundle.get("grupa") == grupa
+            and bundle["doc_id"] not in skipped_ids
+            and set(skipped_ids) <= bundle.get("skipped_ids", set())):
+        data = _ew_reserve(bundle["doc_id"], op_name, bundle.get("update_time"), bundle.get("payload"))
+        if data:
+            data["_forum_ctx"] = bundle.get("forum_ctx", "")
+            return data
+
+    # 2. Zwykła ścieżka — kilka prób (ktoś mógł zarezerwować przed nami)
+    lost = set()
+    for _ in range(3):
+        doc = _ew_pick_candidate(grupa, op_name, set(skipped_ids) | lost)
+        if not doc:
+            return None
+        data = _ew_reserve(doc.id, op_name)
+        if data:
+            return data
+        lost.add(doc.id)
+    return None
+
 def ew_restore_active_case(grupa, op_name):
     """Sprawdź czy operator ma aktywny case (przydzielony/w_toku) — odporność na odświeżenie strony."""
     try:
@@ -193,7 +398,7 @@ def ew_restore_active_case(grupa, op_name):
             data = doc.to_dict()
             if data.get("status") in ("przydzielony", "w_toku"):
                 data["_doc_id"] = doc.id
-                return data
+                return ew_case_store.with_payload(db, doc.reference, data)
     except Exception:
         pass
     return None
@@ -218,17 +423,22 @@ def ew_count_available(grupa):
     return len(db.collection("ew_cases")
                .where("grupa", "==", grupa)
                .where("status", "==", "wolny")
+               .select(["status"])
                .limit(500).get())
 
-def ew_log_completion(op_name):
-    """Loguj zakończenie casa do statystyk Wieżowca"""
-    tz_pl = pytz.timezone('Europe/Warsaw')
-    today = datetime.now(tz_pl).strftime("%Y-%m-%d")
-    time_str = datetime.now(tz_pl).strftime("%H:%M")
-    db.collection("ew_operator_stats").document(today).collection("operators").document(op_name).set({
-        "cases_completed": firestore.Increment(1),
-        "completion_times": firestore.ArrayUnion([time_str]),
-    }, merge=True)
+def ew_log_completion(op_name, batch=None):
+    """Loguj zakończenie casa do statystyk Wieżowca (licznik + wpis w append-only logu)."""
+    own = batch is None
+    if own:
+        batch = db.batch()
+    today, time_str = _stats_day_time()
+    upd = {"cases_completed": firestore.Increment(1)}
+    if STATS_LEGACY_FIELDS:
+        upd["completion_times"] = firestore.ArrayUnion([time_str[:5]])
+    batch.set(db.collection("ew_operator_stats").document(today).collection("operators").document(op_name),
+              upd, merge=True)
+    _stats_log_event(batch, "ew_operator_stats", today, op_name, "case", time_str)
+    _stats_commit(batch, own)
 
 def detect_tag_in_response(text):
     """Wykryj tag C# lub TAG-KOPERTA w odpowiedzi AI"""
@@ -250,41 +460,115 @@ def detect_tag_in_response(text):
         return m.group(1), parse_pz(text)
     return None, None
 
-def ew_find_case_by_nrzam(nrzam, op_name):
-    """Szuka case'a po NrZam w bazie ew_cases. Rezerwuje jeśli wolny."""
-    results = db.collection("ew_cases").where("numer_zamowienia", "==", nrzam).limit(5).get()
-    if not results:
-        return None, "not_found"
-    
-    # Znajdź najlepszy case (priorytet: wolny > przydzielony do mnie > inne)
+def _ew_case_id(nrzam):
+    """Deterministyczne ID casa — identyczne jak w _save_cases_to_db (app.py)."""
+    return "ew_" + re.sub(r'[/\\.#$\[\]]', '_', nrzam)
+
+def _ew_pick_by_status(snaps, op_name):
+    """Z casów jednego NrZam wybierz najlepszy (wolny > przydzielony do mnie > zajęty > zakończony).
+    Zwraca (snapshot, status) albo (None, "not_found").
+    """
     best = None
-    best_status = None
-    for doc in results:
-        data = doc.to_dict()
-        data["_doc_id"] = doc.id
+    best_status = "not_found"
+    for snap in snaps:
+        data = snap.to_dict() or {}
         status = data.get("status", "wolny")
-        
         if status == "wolny":
-            # Zarezerwuj atomowo
-            db.collection("ew_cases").document(doc.id).update({
-                "status": "przydzielony",
-                "assigned_to": op_name,
-                "assigned_at": firestore.SERVER_TIMESTAMP,
-            })
-            return data, "reserved"
+            return snap, "reserved"
         elif status in ("przydzielony", "w_toku") and data.get("assigned_to") == op_name:
-            # Już przydzielony do mnie
-            return data, "already_mine"
+            return snap, "already_mine"
         elif status in ("przydzielony", "w_toku"):
-            best = data
-            best_status = "taken_by_other"
+            best, best_status = snap, "taken_by_other"
         elif status == "zakonczony":
             if not best:
-                best = data
-                best_status = "completed"
-    
+                best, best_status = snap, "completed"
     return best, best_status
 
+def _ew_lookup_refs(nrzams):
+    """NrZam → lista referencji casów. Najpierw bezpośredni get po deterministycznym ID
+    (jedno get_all dla całej listy), dla brakujących — indeks po polu numer_zamowienia
+    (stare ID w stylu batch_XX_0001), zapytania 'in' po 30 wartości. Na końcu NrZam zwinięte
+    przy generowaniu (ten sam zablokowany klient) → case reprezentanta (powiazane_nrzam).
+    """
+    refs = {n: db.collection("ew_cases").document(_ew_case_id(n)) for n in nrzams}
+    found = {n: [] for n in nrzams}
+    by_path = {r.path: n for n, r in refs.items()}
+    for snap in db.get_all(list(refs.values()), field_paths=["status"]):
+        if snap.exists:
+            found[by_path[snap.reference.path]].append(snap.reference)
+    missing = [n for n in nrzams if not found[n]]
+    for i in range(0, len(missing), 30):
+        chunk = missing[i:i + 30]
+        for doc in db.collection("ew_cases").where("numer_zamowienia", "in", chunk).select(["numer_zamowienia"]).get():
+            n = str(doc.to_dict().get("numer_zamowienia", ""))
+            if n in found and len(found[n]) < 5:
+                found[n].append(doc.reference)
+    missing = [n for n in nrzams if not found[n]]
+    for i in range(0, len(missing), 30):
+        chunk = missing[i:i + 30]
+        for doc in (db.collection("ew_cases").where("powiazane_nrzam", "array_contains_any", chunk)
+                    .select(["powiazane_nrzam"]).get()):
+            for n in set(chunk) & set(doc.to_dict().get("powiazane_nrzam") or []):
+                if len(found[n]) < 5:
+                    found[n].append(doc.reference)
+    return found
+
+def ew_find_cases_by_nrzam(nrzams, op_name):
+    """Wersja zbiorcza: rozwiązuje kilka NrZam naraz i rezerwuje wolne w JEDNEJ transakcji.
+    Zwraca listę (nrzam, data|None, status) w kolejności wejścia — statusy jak ew_find_case_by_nrzam.
+    """
+    nrzams = list(dict.fromkeys(n.strip() for n in nrzams if n and n.strip()))
+    if not nrzams:
+        return []
+    found = _ew_lookup_refs(nrzams)
+    # reprezentant zwiniętych NrZam może się powtórzyć — jeden odczyt/rezerwacja na dokument
+    all_refs = list({r.path: r for refs in found.values() for r in refs}.values())
+    if not all_refs:
+        return [(n, None, "not_found") for n in nrzams]
+
+    @firestore.transactional
+    def _txn(transaction):
+        snaps = {snap.reference.path: snap for snap in transaction.get_all(all_refs) if snap.exists}
+        out = []
+        reserved = set()
+        for n in nrzams:
+            snap, status = _ew_pick_by_status([snaps[r.path] for r in found[n] if r.path in snaps], op_name)
+            if snap and status == "reserved" and snap.reference.path in reserved:
+                status = "already_mine"
+            data = None
+            if snap:
+                data = snap.to_dict() or {}
+                data["_doc_id"] = snap.id
+                if str(data.get("numer_zamowienia", "")) != n:
+                    data["_szukany_nrzam"] = n  # NrZam zwinięty do casu reprezentanta
+                if status == "reserved":
+                    reserved.add(snap.reference.path)
+                    transaction.update(snap.reference, {
+                        "status": "przydzielony",
+                        "assigned_to": op_name,
+                        "assigned_at": firestore.SERVER_TIMESTAMP,
+                    })
+            out.append((n, data, status))
+        return out
+
+    results = _txn(db.transaction())
+    # treść casów (wsad) — po transakcji, jednym get_all
+    by_id = {r.id: r for refs in found.values() for r in refs}
+    refs = [by_id[d["_doc_id"]] for _, d, _ in results if d and d["_doc_id"] in by_id]
+    payloads = ew_case_store.load_payloads(db, refs)
+    for _, data, _ in results:
+        if data:
+            data.update(payloads.get(data["_doc_id"], {}))
+    return results
+
+def ew_find_case_by_nrzam(nrzam, op_name):
+    """Szuka case'a po NrZam w bazie ew_cases. Rezerwuje (transakcyjnie) jeśli wolny."""
+    results = ew_find_cases_by_nrzam([nrzam], op_name)
+    if not results:
+        return None, "not_found"
+    _, data, status = results[0]
+    return data, status
+
 
 # ==========================================
 # INICJALIZACJA STANÓW EW
@@ -313,42 +597,19 @@ caching_enabled = global_cfg.get("context_caching_enabled", False)
 # --- CONTEXT CACHING HELPER ---
 def get_or_create_cached_model(model_id, system_prompt):
     """
-    Tworzy lub pobiera cache'owany model z Vertex AI Context Caching.
-    Cache żyje 60 min (TTL). Klucz: hash(model_id + prompt).
+    Pobiera cache'owany model z Vertex AI Context Caching ze wspólnego rejestru procesu
+    (vertex_cache) — wszystkie sesje na tym samym projekcie/modelu/prompcie dzielą jeden cache.
+    Cache żyje 60 min (TTL), odnawiany przed wygaśnięciem. Klucz: (projekt, model, sha256 promptu).
     Zwraca GenerativeModel z from_cached_content lub None jeśli błąd.
     """
-    import hashlib
-    from datetime import timedelta as td
-    
-    cache_key = hashlib.md5(f"{model_id}:{system_prompt[:500]}".encode()).hexdigest()[:12]
-    session_key = f"vertex_cache_{cache_key}"
-    
-    # Sprawdź czy mamy aktywny cache w sesji
-    cached_name = st.session_state.get(session_key)
-    if cached_name:
-        try:
-            cached_content = vertex_caching.CachedContent(cached_content_name=cached_name)
-            # Sprawdź czy cache nie wygasł
-            model = GenerativeModel.from_cached_content(cached_content=cached_content)
-            return model
-        except Exception:
-            # Cache wygasł lub nie istnieje — tworzymy nowy
-            st.session_state.pop(session_key, None)
-    
-    # Twórz nowy cache
+    if "_vertex_cache_holder" not in st.session_state:
+        st.session_state._vertex_cache_holder = uuid.uuid4().hex
     try:
-        cached_content = vertex_caching.CachedContent.create(
-            model_name=model_id,
-            system_instruction=system_prompt,
-            contents=[],  # pusty — cachujemy tylko system prompt
-            ttl=td(minutes=60),
-            display_name=f"ew-{cache_key}",
-        )
-        st.session_state[session_key] = cached_content.name
-        model = GenerativeModel.from_cached_content(cached_content=cached_content)
-        return model
+        return vertex_cache.acquire(current_gcp_project, model_id, system_prompt,
+                                    st.session_state._vertex_cache_holder)
     except Exception as e:
         # Fallback — zwykły model bez cache
+        vertex_cache.invalidate(current_gcp_project, model_id, system_prompt)
         st.toast(f"⚠️ Cache niedostępny: {str(e)[:100]}. Tryb normalny.")
         return None
 
@@ -356,6 +617,11 @@ with st.sidebar:
     st.title(f"👤 {op_name}")
 
     st.markdown(f"**🔑 Projekt:** `{current_gcp_project}`")
+    try:
+        _key_today = read_key_usage(datetime.now(pytz.timezone('Europe/Warsaw')).strftime("%Y-%m-%d"))
+        st.caption(f"Sesje na tym kluczu dziś: **{int(_key_today.get(str(project_index + 1), 0))}**")
+    except Exception:
+        pass
     st.markdown(f"**📄 Prompt:** `{PROMPT_NAME}`")
     st.markdown("---")
 
@@ -418,6 +684,14 @@ with st.sidebar:
         autopilot_label = " 🤖" if case.get("autopilot_status") == "calculated" else ""
         st.info(f"📌 Case: **{case.get('numer_zamowienia', '?')}**{reverse_label}{autopilot_label}\n"
                 f"{case.get('priority_icon', '')} [{case.get('score', 0)}]")
+        if case.get("_szukany_nrzam"):
+            st.caption(f"🔗 Szukany NrZam **{case['_szukany_nrzam']}** jest obsługiwany w tym casie "
+                       f"(ten sam zablokowany klient).")
+        if case.get("powiazane_nrzam"):
+            st.caption(f"🔗 Powiązane zamówienia (ten sam zablokowany klient): "
+                       f"**{', '.join(case['powiazane_nrzam'])}**")
+        if is_reverse and st.session_state.get("ew_reverse_queue"):
+            st.caption(f"📋 W kolejce NrZam: **{len(st.session_state.ew_reverse_queue)}**")
         if case.get("autopilot_status") == "calculated":
             if is_reverse:
                 st.caption(f"🤖 Przeliczone nocą, ale tryb **{case.get('_reverse_type', '')}** → start od zera (nowa instancja kanałowa)")
@@ -425,6 +699,20 @@ with st.sidebar:
                 st.caption("🤖 Pierwszy ruch przeliczony — kliknij ▶️ by załadować gotową analizę")
             else:
                 st.caption("🤖 Przeliczone nocą (autopilot OFF — będzie liczone od zera)")
+        if "_forum_ctx" not in case and FORUM_ENABLED:
+            # case spoza prefetchu (pierwszy, odświeżenie, tryb odwrotny) — podgląd na żądanie,
+            # żeby główna ścieżka operatora nie czekała na forum
+            if st.button("📖 Wczytaj podgląd forum", key=f"ew_forum_preview_{case.get('_doc_id', '')}"):
+                case["_forum_ctx"] = _ew_forum_preview(str(case.get("numer_zamowienia", "") or "").strip())
+                if not case["_forum_ctx"]:
+                    st.caption("📖 Brak wpisów forum dla tego zamówienia.")
+        if case.get("_forum_ctx"):
+            with st.expander("📖 Forum"):
+                st.text(case["_forum_ctx"])
+
+        # PREFETCH: póki operator pracuje nad tym casem, w tle szykujemy następny
+        if not is_reverse and case.get("_doc_id"):
+            ew_schedule_prefetch(operator_grupa, op_name, case["_doc_id"], wybrany_tryb_kod)
 
         # Przycisk: ROZPOCZNIJ CASE (tylko gdy chat nie jest uruchomiony)
         if not st.session_state.get("chat_started"):
@@ -512,14 +800,22 @@ with st.sidebar:
                 # Loguj statystyki + diamenty
                 start_pz = st.session_state.get("current_start_pz", None)
                 end_pz = pz  # PZ z TAGu końcowego
-                proj_idx = st.session_state.get("current_project_idx", 0)
-                log_stats(op_name, start_pz, end_pz, proj_idx)
-                ew_log_completion(op_name)
+                proj_idx = st.session_state.get("current_project_idx", project_index)
+                stats_batch = db.batch()  # jeden commit na kliknięcie
+                log_stats(op_name, start_pz, end_pz, proj_idx, batch=stats_batch)
+                ew_log_completion(op_name, batch=stats_batch)
+                stats_batch.commit()
                 st.session_state.messages = []
                 st.session_state.chat_started = False
                 st.session_state.current_start_pz = None
                 st.session_state._autopilot_loaded = False
-                new_case = ew_get_next_case(operator_grupa, op_name)
+                reverse_queue = st.session_state.get("ew_reverse_queue") or []
+                if is_reverse and reverse_queue:
+                    # Zbiorcza rezerwacja NrZam — następny z listy operatora
+                    new_case = reverse_queue.pop(0)
+                    st.session_state.ew_reverse_queue = reverse_queue
+                else:
+                    new_case = ew_get_next_case(operator_grupa, op_name)
                 st.session_state.ew_current_case = new_case
                 st.session_state.ew_wsad_ready = ""
                 if new_case:
@@ -569,6 +865,33 @@ with st.sidebar:
                         st.session_state.ew_reverse_manual_wsad = ""
                 else:
                     st.error("Podaj numer zamówienia!")
+
+            # Wersja zbiorcza — kilka NrZam naraz (jedno get_all + jedna transakcja)
+            with st.expander("📋 Kilka NrZam naraz"):
+                bulk_input = st.text_area("Wklej NrZam (po przecinku / spacji / w liniach):", key="ew_reverse_bulk", height=100)
+                if st.button(f"🔍 Rezerwuj wszystkie ({wybrany_tryb_kod})", key="ew_reverse_bulk_btn"):
+                    bulk_nrzams = [n for n in re.split(r'[\s,;]+', bulk_input or "") if n]
+                    if not bulk_nrzams:
+                        st.error("Podaj numery zamówień!")
+                    else:
+                        results = ew_find_cases_by_nrzam(bulk_nrzams, op_name)
+                        mine = []
+                        for n, data, status in results:
+                            if status in ("reserved", "already_mine"):
+                                data["_reverse_mode"] = True
+                                data["_reverse_type"] = wybrany_tryb_kod
+                                mine.append(data)
+                            elif status == "taken_by_other":
+                                st.warning(f"⚠️ **{n}** — przydzielony do: **{data.get('assigned_to', '?')}**")
+                            elif status == "completed":
+                                st.info(f"ℹ️ **{n}** — zakończony")
+                            else:
+                                st.warning(f"🔍 **{n}** — nie znaleziono")
+                        if mine:
+                            st.session_state.ew_current_case = mine[0]
+                            st.session_state.ew_reverse_queue = mine[1:]
+                            st.success(f"✅ Zarezerwowano {len(mine)} case'ów — zaczynamy od **{mine[0].get('numer_zamowienia', '?')}**")
+                            st.rerun()
             
             # Pole do wklejenia wsadu ręcznie (gdy case nie znaleziony / zajęty / zakończony)
             manual_nrzam = st.session_state.get("ew_reverse_manual_nrzam", "")
@@ -652,6 +975,7 @@ with st.sidebar:
     # Zamień label z powrotem na ID
     label_to_id = {v: k for k, v in ALL_MODELS.items()}
     active_model_id = label_to_id.get(st.session_state.selected_model_label, allowed_models[0])
+    st.session_state._ew_active_model = active_model_id  # dla rozgrzewania cache w prefetchu
 
     # --- PARAMETRY EKSPERYMENTALNE ---
     st.subheader("🧪 Funkcje Eksperymentalne")
@@ -669,9 +993,10 @@ with st.sidebar:
         # Jeśli case wieżowca jest przydzielony ale nie rozpoczęty — oddaj
         if st.session_state.ew_current_case:
             case = st.session_state.ew_current_case
-            status = db.collection("ew_cases").document(case["_doc_id"]).get().to_dict().get("status")
+            status = db.collection("ew_cases").document(case["_doc_id"]).get(field_paths=["status"]).to_dict().get("status")
             if status == "przydzielony":
                 ew_release_case(case["_doc_id"])
+                ew_prefetch.drop(op_name)  # zwolniony case wraca do puli — następca mógł się zmienić
                 st.session_state.ew_current_case = None
         st.session_state.messages = []
         st.session_state.chat_started = False
@@ -684,11 +1009,19 @@ with st.sidebar:
         if st.session_state.get("ew_current_case"):
             case = st.session_state.ew_current_case
             try:
-                status = db.collection("ew_cases").document(case["_doc_id"]).get().to_dict().get("status")
+                status = db.collection("ew_cases").document(case["_doc_id"]).get(field_paths=["status"]).to_dict().get("status")
                 if status in ("przydzielony", "w_toku"):
                     ew_release_case(case["_doc_id"])
             except:
                 pass
+        # Oddaj też casy zarezerwowane zbiorczo (jeszcze nierozpoczęte)
+        for queued in st.session_state.get("ew_reverse_queue") or []:
+            try:
+                ew_release_case(queued["_doc_id"])
+            except Exception:
+                pass
+        if st.session_state.get("_vertex_cache_holder"):
+            vertex_cache.release(st.session_state._vertex_cache_holder)
         st.session_state.clear()
         cookies.clear()
         cookies.save()
@@ -702,12 +1035,10 @@ st.title(f"🤖 Szturchacz EW (Wieżowiec)")
 
 if "chat_started" not in st.session_state: st.session_state.chat_started = False
 
-@st.cache_data(ttl=3600)
 def get_remote_prompt(url):
+    """Prompt z prompt_store — z pamięci/dysku od razu, rewalidacja (ETag) w tle."""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.text
+        return prompt_store.get(url)
     except Exception as e:
         st.error(f"Błąd pobierania promptu z GitHub: {e}")
         return ""
@@ -740,25 +1071,11 @@ else:
         st.error("Nie udało się załadować promptu. Sprawdź URL w konfiguracji admina.")
         st.stop()
 
-    tz_pl = pytz.timezone('Europe/Warsaw')
-    now = datetime.now(tz_pl)
-
-    p_notag = "TAK" if st.session_state.notag_val else "NIE"
-    p_analizbior = "TAK" if st.session_state.analizbior_val else "NIE"
-
     # Jeśli wsad odwrotny wymusił tryb — nadpisz
     aktualny_tryb = st.session_state.pop("ew_forced_tryb", None) or wybrany_tryb_kod
 
-    parametry_startowe = f"""
-# PARAMETRY STARTOWE
-domyslny_operator={op_name}
-domyslna_data={now.strftime('%d.%m')}
-Grupa_Operatorska={cfg.get('role', 'Operatorzy_DE')}
-domyslny_tryb={aktualny_tryb}
-notag={p_notag}
-analizbior={p_analizbior}
-"""
-    FULL_PROMPT = SYSTEM_PROMPT + parametry_startowe
+    FULL_PROMPT = _ew_full_prompt(SYSTEM_PROMPT, aktualny_tryb,
+                                  st.session_state.notag_val, st.session_state.analizbior_val)
 
     def get_vertex_history():
         vh = []
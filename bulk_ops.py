@@ -0,0 +1,239 @@
+"""
+MASOWE OPERACJE NA FIRESTORE — BulkWriter z postępem, dławieniem, wznawianiem i dry-run
+
+Używany przez:
+- app.py — „Wyczyść kolejkę casów” (archiwizacja pominiętych + usunięcie casów z payloadem
+  + batche), „Wyczyść przeliczenia nocne”, „Wyczyść całe archiwum pominiętych”.
+
+Zamiast pętli z jednym .delete()/.update() na dokument (sekwencyjne RPC, minuty dla 5000 casów)
+mutacje idą przez BulkWriter: równoległe, batchowane zapisy z ponawianiem błędów przejściowych
+i limitem operacji/s (ramp-up jak zaleca Firestore). Starszy klient bez bulk_writer() →
+WriteBatch po _BATCH_MAX operacji (ten sam interfejs set/update/delete).
+
+Zadanie (run_query_job) czyta zapytanie stronami po page_size dokumentów w kolejności ID
+(__name__), mutuje je przez writer i po każdej stronie zapisuje punkt kontrolny w dokumencie
+stanu (state_ref): {"state", "scanned", "last_id", ...}. Po awarii (zamknięta karta, restart
+procesu) ponowne uruchomienie tego samego zadania rusza od last_id — mutacje są idempotentne
+(usunięcie / nadpisanie), więc powtórzona strona niczego nie psuje.
+
+mutate może być listą faz (np. [archiwizuj, usuń]): każda faza obejmuje całą stronę i jest
+zapisana (flush) przed następną, a dokument, którego zapis w fazie się nie udał (po ponowieniach),
+jest w kolejnych fazach pomijany — usunięcie nie wyprzedzi nieudanej kopii.
+
+dry_run=True — „Policz”: ten sam przebieg i ta sama funkcja mutate, ale operacje trafiają do
+licznika zamiast writera — dokładna liczba dokumentów/zapisów bez żadnej zmiany w bazie.
+"""
+
+import time
+
+try:
+    from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+except ImportError:  # klient sprzed BulkWriter — fallback na WriteBatch
+    BulkWriterOptions = None
+
+from firebase_admin import firestore
+
+DEFAULT_MAX_OPS = 500   # operacji/s — pułap BulkWriter (start 500, zasada 500/50/5)
+MAX_ATTEMPTS = 5        # prób zapisu jednego dokumentu (błędy przejściowe)
+_BATCH_MAX = 450        # fallback: operacji na WriteBatch (limit Firestore 500)
+
+
+class _BatchWriter:
+    """Fallback o interfejsie BulkWriter (set/update/delete/flush/close) na WriteBatch."""
+
+    def __init__(self, db):
+        self._db = db
+        self._batch = db.batch()
+        self._paths = []
+        self.failed = 0
+        self.failed_paths = set()
+
+    def _op(self, name, ref, *args, **kwargs):
+        getattr(self._batch, name)(ref, *args, **kwargs)
+        self._paths.append(ref.path)
+        if len(self._paths) >= _BATCH_MAX:
+            self.flush()
+
+    def set(self, ref, data, merge=False):
+        self._op("set", ref, data, merge=merge)
+
+    def update(self, ref, data):
+        self._op("update", ref, data)
+
+    def delete(self, ref):
+        self._op("delete", ref)
+
+    def flush(self):
+        if self._paths:
+            try:
+                self._batch.commit()
+            except Exception as e:
+                self.failed += len(self._paths)
+                self.failed_paths.update(self._paths)
+                print(f"[BULK] batch {len(self._paths)} operacji nieudany: {e}")
+            self._batch = self._db.batch()
+            self._paths = []
+
+    def close(self):
+        self.flush()
+
+
+def _writer(db, max_ops_per_second):
+    """BulkWriter z limitem operacji/s i ponawianiem błędów; .failed / .failed_paths — zapisy porzucone."""
+    if BulkWriterOptions is None or not hasattr(db, "bulk_writer"):
+        return _BatchWriter(db)
+    writer = db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=min(DEFAULT_MAX_OPS, max_ops_per_second),
+        max_ops_per_second=max_ops_per_second,
+    ))
+    writer.failed = 0
+    writer.failed_paths = set()
+
+    def _on_error(error, bulk_writer):
+        if error.attempts < MAX_ATTEMPTS:
+            return True  # ponów (BulkWriter sam odczeka z backoffem)
+        bulk_writer.failed += 1
+        ref = getattr(error.operation, "reference", None)
+        if ref is not None:
+            bulk_writer.failed_paths.add(ref.path)
+        print(f"[BULK] {getattr(ref, 'path', '?')}: {error.message} (po {error.attempts} próbach)")
+        return False
+
+    writer.on_write_error(_on_error)
+    return writer
+
+
+class _DryWriter:
+    """dry_run: przyjmuje operacje i tylko je liczy — mutate działa jak naprawdę, bez zapisu."""
+
+    failed = 0
+    failed_paths = frozenset()
+
+    def __init__(self):
+        self.ops = 0
+
+    def _op(self, *args, **kwargs):
+        self.ops += 1
+
+    set = update = delete = _op
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Owned:
+    """Writer strony: zapamiętuje, który dokument źródłowy zlecił zapis pod danym path."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.owner = None
+        self.owners = {}  # path zapisu -> id dokumentu źródłowego
+
+    def set(self, ref, data, merge=False):
+        self.owners[ref.path] = self.owner
+        self.writer.set(ref, data, merge=merge)
+
+    def update(self, ref, data):
+        self.owners[ref.path] = self.owner
+        self.writer.update(ref, data)
+
+    def delete(self, ref):
+        self.owners[ref.path] = self.owner
+        self.writer.delete(ref)
+
+    def failed_owners(self):
+        return {self.owners[p] for p in self.writer.failed_paths if p in self.owners}
+
+
+def count(query):
+    """Liczba dokumentów zapytania — agregacja count() (bez pobierania), fallback: same ID."""
+    try:
+        return int(query.count().get()[0][0].value)
+    except Exception:
+        return sum(1 for _ in query.select([]).stream())
+
+
+def job_state(state_ref):
+    """Stan zadania {"state": running|done, "done", "ops", "last_id", ...} albo {} (nigdy nie ruszało)."""
+    snap = state_ref.get()
+    return (snap.to_dict() or {}) if snap.exists else {}
+
+
+def run_query_job(db, query, mutate, state_ref, *, dry_run=False, page_size=500,
+                  max_ops_per_second=DEFAULT_MAX_OPS, progress=None, select=None, before=None):
+    """Przejdź zapytanie stronami (po ID) i zmutuj każdy dokument przez BulkWriter.
+
+    mutate(writer, snap) — dopisuje operacje do writer (set/update/delete, także funkcje
+        ew_case_store z batch=writer); zwraca liczbę operacji (0 = dokument pominięty).
+        Lista funkcji = fazy wykonywane po kolei na stronie (patrz opis modułu).
+    before(snaps) — raz na stronę przed mutate (np. zbiorczy odczyt payloadów strony).
+    state_ref — dokument stanu zadania: punkt kontrolny po każdej stronie; zadanie przerwane
+        w trakcie (state == "running") rusza od last_id.
+    dry_run — mutate na liczniku zamiast writera: nic nie jest zapisywane ani checkpointowane.
+    select — projekcja pól czytanych dokumentów (None = całe dokumenty).
+    progress(przetworzone, razem) — po każdej stronie.
+    Zwraca {"docs" (zmutowane), "scanned", "ops", "phase_ops" (operacje per faza), "failed",
+    "resumed", "seconds", "dry_run"}.
+    """
+    t0 = time.time()
+    state = {} if dry_run else job_state(state_ref)
+    resumed = state.get("state") == "running" and bool(state.get("last_id"))
+    last_id = state.get("last_id") if resumed else None
+    scanned = int(state.get("scanned", 0)) if resumed else 0
+    docs = int(state.get("docs", 0)) if resumed else 0
+    ops = int(state.get("ops", 0)) if resumed else 0
+    phases = list(mutate) if isinstance(mutate, (list, tuple)) else [mutate]
+    phase_ops = list(state.get("phase_ops") or []) if resumed else []
+    phase_ops += [0] * (len(phases) - len(phase_ops))
+
+    ordered = query.order_by("__name__")
+    base = ordered.select(select) if select is not None else ordered
+    total = scanned + count(ordered.start_after({"__name__": last_id}) if last_id else query)
+    if not dry_run:
+        state_ref.set({
+            "state": "running", "scanned": scanned, "docs": docs, "ops": ops, "last_id": last_id,
+            "total": total, "updated_at": firestore.SERVER_TIMESTAMP,
+            **({} if resumed else {"started_at": firestore.SERVER_TIMESTAMP}),
+        }, merge=True)
+
+    writer = _DryWriter() if dry_run else _writer(db, max_ops_per_second)
+    while True:
+        page = base.start_after({"__name__": last_id}) if last_id else base
+        snaps = list(page.limit(page_size).stream())
+        if not snaps:
+            break
+        if before:
+            before(snaps)
+        touched, skip = set(), set()
+        for i, phase in enumerate(phases):
+            owned = _Owned(writer)
+            for snap in snaps:
+                if snap.id in skip:
+                    continue
+                owned.owner = snap.id
+                n = phase(owned, snap) or 0
+                if n:
+                    touched.add(snap.id)
+                ops += n
+                phase_ops[i] += n
+            writer.flush()  # faza zapisana przed następną i przed punktem kontrolnym
+            skip |= owned.failed_owners()
+        docs += len(touched)
+        scanned += len(snaps)
+        last_id = snaps[-1].id
+        if not dry_run:
+            state_ref.set({"scanned": scanned, "docs": docs, "ops": ops, "phase_ops": phase_ops, "last_id": last_id,
+                           "updated_at": firestore.SERVER_TIMESTAMP}, merge=True)
+        if progress:
+            progress(scanned, max(total, scanned))
+        if len(snaps) < page_size:
+            break
+    writer.close()
+    if not dry_run:
+        state_ref.set({"state": "done", "last_id": None, "failed": writer.failed,
+                       "updated_at": firestore.SERVER_TIMESTAMP}, merge=True)
+    return {"docs": docs, "scanned": scanned, "ops": ops, "phase_ops": phase_ops, "failed": writer.failed, "resumed": resumed,
+            "seconds": round(time.time() - t0, 2), "dry_run": dry_run}
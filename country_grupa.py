@@ -0,0 +1,143 @@
+"""
+KRAJ → GRUPA I CECHY BLOKU SZTURCHACZA — słowa linii i jedno sprawdzenie w zbiorze zamiast pętli podciągów
+
+Używany przez:
+- app.py — przy zapisie bloku do puli (upsert_szturchacz_blocks) liczone są cechy bloku
+  (grupa po kraju, email, "Zablokowany klient") i zapisywane razem z blokiem;
+  _save_cases_to_db (W1/W2) korzysta z nich zamiast ponownie skanować linię casu.
+
+Dawne detect_country_grupa: lower() + ~40 sprawdzeń `kraj in tekst` — "uk" trafiało w środek
+słów ("bukiet", "ukończone", "duk..."), "wales" w "swales" itd. Teraz tekst dzielony jest na słowa
+(bajty UTF-8 przez jedną tablicę translate: A–Z → a–z, interpunkcja ASCII → spacja, potem split)
+i zbiór słów przecinany ze zbiorem nazw krajów; nazwy wielowyrazowe ("united kingdom") sprawdzane
+tylko, gdy w linii jest ich ostatnie słowo. Z wszystkich trafień wygrywa grupa o najwyższym
+priorytecie, jak dawniej: DE > FR > PL > UK (UK = każdy inny rozpoznany kraj). Brak kraju → None.
+Separatorem słów są białe znaki i interpunkcja ASCII (nie-ASCII, np. "—", zostaje w słowie).
+Na 20k syntetycznych linii ok. 55 ms vs ok. 85–95 ms starej pętli (regex z granicami słów: ~130–160 ms),
+a cechy liczone są RAZ na blok przy zapisie puli, nie w każdej partii Generuj.
+
+Benchmark (syntetyczne linie, porównanie ze starą pętlą):
+    python country_grupa.py
+"""
+
+import re
+
+# Kolejność = priorytet (pierwsza trafiona grupa z tej listy wygrywa)
+GRUPA_KRAJE = (
+    ("DE", ("germany", "austria", "switzerland", "liechtenstein")),
+    ("FR", ("france", "belgium", "spain", "italy")),
+    # PL = tylko Polska. UK = cała reszta (Luxembourg, Portugal, Sweden, Netherlands, UK, itd.)
+    ("PL", ("poland", "polska", "polen", "pologne")),
+    ("UK", (
+        "luxembourg", "portugal", "netherlands", "sweden", "denmark",
+        "finland", "norway", "ireland", "united kingdom", "uk", "england",
+        "czech", "czechia", "slovakia", "hungary", "romania", "bulgaria", "croatia",
+        "slovenia", "greece", "turkey", "serbia", "estonia", "latvia",
+        "lithuania", "malta", "cyprus", "scotland", "wales",
+    )),
+)
+_PRIORYTET = {g: i for i, (g, _) in enumerate(GRUPA_KRAJE)}
+_GRUPA = {kraj: g for g, kraje in GRUPA_KRAJE for kraj in kraje}
+
+# Słowo = ciąg bajtów bez białych znaków i interpunkcji ASCII ("_" należy do słowa, jak w \w);
+# wielkie litery ASCII od razu na małe — nazwy krajów są ASCII
+_SLOWO_TAB = bytes(
+    c + 32 if 65 <= c <= 90
+    else 32 if chr(c) in "!\"#$%&'()*+,-./:;<=>?@[\\]^`{|}~"
+    else c
+    for c in range(256)
+)
+_KRAJ_SLOWO = {k.encode(): g for k, g in _GRUPA.items() if " " not in k}
+# Nazwy wielowyrazowe po ostatnim słowie: b"kingdom" -> [((b"united", b"kingdom"), "UK")]
+_KRAJ_WIELO = {}
+for _k, _g in _GRUPA.items():
+    if " " in _k:
+        _slowa = tuple(w.encode() for w in _k.split())
+        _KRAJ_WIELO.setdefault(_slowa[-1], []).append((_slowa, _g))
+_SZUKANE = frozenset(_KRAJ_SLOWO) | frozenset(_KRAJ_WIELO)
+_RE_EMAIL = re.compile(r"[\w.+-]+@[\w.-]+\.\w+")
+_RE_ZABLOKOWANY = re.compile(r"zablokowany klient", re.IGNORECASE)
+
+
+def _wielowyrazowa(slowa, ostatnie):
+    """Grupa nazwy wielowyrazowej kończącej się słowem `ostatnie`, jeśli stoi w linii w całości."""
+    for nazwa, g in _KRAJ_WIELO[ostatnie]:
+        n = len(nazwa)
+        for i in range(n - 1, len(slowa)):
+            if slowa[i] == ostatnie and tuple(slowa[i - n + 1:i + 1]) == nazwa:
+                return g
+    return None
+
+
+def detect(text):
+    """Grupa po kraju (DE/FR/PL/UK) albo None."""
+    if not text:
+        return None
+    slowa = text.encode("utf-8").translate(_SLOWO_TAB).split()
+    best = None
+    for slowo in _SZUKANE.intersection(slowa):
+        # ostatnie słowo nazwy wielowyrazowej ("kingdom") samo krajem nie jest
+        g = _KRAJ_SLOWO.get(slowo) or _wielowyrazowa(slowa, slowo)
+        if g is not None and (best is None or _PRIORYTET[g] < _PRIORYTET[best]):
+            best = g
+    return best
+
+
+def extract_email(text):
+    """Pierwszy email w tekście (małymi literami) albo None."""
+    m = _RE_EMAIL.search(text or "")
+    return m.group(0).lower() if m else None
+
+
+def cechy(text):
+    """Cechy bloku/linii casu: {"grupa_kraj", "email", "zablokowany"} — zapisywane z blokiem puli."""
+    return {
+        "grupa_kraj": detect(text),
+        "email": extract_email(text),
+        "zablokowany": bool(_RE_ZABLOKOWANY.search(text or "")),
+    }
+
+
+# ==========================================
+# BENCHMARK (python country_grupa.py)
+# ==========================================
+
+def _legacy_detect(text):
+    """Stara pętla z _save_cases_to_db (podciągi, bez granic słów) — do porównania."""
+    text_lower = text.lower()
+    for g, kraje in GRUPA_KRAJE:
+        for country in kraje:
+            if country in text_lower:
+                return g
+    return None
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    rnd = random.Random(3)
+    kraje = [k for _, ks in GRUPA_KRAJE for k in ks] + ["Deutschland", "USA", "Japan"]
+    slowa = ["bukiet", "ukończone", "zamówienie", "kolektor", "zwrot", "kurier", "swales", "Status:", "tel."]
+    lines = []
+    for i in range(20_000):
+        parts = [f"{300000 + i}", rnd.choice(kraje).title(), f"klient{i}@example.com"]
+        parts += rnd.sample(slowa, 4)
+        if rnd.random() < 0.05:
+            parts.append("Zablokowany klient")
+        rnd.shuffle(parts)
+        lines.append(" | ".join(parts))
+
+    t0 = time.perf_counter()
+    old = [_legacy_detect(x) for x in lines]
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = [detect(x) for x in lines]
+    t_new = time.perf_counter() - t0
+    diff = sum(1 for a, b in zip(old, new) if a != b)
+    print(f"{len(lines)} linii — stara pętla {t_old * 1000:.1f} ms, słowa + zbiór {t_new * 1000:.1f} ms")
+    print(f"różne wyniki: {diff} (fałszywe trafienia podciągów, np. 'uk' w 'bukiet')")
+    for a, b, x in zip(old, new, lines):
+        if a != b:
+            print(f"  np. {a} → {b}: {x}")
+            break
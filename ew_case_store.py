@@ -0,0 +1,208 @@
+"""
+CASY WIEŻOWCA (ew_cases) — lekki dokument-indeks + ciężki payload w podkolekcji
+
+Używany przez:
+- app.py — zapis casów (_save_cases_to_db), autopilot (wsad + zapis rozmowy), Przegląd casów
+  (lista z indeksu, treść tylko dla wyświetlanej strony), czyszczenie.
+- app_vertex_ew.py — po rezerwacji casa doczytywany jest jego payload (wsad, przeliczenie);
+  wybór kandydata i liczniki czytają sam indeks.
+
+Układ:
+  ew_cases/{id}                  — INDEKS: status, grupa, score, ikona, przydział, flagi (INDEX_FIELDS
+                                   + pola dopisywane przez apki: skip_*, telefon_*, autopilot_* bez rozmowy)
+  ew_cases/{id}/payload/tresc    — PAYLOAD: PAYLOAD_FIELDS; wartość ≥ PAYLOAD_MIN_COMPRESS bajtów
+                                   (JSON) jako gzip w "{pole}_gz", krótsza jawnie w "{pole}".
+Listy (pula, kafelki, Przegląd casów) ściągają tylko indeks — zapytania z .select(...), więc także
+stare dokumenty z tekstem w indeksie nie są pobierane w całości. Stare dokumenty czytamy dalej:
+case sprzed podziału ma tekst w indeksie — load_payloads / with_payload czytają go stamtąd. Payload
+zapisany przez write_case ma znacznik PAYLOAD_COMPLETE; dokument payloadu bez niego (utworzony dla
+starego casa przez update_payload / clear_payload, np. tylko z autopilot_messages) jest częściowy —
+brakujące pola doczytywane są z indeksu.
+
+Rekord casa jest walidowany przy zapisie (build_case): score jako int, typy pól indeksu, nieznana
+grupa → "" (Brak grupy); nieznany status to błąd programu (ValueError), nie cichy zapis.
+"""
+
+import gzip
+import json
+
+from firebase_admin import firestore
+
+PAYLOAD_FIELDS = ("pelna_linia_szturchacza", "naglowek_priorytetowy", "autopilot_messages")
+PAYLOAD_SUB = "payload"
+PAYLOAD_DOC = "tresc"
+PAYLOAD_MIN_COMPRESS = 1024  # bajtów JSON — krótsze zapisujemy jawnie
+PAYLOAD_COMPLETE = "kompletny"  # znacznik payloadu z write_case — wszystkie pola są w payloadzie
+
+STATUSY = ("wolny", "przydzielony", "w_toku", "zakonczony", "odroczony", "pominiety")
+GRUPY = ("DE", "FR", "UK", "PL", "UKPL", "")  # UKPL = legacy
+
+# Pola indeksu zapisywane przy tworzeniu casa: pole -> (typy, domyślna)
+INDEX_SCHEMA = {
+    "batch_id": ((str,), ""),
+    "numer_zamowienia": ((str,), ""),
+    "score": ((int,), 0),
+    "priority_icon": ((str,), "⚪"),
+    "priority_label": ((str,), ""),
+    "grupa": ((str,), ""),
+    "index_handlowy": ((str,), ""),
+    "status": ((str,), "wolny"),
+    "data_obrobki": ((str, type(None)), None),
+    "assigned_to": ((str, type(None)), None),
+    "assigned_at": ((object,), None),
+    "completed_at": ((object,), None),
+    "result_tag": ((str, type(None)), None),
+    "result_pz": ((str, type(None)), None),
+    "sort_order": ((int,), 0),
+    "powiazane_nrzam": ((list,), []),
+    # hash bloku szturchacza (po normalizacji, app._sz_norm_hash), z którego case wygenerowano —
+    # Generuj przelicza wolny case, gdy hash bloku w puli jest inny
+    "wsad_norm": ((str,), ""),
+    "created_at": ((object,), None),
+}
+
+# Projekcja dla list: wszystko, co czytają widoki puli (bez PAYLOAD_FIELDS)
+INDEX_FIELDS = tuple(INDEX_SCHEMA) + (
+    "autopilot_status", "autopilot_assigned_to", "autopilot_operator", "autopilot_date", "autopilot_model",
+    "skip_reason", "skip_fixed", "skipped_by",
+    "telefon_do_wykonania", "telefon_status", "telefon_proby",
+)
+
+
+def build_case(fields):
+    """Rozdziel i zwaliduj rekord casa → (indeks, payload). Brakujące pola indeksu — wartości
+    domyślne; nieznane pola (spoza schematu i payloadu) trafiają do indeksu bez zmian."""
+    index, payload = {}, {}
+    for name, value in fields.items():
+        (payload if name in PAYLOAD_FIELDS else index)[name] = value
+    for name, (types, default) in INDEX_SCHEMA.items():
+        value = index.get(name, default)
+        if name == "score":
+            try:
+                value = int(value or 0)
+            except (TypeError, ValueError):
+                value = 0
+        elif value is not None and not isinstance(value, types):
+            value = str(value) if str in types else default
+        index[name] = value
+    if index["status"] not in STATUSY:
+        raise ValueError(f"ew_cases: nieznany status {index['status']!r} ({index['numer_zamowienia']})")
+    if index["grupa"] not in GRUPY:
+        index["grupa"] = ""  # trafia do „Brak grupy” w Przeglądzie casów — do ręcznego przypisania
+    return index, payload
+
+
+def payload_ref(case_ref):
+    return case_ref.collection(PAYLOAD_SUB).document(PAYLOAD_DOC)
+
+
+def _pack(payload, merge=True):
+    """Pola payloadu w zwartej postaci; merge=True — z kasowaniem drugiego wariantu pola."""
+    out = {}
+    for name, value in payload.items():
+        raw = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(raw) >= PAYLOAD_MIN_COMPRESS:
+            out[f"{name}_gz"] = gzip.compress(raw, compresslevel=6)
+            if merge:
+                out[name] = firestore.DELETE_FIELD
+        else:
+            out[name] = value
+            if merge:
+                out[f"{name}_gz"] = firestore.DELETE_FIELD
+    return out
+
+
+def _unpack(d):
+    out = {}
+    for name in PAYLOAD_FIELDS:
+        if d.get(f"{name}_gz") is not None:
+            out[name] = json.loads(gzip.decompress(bytes(d[f"{name}_gz"])).decode("utf-8"))
+        elif name in d:
+            out[name] = d[name]
+    return out
+
+
+def write_case(case_ref, fields, batch=None):
+    """Zapisz (nadpisz) case: indeks + payload. batch — WriteBatch/Transaction, inaczej zapis od razu.
+    Zwraca zapisany indeks."""
+    index, payload = build_case(fields)
+    if batch is None:
+        case_ref.set(index)
+        payload_ref(case_ref).set({**_pack(payload, merge=False), PAYLOAD_COMPLETE: True})
+    else:
+        batch.set(case_ref, index)
+        batch.set(payload_ref(case_ref), {**_pack(payload, merge=False), PAYLOAD_COMPLETE: True})
+    return index
+
+
+def update_payload(case_ref, payload, index_updates=None, batch=None):
+    """Zaktualizuj pola payloadu (np. autopilot_messages) i opcjonalnie indeks. Stara kopia pola
+    w indeksie (dokument sprzed podziału) jest kasowana."""
+    idx = dict(index_updates or {})
+    for name in payload:
+        idx[name] = firestore.DELETE_FIELD
+    if batch is None:
+        payload_ref(case_ref).set(_pack(payload), merge=True)
+        case_ref.update(idx)
+    else:
+        batch.set(payload_ref(case_ref), _pack(payload), merge=True)
+        batch.update(case_ref, idx)
+
+
+def clear_payload(case_ref, names, index_updates=None, batch=None):
+    """Usuń pola payloadu (w obu wariantach i z indeksu starych dokumentów)."""
+    drop = {}
+    for name in names:
+        drop[name] = firestore.DELETE_FIELD
+        drop[f"{name}_gz"] = firestore.DELETE_FIELD
+    idx = dict(index_updates or {})
+    idx.update({name: firestore.DELETE_FIELD for name in names})
+    if batch is None:
+        payload_ref(case_ref).set(drop, merge=True)
+        case_ref.update(idx)
+    else:
+        batch.set(payload_ref(case_ref), drop, merge=True)
+        batch.update(case_ref, idx)
+
+
+def delete_case(case_ref, batch=None):
+    """Usuń case razem z payloadem (podkolekcja nie znika sama z dokumentem)."""
+    if batch is None:
+        payload_ref(case_ref).delete()
+        case_ref.delete()
+    else:
+        batch.delete(payload_ref(case_ref))
+        batch.delete(case_ref)
+
+
+def load_payloads(db, case_refs):
+    """Payloady wielu casów: {doc_id: {pole: wartość}} — get_all po 300. Case sprzed podziału
+    (brak dokumentu payloadu albo payload bez PAYLOAD_COMPLETE) — brakujące pola czytane
+    z dokumentu indeksu."""
+    case_refs = list(case_refs)
+    out = {}
+    for i in range(0, len(case_refs), 300):
+        chunk = {payload_ref(r).path: r for r in case_refs[i:i + 300]}
+        legacy = []
+        for snap in db.get_all([payload_ref(r) for r in chunk.values()]):
+            ref = chunk[snap.reference.path]
+            d = (snap.to_dict() or {}) if snap.exists else {}
+            out[ref.id] = _unpack(d)
+            if not d.get(PAYLOAD_COMPLETE):
+                legacy.append(ref)
+        if legacy:
+            for snap in db.get_all(legacy, field_paths=list(PAYLOAD_FIELDS)):
+                d = (snap.to_dict() or {}) if snap.exists else {}
+                got = out.setdefault(snap.id, {})
+                for k in PAYLOAD_FIELDS:
+                    if k not in got and d.get(k) is not None:
+                        got[k] = d[k]
+    return out
+
+
+def with_payload(db, case_ref, data):
+    """data (dict indeksu) uzupełniony o payload casa."""
+    if data is None:
+        return None
+    data.update(load_payloads(db, [case_ref]).get(case_ref.id, {}))
+    return data
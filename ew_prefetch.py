@@ -0,0 +1,72 @@
+"""
+PREFETCH NASTĘPNEGO CASE'A — rozgrzewanie w tle (Koordynator)
+
+Używany przez:
+- app_vertex_ew.py — gdy operator pracuje nad bieżącym casem, w tle wybieramy
+  prawdopodobnego następcę (BEZ rezerwacji), wczytujemy jego treść (payload) i podgląd kontekstu
+  forum (tylko odczyt — bez zapisu forum_memory) oraz rozgrzewamy model z cache (vertex_cache).
+  Przy kliknięciu "Zakończ → Następny" pakiet jest walidowany (transakcja) i od razu użyty.
+
+Stan trzymamy w pamięci PROCESU (jak _OSTATNIE_POSTY w forum_module) — apka operatorska jest
+wykonywana od nowa przy każdym rerunie, więc zmienne globalne skryptu by ginęły.
+Wątek w tle NIE dotyka st.session_state ani st.* — tylko Firestore i HTTP.
+"""
+
+import threading
+import time
+import traceback
+
+PREFETCH_TTL = 300.0  # sekundy — starszy pakiet nie jest używany (kolejka mogła się zmienić)
+
+_BUNDLES = {}      # klucz (operator) -> {"tag": ..., "ts": ..., "bundle": dict|None}
+_PENDING = set()   # klucze, dla których wątek jeszcze liczy
+_LOCK = threading.Lock()
+
+
+def schedule(key, loader, tag=None):
+    """Odpala loader() w wątku w tle, jeśli dla klucza nie ma już świeżego pakietu z tym samym tagiem.
+
+    tag = np. doc_id bieżącego casa — zmiana casa wymusza nowy prefetch.
+    Zwraca True, jeśli wątek wystartował.
+    """
+    with _LOCK:
+        if key in _PENDING:
+            return False
+        cur = _BUNDLES.get(key)
+        if cur and cur["tag"] == tag and (time.time() - cur["ts"]) < PREFETCH_TTL:
+            return False
+        _PENDING.add(key)
+
+    def _run():
+        bundle = None
+        try:
+            bundle = loader()
+        except Exception as e:
+            # Prefetch to tylko optymalizacja — błąd = zwykła ścieżka przy kliknięciu
+            print(f"[EW_PREFETCH] {key}: błąd w tle ({e})\n{traceback.format_exc()}")
+            bundle = None
+        with _LOCK:
+            _PENDING.discard(key)
+            _BUNDLES[key] = {"tag": tag, "ts": time.time(), "bundle": bundle}
+
+    threading.Thread(target=_run, daemon=True, name=f"ew-prefetch-{key}").start()
+    return True
+
+
+def take(key, max_age=PREFETCH_TTL):
+    """Zabiera (jednorazowo) gotowy pakiet dla klucza. None = brak / nieświeży / jeszcze liczy."""
+    with _LOCK:
+        if key in _PENDING:
+            return None
+        entry = _BUNDLES.pop(key, None)
+    if not entry or not entry.get("bundle"):
+        return None
+    if (time.time() - entry["ts"]) > max_age:
+        return None
+    return entry["bundle"]
+
+
+def drop(key):
+    """Unieważnij pakiet (np. operator pominął/zwolnił case — wybór następcy mógł się zmienić)."""
+    with _LOCK:
+        _BUNDLES.pop(key, None)
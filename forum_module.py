@@ -23,10 +23,27 @@ Nick bota: chatoszturek
 
 import re
 import json
+import time
+import hashlib
+import random
+import threading
 import requests
+import requests.adapters
+from concurrent.futures import ThreadPoolExecutor
+import os
 import traceback
+from collections import deque
 import streamlit as st
+import post_classifier
+import szturchacz_parser
 from datetime import datetime, timezone, timedelta
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:  # starszy Streamlit
+    try:
+        from streamlit.scriptrunner import get_script_run_ctx
+    except ImportError:
+        get_script_run_ctx = None
 try:
     from zoneinfo import ZoneInfo
     _TZ_PL = ZoneInfo("Europe/Warsaw")
@@ -163,7 +180,7 @@ def load_zastepstwa(db, prefix=""):
         if getattr(doc, "exists", False):
             mapa = (doc.to_dict() or {}).get("mapa", {}) or {}
     except Exception as e:
-        _flog(f"ZASTEPSTWA: nie udalo sie odczytac mapy ({e}) — jade bez podmiany")
+        _flog(f"ZASTEPSTWA: nie udalo sie odczytac mapy ({e}) — jade bez podmiany", level="WARNING")
         mapa = {}
     _ZAST_CACHE["mapa"] = mapa
     _ZAST_CACHE["ts"] = now
@@ -213,16 +230,120 @@ def _is_individual_user(nick):
 
 
 # --- DEBUG LOG ---
-FORUM_DEBUG = True  # True = loguj wszystko do session_state
+# True = loguj wszystko od DEBUG (print/plik); False = tylko ostrzeżenia i błędy. Pomiary (ms) trafiają
+# do bufora zawsze — z nich jest tabela czasów w panelu autopilota. Włączenie: FORUM_DEBUG=1 w env.
+FORUM_DEBUG = os.environ.get("FORUM_DEBUG", "") == "1"
+FORUM_LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+FORUM_LOG_SIZE = 500            # wpisów w buforze sesji — najstarsze wypadają (nocny autopilot nie puchnie)
+FORUM_LOG_PROCESS_SIZE = 1000   # bufor procesu — wątki w tle (indekser, outbox, prefetch) nie mają sesji
+FORUM_LOG_FILE = os.environ.get("FORUM_LOG_FILE", "")  # opcjonalny plik JSON lines, pusty = wyłączony
+FORUM_LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+FORUM_LOG_FILE_BACKUPS = 3
+_LOG_SESSION_KEY = "_forum_log"  # bufor sesji — czytany tylko przez forum_log_records()
+
+_PROC_LOG = deque(maxlen=FORUM_LOG_PROCESS_SIZE)
+_FILE_LOG = {"logger": None}
+_FILE_LOG_LOCK = threading.Lock()
+
+
+def _forum_file_logger():
+    """Logger z RotatingFileHandler (JSON lines) — tworzony leniwie, jeden na proces."""
+    if not FORUM_LOG_FILE:
+        return None
+    with _FILE_LOG_LOCK:
+        if _FILE_LOG["logger"] is None:
+            import logging
+            import logging.handlers
+            lg = logging.getLogger("forum_module.jsonl")
+            lg.setLevel(logging.DEBUG)
+            lg.propagate = False
+            handler = logging.handlers.RotatingFileHandler(
+                FORUM_LOG_FILE, maxBytes=FORUM_LOG_FILE_MAX_BYTES,
+                backupCount=FORUM_LOG_FILE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            lg.addHandler(handler)
+            _FILE_LOG["logger"] = lg
+        return _FILE_LOG["logger"]
+
+
+def _in_background_thread():
+    """True w wątku bez kontekstu skryptu Streamlit (wątki w tle tego modułu i apek)."""
+    if get_script_run_ctx is None:
+        return False  # nie da się rozpoznać — jak dawniej: sesja, a przy błędzie bufor procesu
+    try:
+        return get_script_run_ctx(suppress_warning=True) is None
+    except TypeError:  # Streamlit bez suppress_warning
+        return get_script_run_ctx() is None
+
 
-def _flog(msg):
-    """Loguj do session_state (widoczne w UI) + print (logi Streamlit Cloud)"""
-    if not FORUM_DEBUG:
+def _flog(msg, level="INFO", **fields):
+    """Strukturalny log forum: bufor sesji (widoczny w UI, ograniczony do FORUM_LOG_SIZE),
+    print (logi Streamlit Cloud) i opcjonalnie plik JSON lines z rotacją.
+
+    fields — pola pomiarowe wywołań forum (endpoint, ms, pages, posts, status...) —
+    z nich forum_log_timings() liczy czasy odpowiedzi.
+    """
+    lvl = FORUM_LOG_LEVELS.get(level, 20)
+    verbose = lvl >= FORUM_LOG_LEVELS["DEBUG" if FORUM_DEBUG else "WARNING"]
+    if not verbose and "ms" not in fields:
         return
-    if "forum_debug_log" not in st.session_state:
-        st.session_state.forum_debug_log = []
-    st.session_state.forum_debug_log.append(msg)
-    print(f"[FORUM_DEBUG] {msg}")
+    rec = {"ts": time.time(), "level": level, "msg": msg}
+    rec.update(fields)
+    if _in_background_thread():
+        # wątek w tle (indekser, outbox, prefetch): st.session_state dałby tu jednorazowy,
+        # niewidoczny stan zamiast błędu — wpis trafia do bufora procesu
+        _PROC_LOG.append(rec)
+    else:
+        try:
+            buf = st.session_state.get(_LOG_SESSION_KEY)
+            if not isinstance(buf, deque) or buf.maxlen != FORUM_LOG_SIZE:
+                buf = deque(maxlen=FORUM_LOG_SIZE)
+                st.session_state[_LOG_SESSION_KEY] = buf
+            buf.append(rec)
+        except Exception:
+            _PROC_LOG.append(rec)
+    if not verbose:
+        return  # pomiar poniżej progu — tylko bufor (forum_log_timings), bez print i pliku
+    _extra = " | " + " ".join(f"{k}={v}" for k, v in fields.items()) if fields else ""
+    print(f"[FORUM_{level}] {msg}{_extra}")
+    lg = _forum_file_logger()
+    if lg is not None:
+        try:
+            lg.info(json.dumps(rec, ensure_ascii=False, default=str))
+        except Exception:
+            pass
+
+
+def forum_log_records(min_level="DEBUG", limit=None, process=False):
+    """Wpisy logu (najnowsze na końcu): bufor sesji albo — process=True — bufor wątków w tle."""
+    floor = FORUM_LOG_LEVELS.get(min_level, 10)
+    if process:
+        src = list(_PROC_LOG)
+    else:
+        try:
+            src = list(st.session_state.get(_LOG_SESSION_KEY) or ())
+        except Exception:
+            src = []
+    out = [r for r in src if isinstance(r, dict) and FORUM_LOG_LEVELS.get(r.get("level"), 20) >= floor]
+    return out[-limit:] if limit else out
+
+
+def forum_log_timings(records=None):
+    """Czasy wywołań forum z logu: {endpoint: {"count", "avg_ms", "p95_ms", "max_ms"}}."""
+    by_ep = {}
+    for r in (forum_log_records() if records is None else records):
+        if "ms" in r and r.get("endpoint"):
+            by_ep.setdefault(r["endpoint"], []).append(r["ms"])
+    out = {}
+    for ep, ms in by_ep.items():
+        ms.sort()
+        out[ep] = {
+            "count": len(ms),
+            "avg_ms": sum(ms) / len(ms),
+            "p95_ms": ms[min(len(ms) - 1, int(0.95 * len(ms)))],
+            "max_ms": ms[-1],
+        }
+    return out
 
 def _get_bearer():
     return st.secrets.get("FORUM_BEARER_TOKEN", "")
@@ -234,6 +355,98 @@ def _headers():
     }
 
 
+# ==========================================
+# KLIENT HTTP — wspólna pula połączeń (keep-alive) dla autopilota i operatorów
+# ==========================================
+# Timeout (connect, read) per endpoint — GetPostTree odpowiada szybko, CreatePost bywa wolniejszy
+FORUM_TIMEOUTS = {"CreatePost": (5, 30), "GetPostTree": (5, 15)}
+# Ponowienia tylko dla IDEMPOTENTNYCH wywołań — CreatePost ponowiony mógłby zdublować wpis
+FORUM_RETRIES = {"CreatePost": 0, "GetPostTree": 3}
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+
+class _ForumClient:
+    """requests.Session z pulą połączeń do f15 — jeden na proces (oszczędza handshake TLS na każdym
+    wywołaniu). Jitterowany backoff dla GetPostTree, histogram czasów odpowiedzi per endpoint."""
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+        self._latency = {}  # endpoint -> {"count", "sum", "errors", "buckets": [n per _LATENCY_BUCKETS + inf]}
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                sess = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=0)
+                sess.mount("https://", adapter)
+                sess.mount("http://", adapter)
+                self._session = sess
+            return self._session
+
+    def _record(self, endpoint, elapsed, error=False):
+        with self._lock:
+            h = self._latency.setdefault(endpoint, {
+                "count": 0, "sum": 0.0, "errors": 0, "buckets": [0] * (len(_LATENCY_BUCKETS) + 1)})
+            h["count"] += 1
+            h["sum"] += elapsed
+            if error:
+                h["errors"] += 1
+            for i, le in enumerate(_LATENCY_BUCKETS):
+                if elapsed <= le:
+                    h["buckets"][i] += 1
+                    break
+            else:
+                h["buckets"][-1] += 1
+
+    def post(self, endpoint, payload):
+        """POST {FORUM_API_BASE}/api/wpisy/{endpoint}. Zwraca Response (raise_for_status po stronie wołającego)."""
+        url = f"{FORUM_API_BASE}/api/wpisy/{endpoint}"
+        timeout = FORUM_TIMEOUTS.get(endpoint, (5, 30))
+        retries = FORUM_RETRIES.get(endpoint, 0)
+        sess = self._get_session()
+        for attempt in range(retries + 1):
+            t0 = time.monotonic()
+            try:
+                resp = sess.post(url, headers=_headers(), json=payload, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                elapsed = time.monotonic() - t0
+                self._record(endpoint, elapsed, error=True)
+                _flog(f"HTTP {endpoint}: {type(e).__name__}", level="WARNING",
+                      endpoint=endpoint, ms=round(elapsed * 1000), status=type(e).__name__, attempt=attempt)
+                if attempt >= retries:
+                    raise
+                _flog(f"HTTP {endpoint}: ponawiam ({attempt + 1}/{retries})", level="WARNING")
+            else:
+                elapsed = time.monotonic() - t0
+                retryable = resp.status_code in _RETRY_STATUS
+                self._record(endpoint, elapsed, error=resp.status_code >= 400)
+                _flog(f"HTTP {endpoint}", level="DEBUG" if resp.status_code < 400 else "WARNING",
+                      endpoint=endpoint, ms=round(elapsed * 1000), status=resp.status_code, attempt=attempt)
+                if not retryable or attempt >= retries:
+                    return resp
+                _flog(f"HTTP {endpoint}: status {resp.status_code} — ponawiam ({attempt + 1}/{retries})", level="WARNING")
+            time.sleep(0.5 * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def latency_stats(self):
+        """Kopia histogramów: {endpoint: {"count", "avg", "errors", "buckets": {"≤0.1s": n, ..., ">30s": n}}}."""
+        with self._lock:
+            out = {}
+            for endpoint, h in self._latency.items():
+                labels = [f"≤{le:g}s" for le in _LATENCY_BUCKETS] + [f">{_LATENCY_BUCKETS[-1]:g}s"]
+                out[endpoint] = {
+                    "count": h["count"],
+                    "avg": h["sum"] / h["count"] if h["count"] else 0.0,
+                    "errors": h["errors"],
+                    "buckets": dict(zip(labels, h["buckets"])),
+                }
+            return out
+
+
+FORUM_CLIENT = _ForumClient()
+
+
 # ==========================================
 # PISANIE — CreatePost
 # ==========================================
@@ -267,8 +480,8 @@ def forum_write(post_id, do_odp_id, user_do, tresc, user_do_type=1, user_od=None
     user_rzeczywisty = ai_user if ai_user else FORUM_USER
 
     _flog(f"WRITE: post_id={post_id}, do_odp_id={do_odp_id}, user_do={user_do}, type={user_do_type}")
-    _flog(f"WRITE: user_od={user_od}, from_type={from_user_type}, AiUser={FORUM_USER}, UserRzeczywisty={user_rzeczywisty}, tytul='{tytul}'")
-    _flog(f"WRITE: tresc={tresc[:80]}...")
+    _flog(f"WRITE: user_od={user_od}, from_type={from_user_type}, AiUser={FORUM_USER}, UserRzeczywisty={user_rzeczywisty}, tytul='{tytul}'", level="DEBUG")
+    _flog(f"WRITE: tresc={tresc[:80]}...", level="DEBUG")
     
     payload = {
         "thread": {
@@ -297,17 +510,14 @@ def forum_write(post_id, do_odp_id, user_do, tresc, user_do_type=1, user_od=None
         }
     }
     
+    t0 = time.monotonic()
     try:
-        resp = requests.post(
-            f"{FORUM_API_BASE}/api/wpisy/CreatePost",
-            headers=_headers(),
-            json=payload,
-            timeout=30
-        )
+        resp = FORUM_CLIENT.post("CreatePost", payload)
         resp.raise_for_status()
         data = resp.json()
         
         if data.get("status") == "SUCCESS":
+            forum_cache_invalidate(post_id, do_odp_id)
             msg = data.get("message", "")
             id_match = re.search(r'\(id:\s*(\d+)\)', msg)
             if not id_match:
@@ -316,7 +526,8 @@ def forum_write(post_id, do_odp_id, user_do, tresc, user_do_type=1, user_od=None
                 id_match = re.search(r'(\d{7,})', msg)
             new_id = int(id_match.group(1)) if id_match else None
             
-            _flog(f"WRITE RESULT: success=True, new_id={new_id}, msg={msg[:100]}")
+            _flog(f"WRITE RESULT: success=True, new_id={new_id}, msg={msg[:100]}",
+                  endpoint="forum_write", ms=round((time.monotonic() - t0) * 1000))
             
             if not new_id:
                 import streamlit as _st
@@ -329,6 +540,8 @@ def forum_write(post_id, do_odp_id, user_do, tresc, user_do_type=1, user_od=None
                 "link": f"{FORUM_API_BASE}/Wpisy/detailWpis?id={post_id}&do_odpid={new_id}#odp-{new_id}" if new_id else None
             }
         else:
+            _flog(f"WRITE RESULT: success=False, msg={str(data.get('message'))[:100]}", level="WARNING",
+                  endpoint="forum_write", ms=round((time.monotonic() - t0) * 1000))
             return {"success": False, "error": data.get("message", "Nieznany błąd")}
     
     except requests.exceptions.HTTPError as e:
@@ -340,10 +553,10 @@ def forum_write(post_id, do_odp_id, user_do, tresc, user_do_type=1, user_od=None
                 _body = e.response.text[:800]
         except Exception:
             _body = ""
-        _flog(f"WRITE HTTP ERROR: {e} | odpowiedz forum: {_body}")
+        _flog(f"WRITE HTTP ERROR: {e} | odpowiedz forum: {_body}", level="ERROR")
         return {"success": False, "error": f"{e} | odpowiedz forum: {_body}"}
     except Exception as e:
-        _flog(f"WRITE ERROR: {e}")
+        _flog(f"WRITE ERROR: {e}", level="ERROR")
         return {"success": False, "error": str(e)}
 
 
@@ -351,8 +564,115 @@ def forum_write(post_id, do_odp_id, user_do, tresc, user_do_type=1, user_od=None
 # CZYTANIE — GetPostTree
 # ==========================================
 
+FORUM_PAGE_WORKERS = 4    # równoległe strony 2..N jednego drzewka
+FIRST_PAGE_TTL = 15.0     # s — ponowny odczyt tego samego drzewka w tym oknie bierze stronę 1 z pamięci
+_FIRST_PAGE = {}          # (root, branch, leaf, lrb, laa, mta) -> (ts, tree)
+_FIRST_PAGE_LOCK = threading.Lock()
+
+
+def _fetch_tree_page(base_payload, page):
+    """Jedna strona GetPostTree. Zwraca (tree, None) albo (None, komunikat)."""
+    payload = dict(base_payload, PagingInfo={"CurrentPage": page})
+    resp = FORUM_CLIENT.post("GetPostTree", payload)
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("status") != "SUCCESS" or not data.get("tree"):
+        return None, data.get("message", "Brak danych")
+    return data["tree"], None
+
+
+def _tree_payload(root_id=None, branch_id=None, leaf_id=None, login_requested_by=None,
+                  login_acting_as=None, member_type_acting_as=None):
+    """Payload GetPostTree (bez PagingInfo) — wspólny dla forum_read i stronicowego indeksera."""
+    _lrb = login_requested_by or FORUM_USER
+    _laa = login_acting_as or _lrb
+    _mta = member_type_acting_as if member_type_acting_as else (
+        1 if _is_individual_user(_laa) else 2)
+    return {
+        "root": root_id,
+        "branch": branch_id,
+        "leaf": leaf_id,
+        "WholePage": None,
+        "LoginRequestedBy": _lrb,           # brief §5.2 — zastępuje "login"; bez JWT
+        "LoginActingAs": _laa,              # WYMAGANE (fix 406)
+        "MemberTypeActingAs": _mta,         # WYMAGANE (fix 406): 1=user, 2=grupa
+    }
+
+
+def _parse_post(p):
+    return {
+        "Id": p.get("Id"),
+        "Do_Odpid": p.get("Do_Odpid"),
+        "Text": p.get("Text", ""),
+        "UserAddName": p.get("UserAddName", ""),
+        "UserAddType": p.get("UserAddType"),       # brief §5.2: 1=user, 2=grupa
+        "UserOdInGroup": p.get("UserOdInGroup"),   # brief §5.2: faktyczny autor gdy nadawca=grupa
+        "UserToName": p.get("UserToName", ""),
+        "DateAdd": p.get("DateAdd", ""),
+        "Level": p.get("Level", 0),
+        "Hierarchy": p.get("Hierarchy", ""),
+    }
+
+
+FORUM_CACHE_TTL = 60.0    # s — wynik GetPostTree współdzielony w obrębie jednego casa
+_TREE_CACHE = {}          # (root, branch, leaf, max_pages, lrb, laa, mta) -> (ts, wynik, {Id postów})
+_TREE_CACHE_STATS = {"hit": 0, "miss": 0, "invalidated": 0}
+_TREE_CACHE_LOCK = threading.Lock()
+
+
 def forum_read(branch_id=None, root_id=None, leaf_id=None, max_pages=5,
                login_requested_by=None, login_acting_as=None, member_type_acting_as=None):
+    """forum_read z krótkim cache (FORUM_CACHE_TTL) — check_forum_answer, auto_load_forum_context
+    i [FORUM_READ] w jednym casie czytają to samo drzewko raz. Zapis na forum unieważnia wątek."""
+    _lrb = login_requested_by or FORUM_USER
+    _laa = login_acting_as or _lrb
+    key = (root_id, branch_id, leaf_id, max_pages, _lrb, _laa, member_type_acting_as)
+    now = time.time()
+    with _TREE_CACHE_LOCK:
+        hit = _TREE_CACHE.get(key)
+        if hit and now - hit[0] < FORUM_CACHE_TTL:
+            _TREE_CACHE_STATS["hit"] += 1
+            result = hit[1]
+            return dict(result, posts=list(result["posts"]))
+        _TREE_CACHE_STATS["miss"] += 1
+
+    result = _forum_read_uncached(branch_id=branch_id, root_id=root_id, leaf_id=leaf_id, max_pages=max_pages,
+                                  login_requested_by=login_requested_by, login_acting_as=login_acting_as,
+                                  member_type_acting_as=member_type_acting_as)
+    if result.get("success"):
+        ids = {p["Id"] for p in result["posts"]}
+        with _TREE_CACHE_LOCK:
+            for k in [k for k, (ts, _, _) in _TREE_CACHE.items() if now - ts >= FORUM_CACHE_TTL]:
+                _TREE_CACHE.pop(k, None)
+            _TREE_CACHE[key] = (now, result, ids)
+        result = dict(result, posts=list(result["posts"]))
+    return result
+
+
+def forum_cache_invalidate(post_id=None, do_odp_id=None):
+    """Unieważnij drzewka dotknięte zapisem: wątek post_id oraz każde drzewko zawierające post,
+    pod którym dopisano odpowiedź (do_odp_id). Bez argumentów — wszystko."""
+    targets = {i for i in (post_id, do_odp_id) if i}
+    with _TREE_CACHE_LOCK:
+        if not targets:
+            stale = list(_TREE_CACHE)
+        else:
+            stale = [k for k, (_, _, ids) in _TREE_CACHE.items()
+                     if targets & {k[0], k[1], k[2]} or targets & ids]
+        for k in stale:
+            _TREE_CACHE.pop(k, None)
+        _TREE_CACHE_STATS["invalidated"] += len(stale)
+    _forget_first_pages()
+
+
+def forum_cache_stats():
+    """Liczniki cache GetPostTree (do strojenia FORUM_CACHE_TTL): hit / miss / invalidated / entries."""
+    with _TREE_CACHE_LOCK:
+        return dict(_TREE_CACHE_STATS, entries=len(_TREE_CACHE))
+
+
+def _forum_read_uncached(branch_id=None, root_id=None, leaf_id=None, max_pages=5,
+                         login_requested_by=None, login_acting_as=None, member_type_acting_as=None):
     """Czytanie drzewka (GetPostTree).
 
     PRYWATNOŚĆ (brief §5.2): stare pole "login" USUNIĘTE. Autoryzacja przez stały bearer token,
@@ -360,86 +680,74 @@ def forum_read(branch_id=None, root_id=None, leaf_id=None, max_pages=5,
       - login_requested_by: login wykonującego zapytanie; domyślnie konto AI "chatoszturek".
       - login_acting_as / member_type_acting_as: opcjonalne — z czyjej perspektywy czytać drzewko
         (czytanie jako grupa: login_acting_as=grupa, member_type_acting_as=2).
-    """
-    all_posts = []
-    thread_title = ""
-
-    for page in range(1, max_pages + 1):
-        # FIX 406 (potwierdzone przez IT forum): GetPostTree WYMAGA LoginActingAs (string) oraz
-        # MemberTypeActingAs (int: 1=user, 2=grupa). Bez nich serwer zwraca 406 Not Acceptable.
-        # Domyślnie czytamy z perspektywy konta wykonującego zapytanie (LoginRequestedBy), typ=user.
-        _lrb = login_requested_by or FORUM_USER
-        _laa = login_acting_as or _lrb
-        _mta = member_type_acting_as if member_type_acting_as else (
-            1 if _is_individual_user(_laa) else 2)
-        payload = {
-            "root": root_id,
-            "branch": branch_id,
-            "leaf": leaf_id,
-            "WholePage": None,
-            "LoginRequestedBy": _lrb,           # brief §5.2 — zastępuje "login"; bez JWT
-            "LoginActingAs": _laa,              # WYMAGANE (fix 406)
-            "MemberTypeActingAs": _mta,         # WYMAGANE (fix 406): 1=user, 2=grupa
-            "PagingInfo": {
-                "CurrentPage": page
-            }
-        }
 
+    Strona 1 daje TotalPages — strony 2..N idą równolegle (FORUM_PAGE_WORKERS), scalane w kolejności.
+    """
+    # FIX 406 (potwierdzone przez IT forum): GetPostTree WYMAGA LoginActingAs (string) oraz
+    # MemberTypeActingAs (int: 1=user, 2=grupa). Bez nich serwer zwraca 406 Not Acceptable.
+    # Domyślnie czytamy z perspektywy konta wykonującego zapytanie (LoginRequestedBy), typ=user.
+    base_payload = _tree_payload(root_id, branch_id, leaf_id, login_requested_by,
+                                 login_acting_as, member_type_acting_as)
+    _lrb, _laa, _mta = (base_payload["LoginRequestedBy"], base_payload["LoginActingAs"],
+                        base_payload["MemberTypeActingAs"])
+
+    t0 = time.monotonic()
+    # Strona 1 — z pamięci, jeśli to samo drzewko czytano przed chwilą
+    page_key = (root_id, branch_id, leaf_id, _lrb, _laa, _mta)
+    with _FIRST_PAGE_LOCK:
+        memo = _FIRST_PAGE.get(page_key)
+    if memo and (time.time() - memo[0]) < FIRST_PAGE_TTL:
+        tree = memo[1]
+    else:
         try:
-            resp = requests.post(
-                f"{FORUM_API_BASE}/api/wpisy/GetPostTree",
-                headers=_headers(),
-                json=payload,
-                timeout=30
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            
-            if data.get("status") != "SUCCESS" or not data.get("tree"):
-                if page == 1:
-                    return {"success": False, "error": data.get("message", "Brak danych")}
-                break
-            
-            tree = data["tree"]
-            if page == 1:
-                thread_title = tree.get("Title", "")
-            
-            post_list = tree.get("PostList", [])
-            if not post_list:
-                break
-            
-            for p in post_list:
-                all_posts.append({
-                    "Id": p.get("Id"),
-                    "Do_Odpid": p.get("Do_Odpid"),
-                    "Text": p.get("Text", ""),
-                    "UserAddName": p.get("UserAddName", ""),
-                    "UserAddType": p.get("UserAddType"),       # brief §5.2: 1=user, 2=grupa
-                    "UserOdInGroup": p.get("UserOdInGroup"),   # brief §5.2: faktyczny autor gdy nadawca=grupa
-                    "UserToName": p.get("UserToName", ""),
-                    "DateAdd": p.get("DateAdd", ""),
-                    "Level": p.get("Level", 0),
-                    "Hierarchy": p.get("Hierarchy", ""),
-                })
-            
-            paging = tree.get("PagingInfo", {})
-            total_pages = paging.get("TotalPages", 1)
-            if page >= total_pages:
-                break
-        
+            tree, err = _fetch_tree_page(base_payload, 1)
         except Exception as e:
-            if page == 1:
-                return {"success": False, "error": str(e)}
-            break
-    
+            return {"success": False, "error": str(e)}
+        if tree is None:
+            return {"success": False, "error": err}
+        with _FIRST_PAGE_LOCK:
+            now = time.time()
+            for k in [k for k, (ts, _) in _FIRST_PAGE.items() if now - ts >= FIRST_PAGE_TTL]:
+                _FIRST_PAGE.pop(k, None)
+            _FIRST_PAGE[page_key] = (now, tree)
+
+    thread_title = tree.get("Title", "")
+    page_lists = [tree.get("PostList", [])]
+    all_pages = tree.get("PagingInfo", {}).get("TotalPages", 1) or 1
+    total_pages = min(all_pages, max_pages)
+
+    if page_lists[0] and total_pages > 1:
+        with ThreadPoolExecutor(max_workers=min(FORUM_PAGE_WORKERS, total_pages - 1)) as pool:
+            futures = [pool.submit(_fetch_tree_page, base_payload, n) for n in range(2, total_pages + 1)]
+            for fut in futures:  # w kolejności stron — jak dawniej: pierwsza dziura kończy
+                try:
+                    page_tree, _ = fut.result()
+                except Exception:
+                    page_tree = None
+                if not page_tree or not page_tree.get("PostList"):
+                    break
+                page_lists.append(page_tree["PostList"])
+
+    all_posts = [_parse_post(p) for post_list in page_lists for p in post_list]
+    _flog(f"READ: root={root_id}, branch={branch_id}, leaf={leaf_id}", level="DEBUG",
+          endpoint="forum_read", ms=round((time.monotonic() - t0) * 1000),
+          pages=len(page_lists), posts=len(all_posts), first_page_memo=bool(memo and tree is memo[1]))
     return {
         "success": True,
         "posts": all_posts,
         "thread_title": thread_title,
-        "count": len(all_posts)
+        "count": len(all_posts),
+        # False — drzewko ucięte (max_pages albo dziura w stronach): nie wszystkie wpisy przeczytane
+        "complete": len(page_lists) >= all_pages,
     }
 
 
+def _forget_first_pages():
+    """Po zapisie (CreatePost) strona 1 z pamięci jest nieaktualna."""
+    with _FIRST_PAGE_LOCK:
+        _FIRST_PAGE.clear()
+
+
 def forum_read_subtree(branch_id=None, leaf_id=None, root_id=None, from_post_id=None, nrzam=None):
     """
     Czyta wątek forum i wyciąga ORAZ FILTRUJE powiązane odpowiedzi.
@@ -450,9 +758,24 @@ def forum_read_subtree(branch_id=None, leaf_id=None, root_id=None, from_post_id=
     if not result.get("success"):
         return result
     
+    filtered, err = _filter_subtree(result["posts"], from_post_id, nrzam)
+    if err:
+        return {"success": False, "error": err}
+    
+    return {
+        "success": True,
+        "posts": filtered,
+        "thread_title": result["thread_title"],
+        "count": len(filtered)
+    }
+
+
+def _filter_subtree(posts, from_post_id, nrzam):
+    """Filtr forum_read_subtree na już pobranej liście wpisów (też dla odczytu zbiorczego).
+    Zwraca (wpisy posortowane po DateAdd, None) albo (None, komunikat błędu)."""
     start_hierarchy = None
     root_text = ""
-    for p in result["posts"]:
+    for p in posts:
         if p["Id"] == from_post_id:
             start_hierarchy = p["Hierarchy"]
             root_text = p.get("Text", "")
@@ -461,15 +784,15 @@ def forum_read_subtree(branch_id=None, leaf_id=None, root_id=None, from_post_id=
     # BEZPIECZNIK: Sprawdzamy, czy wczytany post faktycznie dotyczy naszego zamówienia
     if start_hierarchy and nrzam:
         if str(nrzam) not in root_text:
-            _flog(f"  → UWAGA! Post {from_post_id} dotyczy innego numeru niż {nrzam}! Ignoruję to fałszywe ID.")
+            _flog(f"  → UWAGA! Post {from_post_id} dotyczy innego numeru niż {nrzam}! Ignoruję to fałszywe ID.", level="WARNING")
             start_hierarchy = None  
     
     if not start_hierarchy and not nrzam:
-        return {"success": False, "error": f"Nie znaleziono wpisu {from_post_id} lub fałszywe ID"}
+        return None, f"Nie znaleziono wpisu {from_post_id} lub fałszywe ID"
     
     filtered = []
     seen_ids = set()
-    for p in result["posts"]:
+    for p in posts:
         pid = p["Id"]
         
         # 1. Pasuje do drzewka odpowiedzi (i przeszło bezpiecznik)
@@ -486,16 +809,9 @@ def forum_read_subtree(branch_id=None, leaf_id=None, root_id=None, from_post_id=
                 seen_ids.add(pid)
                 
     if not filtered:
-        return {"success": False, "error": f"Brak powiązanych postów dla zamówienia {nrzam}"}
+        return None, f"Brak powiązanych postów dla zamówienia {nrzam}"
         
-    filtered = sorted(filtered, key=lambda x: x.get("DateAdd", ""))
-    
-    return {
-        "success": True,
-        "posts": filtered,
-        "thread_title": result["thread_title"],
-        "count": len(filtered)
-    }
+    return sorted(filtered, key=lambda x: x.get("DateAdd", "")), None
 
 
 # ==========================================
@@ -546,38 +862,11 @@ def parse_forum_markers(ai_response):
 # DIAMENTY v1.5.7d "pomijamyPZ6" — decyzja na podstawie TREŚCI posta
 # ==========================================
 
-# Stop-lista: posty zawierające te słowa NIE są diamentami (bumpy/ponaglenia/eskalacje).
-# UWAGA: celowo BEZ "etykiet" — etykieta UPS punkt JEST diamentem (decyzja EA).
-DIAMOND_STOP_WORDS = re.compile(r'(bump|ponaglenie|eskalacja|dopyt|podbicie)', re.IGNORECASE)
-
-# Walidacja: prawdziwe zlecenie kuriera/etykiety zawsze zawiera "Zamówienie: NNN"
-_RE_DIAMOND_ZAMOWIENIE = re.compile(r'Zam[óo]wienie\s*[:=]\s*(\d+)', re.IGNORECASE)
-
-# Ekstrakcja z treści posta — tolerancja [:=] (tag C# w ai_text używa "=", treść posta ":")
-_RE_DIAMOND_TOWAR = re.compile(r'TOWAR_TYP\s*[:=]\s*(KOLEKTOR|SKRZYNIA)', re.IGNORECASE)
-# v1.5.7e: łapie też samo "Schenker" (normalizacja do DBSCHENKER w log_diamond)
-_RE_DIAMOND_KURIER = re.compile(r'Kurier\s*[:=]\s*(UPS|FEDEX|(?:DB[\s_]?)?SCHENKER)', re.IGNORECASE)
-_RE_DIAMOND_ETYKIETA = re.compile(r'(UPS_ETYKIETA_PUNKT|KURIER_OPCJA\s*[:=]\s*ETYKIETA_PUNKT)', re.IGNORECASE)
-_RE_DIAMOND_KURIER_SLOWO = re.compile(r'(Kurier\s*[:=]|KURIER_PRZEWOZNIK)', re.IGNORECASE)
-
-# v1.5.7e: typy NIE-diamentów ("anulowane") — frazy werdykt EA 1:1 (11.06.2026).
-# Te wpisy ZAPISUJĄ się do logu pod kluczem {numer}__{typ} (dedup per data+numer+typ),
-# ale NIE liczą się jako diamenty. Zamówione pokazują zamówione, anulowane osobno —
-# bez odejmowania jednych od drugich (werdykt EA).
-# zmiana: KOREKTA / zmiana terminu / nowy termin / przełożyć / zmienił datę /
-#         aktualizacja zlecenia / notatk (werdykt EA: notatki idą do korekty)
-_RE_TYP_ZMIANA = re.compile(
-    r'(KOREKTA|zmiana\s+terminu|nowy\s+termin|prze[łl]o[żz]|zmieni[łl]\s+dat|aktualizacja\s+zlecenia|notatk)',
-    re.IGNORECASE)
-# cofniete: WSTRZYMANIE / anulowanie / anulować / cofnięcie / rezygnacja
-_RE_TYP_COFNIETE = re.compile(
-    r'(WSTRZYMA|anulowa|cofni[ęe]|rezygnacj)',
-    re.IGNORECASE)
-# ponowienie: ponawiam / ponowienie / przypominam / brak odpowiedzi
-_RE_TYP_PONOWIENIE = re.compile(
-    r'(ponawiam|ponowieni|przypominam|brak\s+odpowiedzi)',
-    re.IGNORECASE)
-NIE_DIAMENT_TYPY = ("zmiana", "cofniete", "ponowienie")
+# Wzorce (stop-lista, "Zamówienie: NNN", towar/kurier, typy NIE-diamentów — frazy werdykt EA
+# 11.06.2026) żyją w post_classifier.FEATURES — osobne .search() na wzorzec, wynik pamiętany
+# po hashu treści (memo), więc ta sama treść nie jest skanowana ponownie.
+DIAMOND_STOP_WORDS = post_classifier.SINGLE["stop"]
+NIE_DIAMENT_TYPY = post_classifier.NIE_DIAMENT_TYPY
 
 
 def _validate_diamond_from_tresc(tresc):
@@ -590,11 +879,7 @@ def _validate_diamond_from_tresc(tresc):
     """
     if not tresc:
         return False
-    if not _RE_DIAMOND_ZAMOWIENIE.search(tresc):
-        return False
-    if DIAMOND_STOP_WORDS.search(tresc):
-        return False
-    return True
+    return post_classifier.classify(tresc)["diament"]
 
 
 def _classify_typ_zlecenia(tresc):
@@ -608,17 +893,7 @@ def _classify_typ_zlecenia(tresc):
     """
     if not tresc:
         return "inne"
-    if _RE_TYP_ZMIANA.search(tresc):
-        return "zmiana"
-    if _RE_TYP_COFNIETE.search(tresc):
-        return "cofniete"
-    if _RE_TYP_PONOWIENIE.search(tresc):
-        return "ponowienie"
-    if _RE_DIAMOND_ETYKIETA.search(tresc):
-        return "etykieta_ups_punkt"
-    if _RE_DIAMOND_KURIER_SLOWO.search(tresc):
-        return "kurier"
-    return "inne"
+    return post_classifier.classify(tresc)["typ"]
 
 
 def log_diamond(db, diamond_prefix, numer_zamowienia, operator, source_type,
@@ -631,7 +906,8 @@ def log_diamond(db, diamond_prefix, numer_zamowienia, operator, source_type,
     (diamenty) lub .../numbers/{numer}__{typ} (v1.5.7e, nie-diamenty:
     zmiana/cofniete/ponowienie — zapisywane, ale nie liczone jako diamenty).
     Dedup: pierwszy zapis dla danego klucza wygrywa — diamenty per (data, numer),
-    nie-diamenty per (data, numer, typ).
+    nie-diamenty per (data, numer, typ). Zapis przez create() (jedno RPC, odrzucane
+    gdy dokument już istnieje) — bez wyścigu get-then-set między operatorami a autopilotem.
     
     Źródła wywołania:
     - app_vertex_ew.py (operator) → source_type="operator"
@@ -647,42 +923,97 @@ def log_diamond(db, diamond_prefix, numer_zamowienia, operator, source_type,
     """
     if db is None:
         return
+    from google.api_core.exceptions import AlreadyExists
+    try:
+        built = _build_diamond_entry(db, diamond_prefix, numer_zamowienia, operator, source_type,
+                                     forum_post_id=forum_post_id, kurier=kurier, kategoria_towaru=kategoria_towaru,
+                                     cel=cel, grupa=grupa, pz=pz, bump=bump, tresc=tresc,
+                                     typ_zlecenia=typ_zlecenia, is_new_subthread=is_new_subthread)
+        if built is None:
+            return
+        doc_ref, entry = built
+        doc_ref.create(entry)
+        _flog(f"DIAMOND LOGGED: {entry['date_str']}/{doc_ref.id} | diament={entry['czy_diament']} | op={operator} | src={source_type} | cel={cel} | typ={entry.get('typ_zlecenia')} | kat={entry.get('kategoria_towaru')} | kurier={entry.get('kurier')}")
+    except AlreadyExists:
+        _flog(f"DIAMOND DEDUP: {entry['date_str']}/{doc_ref.id} już istnieje, pomijam")
+    except Exception as e:
+        # Połykamy błędy — log diamentu NIE może wywrócić wysyłki na forum
+        _flog(f"DIAMOND LOG ERROR (połknięty): {e}", level="ERROR")
+
+
+def log_diamonds_batch(db, items):
+    """Zbiorczy log_diamond: kilka diamentów z jednego execute_forum_actions w JEDNYM commicie.
+    items = lista słowników z argumentami log_diamond (bez db). Duplikaty w obrębie listy odrzucane
+    lokalnie; gdy któryś klucz już jest w bazie (create odrzuca cały batch) — pojedyncze create().
+    """
+    if db is None or not items:
+        return
+    if len(items) == 1:
+        log_diamond(db=db, **items[0])
+        return
+    built = {}
+    for kw in items:
+        try:
+            b = _build_diamond_entry(db, **kw)
+        except Exception as e:
+            _flog(f"DIAMOND LOG ERROR (połknięty): {e}", level="ERROR")
+            continue
+        if b is not None and b[0].path not in built:
+            built[b[0].path] = (b, kw)
+    if not built:
+        return
+    from google.api_core.exceptions import AlreadyExists, Conflict
+    batch = db.batch()
+    for (doc_ref, entry), _kw in built.values():
+        batch.create(doc_ref, entry)
+    try:
+        batch.commit()
+        _flog(f"DIAMOND LOGGED (batch): {len(built)} wpisów")
+    except (AlreadyExists, Conflict):
+        # Któryś klucz zajęty (dedup dnia) — atomowy batch nie przejdzie, lecimy pojedynczo
+        for (_b, kw) in built.values():
+            log_diamond(db=db, **kw)
+    except Exception as e:
+        _flog(f"DIAMOND LOG ERROR (połknięty): {e}", level="ERROR")
+
+
+def _build_diamond_entry(db, diamond_prefix, numer_zamowienia, operator, source_type,
+                         forum_post_id=None, kurier=None, kategoria_towaru=None,
+                         cel=None, grupa=None, pz=None, bump=None,
+                         tresc=None, typ_zlecenia=None, is_new_subthread=True):
+    """Klasyfikacja + budowa wpisu diamentu. Zwraca (doc_ref, entry) albo None (wpis odrzucony)."""
     # v1.5.7e: klasyfikacja typu z treści ZANIM walidacja diamentu —
     # typy zmiana/cofniete/ponowienie (NIE-diamenty, "anulowane") ZAPISUJĄ się
     # do logu pod kluczem {numer}__{typ}, ale NIE liczą się jako diamenty.
-    _typ_z_tresci = _classify_typ_zlecenia(tresc) if tresc else None
+    # Wszystkie cechy treści z jednego wywołania post_classifier.classify() (memo po treści).
+    _cechy = post_classifier.classify(tresc) if tresc else None
+    _typ_z_tresci = _cechy["typ"] if _cechy else None
     _czy_diament = True
     if _typ_z_tresci in NIE_DIAMENT_TYPY:
         typ_zlecenia = _typ_z_tresci
         _czy_diament = False
         # NIE-diament też musi mieć "Zamówienie: NNN" (klucz dokumentu);
         # stop-lista (bump/ponaglenie/eskalacja/dopyt/podbicie) odrzuca wpis całkowicie.
-        if not _RE_DIAMOND_ZAMOWIENIE.search(tresc) or DIAMOND_STOP_WORDS.search(tresc):
+        if not _cechy["diament"]:
             _flog(f"DIAMOND SKIP (nie-diament bez 'Zamówienie:' lub stop-słowo): nrzam={numer_zamowienia}")
-            return
+            return None
     else:
         # v1.5.7d: walidacja treści — post musi zawierać "Zamówienie: NNN"
         # i NIE może zawierać stop-słów (bump/ponaglenie/eskalacja/dopyt/podbicie)
-        if tresc is not None and not _validate_diamond_from_tresc(tresc):
+        if tresc is not None and not (_cechy and _cechy["diament"]):
             _flog(f"DIAMOND SKIP (walidacja treści): nrzam={numer_zamowienia} — brak 'Zamówienie:' lub stop-słowo")
-            return
+            return None
     # v1.5.7d: ekstrakcja z treści posta (regexy tolerują [:=]) — pierwszeństwo nad meta z apek
-    if tresc:
-        _m_towar = _RE_DIAMOND_TOWAR.search(tresc)
-        if _m_towar:
-            kategoria_towaru = "Kolektor" if _m_towar.group(1).upper() == "KOLEKTOR" else "Skrzynia biegów"
-        _m_kurier = _RE_DIAMOND_KURIER.search(tresc)
-        if _m_kurier:
-            kurier = _m_kurier.group(1).upper().replace(" ", "").replace("_", "")
-            # v1.5.7e: samo "Schenker" normalizowane do DBSCHENKER
-            if kurier == "SCHENKER":
-                kurier = "DBSCHENKER"
-        if not numer_zamowienia:
-            _m_nr = _RE_DIAMOND_ZAMOWIENIE.search(tresc)
-            if _m_nr:
-                numer_zamowienia = _m_nr.group(1)
+    if _cechy:
+        if _cechy["towar"]:
+            kategoria_towaru = _cechy["towar"]
+        if _cechy["kurier"]:
+            # v1.5.7e: samo "Schenker" znormalizowane do DBSCHENKER w klasyfikatorze
+            kurier = _cechy["kurier"]
+        if not numer_zamowienia and _cechy["zamowienie"]:
+            numer_zamowienia = _cechy["zamowienie"]
         if not typ_zlecenia:
-            typ_zlecenia = _classify_typ_zlecenia(tresc)
+            typ_zlecenia = _cechy["typ"]
     # REGUŁA "NOWE ID = DIAMENT" (🟥): zlecenie kuriera liczy się RAZ — przy pierwotnym
     # wpisie tworzącym nowy podwątek. Każdy wpis pod ISTNIEJĄCYM podwątkiem dla tego
     # zamówienia (reissue etykiety, korekta, "prosimy o nową etykietę", ponowne zlecenie)
@@ -703,71 +1034,116 @@ def log_diamond(db, diamond_prefix, numer_zamowienia, operator, source_type,
         elif kurier != "UPS":
             _anomalia_kolektor = True
     if not numer_zamowienia:
-        return
-    try:
-        from datetime import datetime
-        import pytz
-        from firebase_admin import firestore as _fs
-        
-        tz_pl = pytz.timezone('Europe/Warsaw')
-        now = datetime.now(tz_pl)
-        date_str = now.strftime("%Y-%m-%d")
-        
-        prefix = diamond_prefix or ""
-        coll_name = f"{prefix}ew_diamond_log"
-        # v1.5.7e: diamenty pod kluczem {numer} (wstecznie zgodne z zakładką Diamentoza);
-        # NIE-diamenty (zmiana/cofniete/ponowienie) pod {numer}__{typ} — dedup per
-        # (data, numer, typ): cofnięcie tego samego dnia nie blokuje (i nie jest
-        # blokowane przez) prawdziwego diamentu.
-        _doc_id = str(numer_zamowienia) if _czy_diament else f"{numer_zamowienia}__{typ_zlecenia}"
-        doc_ref = db.collection(coll_name).document(date_str).collection("numbers").document(_doc_id)
-        
-        # DEDUP: jeśli już istnieje wpis dla tego klucza — nie nadpisuj
+        return None
+    from datetime import datetime
+    import pytz
+    from firebase_admin import firestore as _fs
+    
+    tz_pl = pytz.timezone('Europe/Warsaw')
+    now = datetime.now(tz_pl)
+    date_str = now.strftime("%Y-%m-%d")
+    
+    prefix = diamond_prefix or ""
+    coll_name = f"{prefix}ew_diamond_log"
+    # v1.5.7e: diamenty pod kluczem {numer} (wstecznie zgodne z zakładką Diamentoza);
+    # NIE-diamenty (zmiana/cofniete/ponowienie) pod {numer}__{typ} — dedup per
+    # (data, numer, typ): cofnięcie tego samego dnia nie blokuje (i nie jest
+    # blokowane przez) prawdziwego diamentu.
+    _doc_id = str(numer_zamowienia) if _czy_diament else f"{numer_zamowienia}__{typ_zlecenia}"
+    doc_ref = db.collection(coll_name).document(date_str).collection("numbers").document(_doc_id)
+    
+    entry = {
+        "numer_zamowienia": str(numer_zamowienia),
+        "operator": operator or "?",
+        "source_type": source_type or "operator",
+        "logged_at": _fs.SERVER_TIMESTAMP,
+        "date_str": date_str,
+        "czy_diament": _czy_diament,
+    }
+    if _anomalia_kolektor:
+        entry["anomalia_kolektor_kurier"] = True
+    if forum_post_id:
+        entry["forum_post_id"] = forum_post_id
+    if kurier:
+        entry["kurier"] = kurier
+    if kategoria_towaru:
+        entry["kategoria_towaru"] = kategoria_towaru
+    if cel:
+        entry["cel"] = cel
+    if grupa:
+        entry["grupa"] = grupa
+    if pz:
+        entry["pz"] = pz
+    if bump is not None:
+        entry["bump"] = bump
+    if typ_zlecenia:
+        entry["typ_zlecenia"] = typ_zlecenia
+    return doc_ref, entry
+
+
+def _diamond_args_for(cel, user_do, tresc, diamond_prefix, source_type, diamond_meta, is_new_subthread):
+    """Argumenty log_diamond (bez forum_post_id) dla wpisu na wątek kurierski albo None.
+    SZTURZE_WSPARCIE / EA na wątku kurierskim = zgłoszenie problemu albo eskalacja, nigdy zamówienie kuriera."""
+    if cel not in ("AUTOS_KURIERZY", "KURIER_test") or user_do in ("SZTURZE_WSPARCIE", "EA"):
+        return None
+    _meta = diamond_meta or {}
+    return {
+        "diamond_prefix": diamond_prefix,
+        "numer_zamowienia": _meta.get("numer_zamowienia"),
+        "operator": _meta.get("operator"),
+        "source_type": source_type,
+        "kurier": _meta.get("kurier"),
+        "kategoria_towaru": _meta.get("kategoria_towaru"),
+        "cel": cel,
+        "grupa": _meta.get("grupa"),
+        "pz": _meta.get("pz"),
+        "bump": _meta.get("bump"),
+        "tresc": tresc,
+        "is_new_subthread": is_new_subthread,
+    }
+
+
+PHONE_LOG_LOOKBACK_DAYS = 14
+
+
+def phone_log_entry(db, col_fn, numer_zamowienia, base, user_do, post_id, link, tresc):
+    """Wpis rejestru telefonów dla wpisu do Telefonistów → (kolekcja delegacje dnia, dokument).
+    typ: "zlecenie", gdy treść to delegacja telefonu i w sprawie nie było wpisu przez
+    PHONE_LOG_LOOKBACK_DAYS dni, inaczej "ponaglenie". base — pola źródła (zlecil, grupa, bot, ...)."""
+    from firebase_admin import firestore as _fs
+    import pytz
+    nrzam = str(numer_zamowienia).strip()
+    now_pl = datetime.now(pytz.timezone("Europe/Warsaw"))
+    byl = False
+    for i in range(PHONE_LOG_LOOKBACK_DAYS):
+        ds = (now_pl - timedelta(days=i)).strftime("%Y-%m-%d")
         try:
-            existing = doc_ref.get()
-            if existing.exists:
-                _flog(f"DIAMOND DEDUP: {date_str}/{_doc_id} już istnieje, pomijam")
-                return
+            if any(True for _ in db.collection(col_fn("ew_phone_log")).document(ds).collection("delegacje")
+                   .where("numer_zamowienia", "==", nrzam).limit(1).stream()):
+                byl = True
+                break
         except Exception:
             pass
-        
-        entry = {
-            "numer_zamowienia": str(numer_zamowienia),
-            "operator": operator or "?",
-            "source_type": source_type or "operator",
-            "logged_at": _fs.SERVER_TIMESTAMP,
-            "date_str": date_str,
-            "czy_diament": _czy_diament,
-        }
-        if _anomalia_kolektor:
-            entry["anomalia_kolektor_kurier"] = True
-        if forum_post_id:
-            entry["forum_post_id"] = forum_post_id
-        if kurier:
-            entry["kurier"] = kurier
-        if kategoria_towaru:
-            entry["kategoria_towaru"] = kategoria_towaru
-        if cel:
-            entry["cel"] = cel
-        if grupa:
-            entry["grupa"] = grupa
-        if pz:
-            entry["pz"] = pz
-        if bump is not None:
-            entry["bump"] = bump
-        if typ_zlecenia:
-            entry["typ_zlecenia"] = typ_zlecenia
-        
-        doc_ref.set(entry, merge=False)
-        _flog(f"DIAMOND LOGGED: {date_str}/{_doc_id} | diament={_czy_diament} | op={operator} | src={source_type} | cel={cel} | typ={typ_zlecenia} | kat={kategoria_towaru} | kurier={kurier}")
-    except Exception as e:
-        # Połykamy błędy — log diamentu NIE może wywrócić wysyłki na forum
-        _flog(f"DIAMOND LOG ERROR (połknięty): {e}")
+    tresc = str(tresc or "")
+    jest_del = bool(re.search(r"delegacja telefonu", tresc, re.IGNORECASE))
+    ds = now_pl.strftime("%Y-%m-%d")
+    doc = dict(base or {}, **{
+        "numer_zamowienia": nrzam,
+        "typ": "zlecenie" if (jest_del and not byl) else "ponaglenie",
+        "do_kogo": str(user_do or ""),
+        "id_postu": str(post_id),
+        "link": link or "",
+        "tresc": tresc[:300],
+        "data_str": ds,
+        "godzina": now_pl.strftime("%H:%M"),
+        "created_at": _fs.SERVER_TIMESTAMP,
+    })
+    return db.collection(col_fn("ew_phone_log")).document(ds).collection("delegacje"), doc
 
 
 def execute_forum_actions(ai_response, forum_memory=None, user_od=None, ai_user=None,
                           db=None, source_type="operator", diamond_prefix="",
-                          is_diamond_candidate=False, diamond_meta=None):
+                          is_diamond_candidate=False, diamond_meta=None, outbox=None):
     """Wykonuje akcje forum (WRITE/READ) z markerów AI.
     
     Nowe parametry (opcjonalne, wstecznie bezpieczne):
@@ -780,6 +1156,10 @@ def execute_forum_actions(ai_response, forum_memory=None, user_od=None, ai_user=
           decyzja "czy diament" zapada w log_diamond na podstawie treści posta
     - diamond_meta: dict z polami fallback (numer_zamowienia, operator, grupa, pz, bump);
           kategoria_towaru / kurier / typ_zlecenia moduł sam parsuje z treści posta
+    - outbox: {"col_fn", "numer_zamowienia", "phone_log", "case_update"} — WRITE idzie do trwałej
+          kolejki (forum_outbox_enqueue) zamiast CreatePost w tej chwili; wynik ma queued=True.
+          Pamięć forum, rejestr telefonów, diament i case_update (flagi casa zależne od wpisu)
+          zapisuje wysyłacz dopiero po dostarczeniu.
     """
     markers = parse_forum_markers(ai_response)
     
@@ -797,6 +1177,7 @@ def execute_forum_actions(ai_response, forum_memory=None, user_od=None, ai_user=
     modified_response = ai_response
     forum_reads = []
     forum_writes = []
+    diamonds = []  # argumenty log_diamond — jeden commit po wszystkich markerach
     
     for marker in markers:
         if marker["type"] == "write":
@@ -824,6 +1205,25 @@ def execute_forum_actions(ai_response, forum_memory=None, user_od=None, ai_user=
             _cel_existed_before = bool(forum_memory) and (cel in forum_memory)
             _is_new_subthread = (not _cel_existed_before) and (not do_odp_id)
 
+            if outbox and db is not None:
+                _diamond_args = _diamond_args_for(cel, user_do, tresc, diamond_prefix, source_type,
+                                                  diamond_meta, _is_new_subthread)
+                _key, _is_new = forum_outbox_enqueue(
+                    db, outbox["col_fn"], outbox.get("numer_zamowienia"), cel, tresc,
+                    user_do=user_do, do_odp_id=do_odp_id, user_od=user_od, ai_user=ai_user, tytul=tytul,
+                    diamond=_diamond_args, phone_log=outbox.get("phone_log"),
+                    case_update=outbox.get("case_update"),
+                )
+                forum_writes.append({
+                    "success": True, "queued": True, "outbox_id": _key, "duplicate": not _is_new,
+                    "cel": cel, "tresc_skrot": tresc[:100] if tresc else "",
+                    "user_do": user_do or "", "tresc": tresc or "",
+                })
+                replacement = (f"📨 Wpis na forum ({cel}) w kolejce — wyśle się w tle."
+                               if _is_new else f"📨 Identyczny wpis na forum ({cel}) już jest w kolejce/wysłany.")
+                modified_response = modified_response.replace(marker["raw"], replacement)
+                continue
+
             result = forum_write_to_thread(
                 cel=cel,
                 tresc=tresc,
@@ -857,26 +1257,10 @@ def execute_forum_actions(ai_response, forum_memory=None, user_od=None, ai_user=
                 # SZTURZE_WSPARCIE / EA na wątku kurierskim = zgłoszenie problemu albo eskalacja,
                 # NIGDY zamówienie kuriera. Bez tego warunku nieudane zlecenie (§11.4.3) dałoby
                 # diament: treść ma "Zamówienie: NNN" i nie zawiera słów ze stop-listy.
-                if (cel in ("AUTOS_KURIERZY", "KURIER_test")
-                        and db is not None
-                        and user_do not in ("SZTURZE_WSPARCIE", "EA")):
-                    _meta = diamond_meta or {}
-                    log_diamond(
-                        db=db,
-                        diamond_prefix=diamond_prefix,
-                        numer_zamowienia=_meta.get("numer_zamowienia"),
-                        operator=_meta.get("operator"),
-                        source_type=source_type,
-                        forum_post_id=result.get("FORUM_ID"),
-                        kurier=_meta.get("kurier"),
-                        kategoria_towaru=_meta.get("kategoria_towaru"),
-                        cel=cel,
-                        grupa=_meta.get("grupa"),
-                        pz=_meta.get("pz"),
-                        bump=_meta.get("bump"),
-                        tresc=tresc,
-                        is_new_subthread=_is_new_subthread,
-                    )
+                _diamond_args = (_diamond_args_for(cel, user_do, tresc, diamond_prefix, source_type,
+                                                   diamond_meta, _is_new_subthread) if db is not None else None)
+                if _diamond_args:
+                    diamonds.append(dict(_diamond_args, forum_post_id=result.get("FORUM_ID")))
                 
                 replacement = (
                     f"✅ Wysłałem na forum ({cel}). "
@@ -968,6 +1352,9 @@ def execute_forum_actions(ai_response, forum_memory=None, user_od=None, ai_user=
             
             modified_response = modified_response.replace(marker["raw"], replacement)
     
+    if diamonds:
+        log_diamonds_batch(db, diamonds)
+    
     return {
         "response": modified_response,
         "forum_reads": forum_reads,
@@ -1160,7 +1547,7 @@ def _get_thread_raw(cel):
     # Case-insensitive fallback — gdyby AI wysłała 'czatosztur_fr' małymi
     for _k, _v in FORUM_THREADS.items():
         if _k.lower() == cel.lower():
-            _flog(f"THREAD LOOKUP: case-insensitive match: '{cel}' → '{_k}'")
+            _flog(f"THREAD LOOKUP: case-insensitive match: '{cel}' → '{_k}'", level="DEBUG")
             return _v
     return None
 
@@ -1181,23 +1568,23 @@ def forum_write_to_thread(cel, tresc, user_do=None, do_odp_id=None, forum_memory
     
     if do_odp_id:
         target_do_odp = do_odp_id
-        _flog(f"  DECYZJA: explicit do_odp_id={do_odp_id}")
+        _flog(f"  DECYZJA: explicit do_odp_id={do_odp_id}", level="DEBUG")
     elif forum_memory and cel in forum_memory:
         target_do_odp = forum_memory[cel].get("id")
-        _flog(f"  DECYZJA: kontynuacja z forum_memory, target={target_do_odp}")
+        _flog(f"  DECYZJA: kontynuacja z forum_memory, target={target_do_odp}", level="DEBUG")
     elif USE_NEW_SUBTHREADS:
         target_do_odp = None
-        _flog(f"  DECYZJA: NOWY PODWĄTEK (USE_NEW=True, do_odp_id=None)")
+        _flog(f"  DECYZJA: NOWY PODWĄTEK (USE_NEW=True, do_odp_id=None)", level="DEBUG")
     else:
         target_do_odp = info.get("korzen_id")
         if target_do_odp == "DIRECT":
             target_do_odp = 0
-            _flog(f"  DECYZJA: tryb DIRECT → nowy post w wątku (do_odp_id=0)")
+            _flog(f"  DECYZJA: tryb DIRECT → nowy post w wątku (do_odp_id=0)", level="DEBUG")
         elif target_do_odp is not None:
-            _flog(f"  DECYZJA: workaround korzen_id={target_do_odp}")
+            _flog(f"  DECYZJA: workaround korzen_id={target_do_odp}", level="DEBUG")
         else:
             target_do_odp = 0
-            _flog(f"  DECYZJA: brak korzenia → nowy post w wątku (do_odp_id=0)")
+            _flog(f"  DECYZJA: brak korzenia → nowy post w wątku (do_odp_id=0)", level="DEBUG")
     
     target_user = user_do or info.get("grupa", "EA")
     # "SELF" = wpis do własnej grupy piszącego (AUTOS_KURIERZY od v1.12 — §11.4.3).
@@ -1254,7 +1641,7 @@ def save_forum_memory(db, col_fn, numer_zamowienia, cel, forum_id, co=""):
     tz_pl = pytz.timezone('Europe/Warsaw')
     data_str = datetime.now(tz_pl).strftime("%Y-%m-%d %H:%M")
     
-    _flog(f"SAVE_MEMORY: nrzam={numer_zamowienia}, cel={cel}, forum_id={forum_id}")
+    _flog(f"SAVE_MEMORY: nrzam={numer_zamowienia}, cel={cel}, forum_id={forum_id}", level="DEBUG")
     
     entry = {
         "id": forum_id,
@@ -1269,13 +1656,13 @@ def save_forum_memory(db, col_fn, numer_zamowienia, cel, forum_id, co=""):
         if existing.exists:
             existing_posts = existing.to_dict().get("forum_posts", {})
             if cel in existing_posts:
-                _flog(f"  → JUŻ ISTNIEJE (nie nadpisuję, pierwotny id={existing_posts[cel].get('id')})")
+                _flog(f"  → JUŻ ISTNIEJE (nie nadpisuję, pierwotny id={existing_posts[cel].get('id')})", level="DEBUG")
                 return
         doc_ref.update({f"forum_posts.{cel}": entry})
-        _flog(f"  → ZAPISANO (update)")
+        _flog(f"  → ZAPISANO (update)", level="DEBUG")
     except Exception:
         doc_ref.set({"forum_posts": {cel: entry}})
-        _flog(f"  → ZAPISANO (set — nowy dokument)")
+        _flog(f"  → ZAPISANO (set — nowy dokument)", level="DEBUG")
 
 
 def load_forum_memory(db, col_fn, numer_zamowienia):
@@ -1285,24 +1672,146 @@ def load_forum_memory(db, col_fn, numer_zamowienia):
             result = doc.to_dict().get("forum_posts", {})
             return result
     except Exception as e:
-        _flog(f"LOAD_MEMORY BŁĄD: {e}")
+        _flog(f"LOAD_MEMORY BŁĄD: {e}", level="ERROR")
     return {}
 
 
-def auto_load_forum_context(db, col_fn, numer_zamowienia):
-    _flog(f"AUTO_LOAD: start, nrzam={numer_zamowienia}")
+FORUM_CTX_KEEP = 10  # ile ostatnich wpisów per cel trzymamy wyrenderowanych w forum_memory
+
+
+def _render_post_line(p):
+    date_str = _czas_lokalny(p.get('DateAdd'))   # UTC z forum -> czas lokalny
+    return (
+        f"  [{date_str}] {p['UserAddName']}{('(' + str(p.get('UserOdInGroup')) + ')') if p.get('UserOdInGroup') else ''} → {p['UserToName']}: "
+        f"{_strip_html(p['Text'][:400])}"
+    )
+
+
+FORUM_ANSWER_REFRESH = 600  # s — tyle zapisana odpowiedź człowieka wystarcza bez ponownego odczytu forum
+
+# Widoki high-water: każda ścieżka odczytu filtruje INNY zbiór wpisów (auto_load czyta gałąź korzenia,
+# check_forum_answer — podwątek, zbiorczy — cały korzeń), więc każda ma własny hw_id; wspólny znacznik
+# przesunięty przez szerszy odczyt chowałby węższemu wpisy, których ten jeszcze nie widział.
+HW_CTX = "ctx"                  # auto_load_forum_context
+HW_ANSWER = "answer"            # check_forum_answer (forum_read_subtree od wpisu)
+HW_ANSWER_BULK = "answer_bulk"  # check_forum_answers_bulk (odczyt korzenia + _filter_subtree)
+
+
+def _hw_view(info, view):
+    """Stan high-water widoku view z wpisu forum_memory.forum_posts[cel] ({} = jeszcze nie czytany)."""
+    return (info.get("hw") or {}).get(view) or {}
+
+
+def _apply_high_water(info, posts, view):
+    """Znacznik najwyższego widzianego wpisu (hw_id) per cel i widok — przetwarzamy TYLKO wpisy nowsze.
+    info = wpis z forum_memory.forum_posts[cel]; posts = wynik odczytu (posortowany po DateAdd).
+    Zwraca (stan, nowe_posty); stan = forum_posts.{cel}.hw.{view}:
+      hw_id / hw_date — ostatni widziany wpis, checked — kiedy czytano (epoch),
+      ctx — tylko widok HW_CTX: ostatnie FORUM_CTX_KEEP wyrenderowanych linii
+            [{id, h (człowiek?), a (autor), line}] (widoki odpowiedzi ich nie czytają),
+      count — ile wpisów łącznie, last_human — NAJNOWSZA odpowiedź nie-bota {author, date, text}.
+    """
+    prev = _hw_view(info, view)
+    hw = int(prev.get("hw_id") or 0)
+    state = {
+        "hw_id": hw,
+        "hw_date": prev.get("hw_date", ""),
+        "checked": time.time(),
+        "count": int(prev.get("count") or 0) if hw else 0,
+        "last_human": prev.get("last_human") if hw else None,
+    }
+    if view == HW_CTX:
+        state["ctx"] = list(prev.get("ctx") or []) if hw else []
+    new_posts = [p for p in posts if int(p.get("Id") or 0) > hw]
+    if not new_posts:
+        return state, []
+    if view == HW_CTX:
+        state["ctx"] = (state["ctx"] + [{
+            "id": p.get("Id"),
+            "h": p.get("UserAddName") != FORUM_USER,
+            "a": p.get("UserAddName", ""),
+            "line": _render_post_line(p),
+        } for p in new_posts])[-FORUM_CTX_KEEP:]
+    state["count"] += len(new_posts)
+    top = max(new_posts, key=lambda p: int(p.get("Id") or 0))
+    state["hw_id"] = int(top.get("Id") or 0)
+    state["hw_date"] = top.get("DateAdd", "")
+    humans = [p for p in new_posts if p.get("UserAddName") != FORUM_USER]
+    if humans:
+        last = max(humans, key=lambda p: int(p.get("Id") or 0))
+        state["last_human"] = {
+            "author": last.get("UserAddName"),
+            "date": (last.get("DateAdd") or "")[:16],
+            "text": _strip_html((last.get("Text") or "")[:200]),
+        }
+    return state, new_posts
+
+
+def _latest_answer(found):
+    """Z listy (cel, last_human) — najnowsza odpowiedź (po dacie) albo None."""
+    found = [f for f in found if f[1]]
+    return max(found, key=lambda f: f[1].get("date") or "") if found else None
+
+
+def _cached_answer(celes, view):
+    """Odpowiedź z forum_memory bez odczytu forum — tylko gdy KAŻDY cel był czytany w tym widoku
+    w ostatnich FORUM_ANSWER_REFRESH s (inaczej mogła przyjść nowsza odpowiedź) i któryś ma last_human."""
+    now = time.time()
+    found = []
+    for cel, info in celes:
+        state = _hw_view(info, view)
+        if now - float(state.get("checked") or 0) >= FORUM_ANSWER_REFRESH:
+            return None
+        found.append((cel, state.get("last_human")))
+    return _latest_answer(found)
+
+
+def _save_high_water(db, col_fn, numer_zamowienia, states, batch=None):
+    """Jeden zapis forum_memory dla wszystkich celów/widoków: states = {cel: {view: stan}}.
+    set(merge=True) z zagnieżdżonym słownikiem — działa też, gdy dokumentu jeszcze nie ma
+    (update() na brakującym dokumencie rzuca NotFound i znacznik po cichu przepadał).
+    Widoki odpowiedzi nie trzymają ctx — merge nie usuwa pól, więc ctx zapisany tam wcześniej
+    kasujemy jawnie (DELETE_FIELD)."""
+    if not states:
+        return
+    from firebase_admin import firestore as _fs
+    upd = {"forum_posts": {cel: {"hw": {
+        view: state if view == HW_CTX else {**state, "ctx": _fs.DELETE_FIELD}
+        for view, state in views.items()
+    }} for cel, views in states.items()}}
+    ref = db.collection(col_fn("forum_memory")).document(str(numer_zamowienia))
+    if batch is not None:
+        batch.set(ref, upd, merge=True)
+        return
+    try:
+        ref.set(upd, merge=True)
+    except Exception as e:
+        _flog(f"HIGH_WATER zapis nieudany ({numer_zamowienia}): {e}", level="WARNING")
+
+
+def auto_load_forum_context(db, col_fn, numer_zamowienia, persist=True):
+    """Kontekst forum casa: [FORUM_CONTEXT: cel] + wyrenderowane wpisy (od hw_id nowe).
+    persist=False — podgląd tylko do odczytu (np. case jeszcze niezarezerwowany): bez pełnego skanu,
+    bez zapisu forum_memory / high-water i bez zapamiętywania postów w sesji.
+    """
+    _flog(f"AUTO_LOAD: start, nrzam={numer_zamowienia}, persist={persist}")
     
     try:
         memory = load_forum_memory(db, col_fn, numer_zamowienia)
         
         if not memory:
-            memory = _scan_forum_for_case(db, col_fn, str(numer_zamowienia))
+            memory = forum_index_lookup(db, col_fn, numer_zamowienia, persist=persist)
+            if not memory and persist:
+                # indeks nie zna numeru (jeszcze nie przeszedł, wpis po ostatnim przebiegu,
+                # ucięte drzewko) — pełny skan; trafienie trafia do forum_memory
+                memory = _scan_forum_for_case(db, col_fn, str(numer_zamowienia))
         
         if not memory:
             _flog(f"AUTO_LOAD: scan też pusty → zwracam pusty kontekst")
             return ""
         
         context_parts = []
+        hw_states = {}
         for cel, info in memory.items():
             forum_id = info.get("id")
             if not forum_id:
@@ -1323,57 +1832,59 @@ def auto_load_forum_context(db, col_fn, numer_zamowienia):
                     result = forum_read_subtree(leaf_id=forum_id, root_id=root_id, from_post_id=forum_id, nrzam=numer_zamowienia)
             else:
                 if thread_info and thread_info.get("korzen_id") and thread_info.get("korzen_id") != "DIRECT":
-                    _flog(f"  → subtree: branch={thread_info['korzen_id']}, from={forum_id}")
+                    _flog(f"  → subtree: branch={thread_info['korzen_id']}, from={forum_id}", level="DEBUG")
                     result = forum_read_subtree(branch_id=thread_info["korzen_id"], from_post_id=forum_id, nrzam=numer_zamowienia)
                 else:
-                    _flog(f"  → subtree (brak korzenia/DIRECT): branch={forum_id}, from={forum_id}")
+                    _flog(f"  → subtree (brak korzenia/DIRECT): branch={forum_id}, from={forum_id}", level="DEBUG")
                     result = forum_read_subtree(branch_id=forum_id, from_post_id=forum_id, nrzam=numer_zamowienia)
                     
                     if not result.get("success"):
-                         _flog(f"  → fallback leaf z filtrem: forum_id={forum_id}")
+                         _flog(f"  → fallback leaf z filtrem: forum_id={forum_id}", level="DEBUG")
                          result = forum_read_subtree(leaf_id=forum_id, root_id=root_id, from_post_id=forum_id, nrzam=numer_zamowienia)
             
             _flog(f"  → wynik odczytu: success={result.get('success')}, postow={result.get('count', 0)}")
             co = info.get("co", cel)
             
             if result.get("success") and result.get("posts"):
-                posts = result["posts"][-10:]
-                try:
-                    _zapamietaj_posty(numer_zamowienia, [{
-                        "Id": p.get("Id"),
-                        "Do_Odpid": p.get("Do_Odpid"),
-                        "Hierarchy": p.get("Hierarchy", ""),
-                        **_rozbij_autora(p.get("UserAddName", ""), p.get("UserOdInGroup", "")),
-                        "Czas": _czas_lokalny(p.get("DateAdd")),
-                        "Tekst": _strip_html(str(p.get("Text") or ""))[:300],
-                    } for p in result["posts"]])
-                except Exception:
-                    pass
+                state, new_posts = _apply_high_water(info, result["posts"], HW_CTX)
+                if new_posts:
+                    hw_states[cel] = {HW_CTX: state}
+                _flog(f"  → nowych wpisów od hw: {len(new_posts)} (hw_id={state['hw_id']})")
+                if persist:  # podgląd nie zapisuje struktury wpisów w sesji
+                    try:
+                        _zapamietaj_posty(numer_zamowienia, [{
+                            "Id": p.get("Id"),
+                            "Do_Odpid": p.get("Do_Odpid"),
+                            "Hierarchy": p.get("Hierarchy", ""),
+                            **_rozbij_autora(p.get("UserAddName", ""), p.get("UserOdInGroup", "")),
+                            "Czas": _czas_lokalny(p.get("DateAdd")),
+                            "Tekst": _strip_html(str(p.get("Text") or ""))[:300],
+                        } for p in result["posts"]])
+                    except Exception:
+                        pass
                 
-                human_replies = [p for p in posts if p.get("UserAddName") != FORUM_USER]
+                # Kontekst z zapisanych linii + dopisane nowe — stare wpisy nie są renderowane ponownie
+                human_replies = [c for c in state["ctx"] if c.get("h")]
                 
                 if human_replies:
-                    context_parts.append(f"[FORUM_CONTEXT: {cel}] ({co}, {result['count']} postów. Ostatnia odpowiedź od: {human_replies[-1].get('UserAddName')})")
+                    context_parts.append(f"[FORUM_CONTEXT: {cel}] ({co}, {state['count']} postów. Ostatnia odpowiedź od: {human_replies[-1].get('a')})")
                 else:
                     context_parts.append(f"[FORUM_CONTEXT: {cel}] ({co}, brak nowych odpowiedzi)")
                 
-                for p in posts:
-                    date_str = _czas_lokalny(p.get('DateAdd'))   # UTC z forum -> czas lokalny
-                    context_parts.append(
-                        f"  [{date_str}] {p['UserAddName']}{('(' + str(p.get('UserOdInGroup')) + ')') if p.get('UserOdInGroup') else ''} → {p['UserToName']}: "
-                        f"{_strip_html(p['Text'][:400])}"
-                    )
+                context_parts.extend(c["line"] for c in state["ctx"])
             else:
                 err_msg = result.get("error", "API zwróciło pustą listę")
-                _flog(f"  → UWAGA: błąd lub brak postów ({err_msg}). Dodaję bezpiecznik.")
+                _flog(f"  → UWAGA: błąd lub brak postów ({err_msg}). Dodaję bezpiecznik.", level="WARNING")
                 context_parts.append(f"[FORUM_CONTEXT: {cel}] ({co}, w pamięci istnieje wpis ID={forum_id}, ale odczyt nie znalazł odpowiedzi. Zakładam: brak nowych odpowiedzi.)")
 
+        if persist:
+            _save_high_water(db, col_fn, numer_zamowienia, hw_states)
         if context_parts:
             return "\n".join(context_parts)
         return ""
         
     except Exception as e:
-        _flog(f"AUTO_LOAD BŁĄD KRYTYCZNY: {e}\n{traceback.format_exc()}")
+        _flog(f"AUTO_LOAD BŁĄD KRYTYCZNY: {e}\n{traceback.format_exc()}", level="ERROR")
         return ""
 
 
@@ -1383,19 +1894,36 @@ def check_forum_answer(db, col_fn, numer_zamowienia, cel_filter=None):
     Reużywa pamięci forum + forum_read_subtree (jeden GetPostTree na cel — bez ciężkiego skanu).
     Decyzja per ustalenie użytkownika: liczy się KAŻDY wpis nie-bota pod wątkiem (UserAddName != FORUM_USER).
     cel_filter (opcjonalnie): zbiór/lista nazw cel — sprawdzaj tylko te wątki (np. TEL-owe).
+    Odpowiedź zapisana w forum_memory (last_human, widok HW_ANSWER) wystarcza bez zapytania do forum
+    przez FORUM_ANSWER_REFRESH s od odczytu; potem wątki są doczytywane (tylko wpisy nowsze niż hw_id),
+    żeby zwrócić NAJNOWSZĄ odpowiedź ze wszystkich celów.
     Zwraca: {answered: bool, last_author, last_date, last_text, cel}.
     """
     out = {"answered": False, "last_author": None, "last_date": None, "last_text": None, "cel": None}
+
+    def _answered(cel, last):
+        out.update({
+            "answered": True,
+            "last_author": last.get("author"),
+            "last_date": last.get("date"),
+            "last_text": last.get("text"),
+            "cel": cel,
+        })
+        return out
+
     try:
         memory = load_forum_memory(db, col_fn, numer_zamowienia)
         if not memory:
             return out
-        for cel, info in memory.items():
-            if cel_filter and cel not in cel_filter:
-                continue
+        celes = [(cel, info) for cel, info in memory.items()
+                 if (not cel_filter or cel in cel_filter) and info.get("id")]
+        # Świeżo sprawdzona odpowiedź człowieka → bez zapytania do forum
+        cached = _cached_answer(celes, HW_ANSWER)
+        if cached:
+            return _answered(*cached)
+        hw_states, found = {}, []
+        for cel, info in celes:
             forum_id = info.get("id")
-            if not forum_id:
-                continue
             result = forum_read_subtree(branch_id=forum_id, from_post_id=forum_id, nrzam=numer_zamowienia)
             if not result.get("success"):
                 # Fallback jak w auto_load_forum_context: czytaj korzeń wątku i filtruj po hierarchii+nrzam.
@@ -1405,23 +1933,101 @@ def check_forum_answer(db, col_fn, numer_zamowienia, cel_filter=None):
                                             from_post_id=forum_id, nrzam=numer_zamowienia)
             if not result.get("success") or not result.get("posts"):
                 continue
-            human = [p for p in result["posts"] if p.get("UserAddName") != FORUM_USER]
-            if human:
-                last = human[-1]
-                out.update({
-                    "answered": True,
-                    "last_author": last.get("UserAddName"),
-                    "last_date": (last.get("DateAdd") or "")[:16],
-                    "last_text": _strip_html((last.get("Text") or "")[:200]),
-                    "cel": cel,
-                })
-                return out
-        return out
+            # Tylko wpisy nowsze niż hw_id — „czy coś nowego od nie-bota od ostatniego sprawdzenia?"
+            state, new_posts = _apply_high_water(info, result["posts"], HW_ANSWER)
+            if new_posts or state["last_human"]:  # last_human: odśwież checked, by cache działał
+                hw_states[cel] = {HW_ANSWER: state}
+            found.append((cel, state["last_human"]))
+        _save_high_water(db, col_fn, numer_zamowienia, hw_states)
+        latest = _latest_answer(found)
+        return _answered(*latest) if latest else out
     except Exception as e:
-        _flog(f"CHECK_FORUM_ANSWER BŁĄD: {e}")
+        _flog(f"CHECK_FORUM_ANSWER BŁĄD: {e}", level="ERROR")
         return out
 
 
+FORUM_BULK_MAX_PAGES = 10  # odczyt zbiorczy czyta cały korzeń — więcej stron niż pojedynczy subtree
+
+
+def check_forum_answers_bulk(db, col_fn, numery_zamowien, cel_filter=None):
+    """Zbiorcza wersja check_forum_answer dla całego woreczka.
+    forum_memory wszystkich numerów jednym get_all, wątki grupowane po korzeniu (FORUM_THREADS) —
+    każdy korzeń czytany RAZ, podwątki wycinane lokalnie (_filter_subtree). Wynik (także „brak
+    odpowiedzi") z pełnego odczytu korzenia jest ostateczny; pojedynczo (check_forum_answer) sprawdzane
+    są tylko numery, których podwątku w odczycie nie ma, i numery z korzenia uciętego na max_pages.
+    Zwraca {nrzam: wynik jak w check_forum_answer} — dla każdego numeru wynik aktualny na teraz.
+    """
+    numery = list(dict.fromkeys(str(n) for n in numery_zamowien if n))
+    out = {n: {"answered": False, "last_author": None, "last_date": None, "last_text": None, "cel": None}
+           for n in numery}
+    if not numery:
+        return out
+
+    def _answered(n, cel, last):
+        out[n].update({"answered": True, "last_author": last.get("author"), "last_date": last.get("date"),
+                       "last_text": last.get("text"), "cel": cel})
+
+    mem_col = db.collection(col_fn("forum_memory"))
+    memories = {}
+    for i in range(0, len(numery), 300):
+        for snap in db.get_all([mem_col.document(n) for n in numery[i:i + 300]]):
+            if snap.exists:
+                memories[snap.id] = (snap.to_dict() or {}).get("forum_posts", {})
+
+    by_root = {}  # root_post_id -> [(nrzam, cel, info)]
+    for n, memory in memories.items():
+        celes = [(cel, info) for cel, info in memory.items()
+                 if (not cel_filter or cel in cel_filter) and info.get("id")]
+        known = _cached_answer(celes, HW_ANSWER_BULK)
+        if known:
+            _answered(n, *known)
+            continue
+        for cel, info in celes:
+            by_root.setdefault((_get_thread_raw(cel) or {}).get("post_id"), []).append((n, cel, info))
+
+    fallback = set()
+    hw_states = {}  # nrzam -> {cel: {HW_ANSWER_BULK: stan}}
+    found = {}      # nrzam -> [(cel, last_human)]
+    for root, items in by_root.items():
+        result = forum_read(root_id=root, max_pages=FORUM_BULK_MAX_PAGES) if root else {"success": False}
+        posts = result.get("posts") if result.get("success") else None
+        if posts and not result.get("complete", True):
+            posts = None  # ucięty korzeń — najnowsze wpisy mogły się nie zmieścić, sprawdzamy pojedynczo
+        for n, cel, info in items:
+            if not posts:
+                fallback.add(n)
+                continue
+            filtered, _err = _filter_subtree(posts, info["id"], n)
+            if not filtered:
+                fallback.add(n)
+                continue
+            state, new_posts = _apply_high_water(info, filtered, HW_ANSWER_BULK)
+            if new_posts or state["last_human"]:
+                hw_states.setdefault(n, {})[cel] = {HW_ANSWER_BULK: state}
+            found.setdefault(n, []).append((cel, state["last_human"]))
+    for n, items in found.items():
+        latest = _latest_answer(items)
+        if latest and n not in fallback:
+            _answered(n, *latest)
+    _flog(f"CHECK_BULK: {len(numery)} numerów, {len(by_root)} korzeni, pojedynczo: {len(fallback)}")
+
+    if hw_states:
+        items = list(hw_states.items())
+        for i in range(0, len(items), 400):
+            batch = db.batch()
+            for n, states in items[i:i + 400]:
+                _save_high_water(db, col_fn, n, states, batch=batch)
+            try:
+                batch.commit()
+            except Exception as e:
+                _flog(f"CHECK_BULK: zapis hw nieudany: {e}", level="WARNING")
+
+    for n in fallback:
+        if not out[n]["answered"]:
+            out[n] = check_forum_answer(db, col_fn, n, cel_filter=cel_filter)
+    return out
+
+
 def load_forum_context_by_id(db, col_fn, numer_zamowienia, cel, forum_id):
     _flog(f"LOAD_BY_ID: nrzam={numer_zamowienia}, cel={cel}, forum_id={forum_id}")
 
@@ -1446,7 +2052,7 @@ def load_forum_context_by_id(db, col_fn, numer_zamowienia, cel, forum_id):
         try:
             save_forum_memory(db, col_fn, numer_zamowienia, cel, forum_id, f"manual: {cel}")
         except Exception as e:
-            _flog(f"  → błąd zapisu memory: {e}")
+            _flog(f"  → błąd zapisu memory: {e}", level="WARNING")
     else:
         context_parts.append(
             f"[FORUM_CONTEXT: {cel}] (wpis id={forum_id}, brak treści do odczytu — "
@@ -1460,6 +2066,27 @@ def load_forum_context_by_id(db, col_fn, numer_zamowienia, cel, forum_id):
     return "\n".join(context_parts)
 
 
+def _match_cel(root_post_id, text):
+    """Do którego celu (FORUM_THREADS) należy wpis bota z wątku root_post_id — po słowach kluczowych,
+    a gdy żadne nie pasuje: pierwszy cel z tym korzeniem."""
+    text_lower = text.lower()
+    for c, cinfo in FORUM_THREADS.items():
+        if cinfo.get("post_id") != root_post_id:
+            continue
+        if "AUTOS_KURIERZY" == c and ("kurier" in text_lower or "zlecenie kuri" in text_lower or "etykiet" in text_lower):
+            return c
+        elif "CZATOSZTUR_" in c and ("delegacja" in text_lower or "telefon" in text_lower):
+            return c
+        elif "SPEDYCJA" in c and ("spedycj" in text_lower or "reklamacj" in text_lower):
+            return c
+        elif "NIEPOZAMYKANE" in c and ("austausch" in text_lower or "zielonk" in text_lower):
+            return c
+    for c, cinfo in FORUM_THREADS.items():
+        if cinfo.get("post_id") == root_post_id:
+            return c
+    return None
+
+
 def _scan_forum_for_case(db, col_fn, numer_zamowienia):
     found = {}
     nrzam = str(numer_zamowienia)
@@ -1488,29 +2115,7 @@ def _scan_forum_for_case(db, col_fn, numer_zamowienia):
                 if not post_forum_id:
                     continue
                 
-                text_lower = text.lower()
-                matched_cel = None
-                for c, cinfo in FORUM_THREADS.items():
-                    if cinfo.get("post_id") != post_id:
-                        continue
-                    if "AUTOS_KURIERZY" == c and ("kurier" in text_lower or "zlecenie kuri" in text_lower or "etykiet" in text_lower):
-                        matched_cel = c
-                        break
-                    elif "CZATOSZTUR_" in c and ("delegacja" in text_lower or "telefon" in text_lower):
-                        matched_cel = c
-                        break
-                    elif "SPEDYCJA" in c and ("spedycj" in text_lower or "reklamacj" in text_lower):
-                        matched_cel = c
-                        break
-                    elif "NIEPOZAMYKANE" in c and ("austausch" in text_lower or "zielonk" in text_lower):
-                        matched_cel = c
-                        break
-                
-                if not matched_cel:
-                    for c, cinfo in FORUM_THREADS.items():
-                        if cinfo.get("post_id") == post_id:
-                            matched_cel = c
-                            break
+                matched_cel = _match_cel(post_id, text)
                 
                 if matched_cel and matched_cel not in found:
                     is_root = post.get("Do_Odpid") == 0 or post.get("Level") == 0
@@ -1524,7 +2129,469 @@ def _scan_forum_for_case(db, col_fn, numer_zamowienia):
                     except Exception:
                         pass
         except Exception as e:
-            _flog(f"SCAN ERROR: {e}")
+            _flog(f"SCAN ERROR: {e}", level="ERROR")
             continue
     
     return found if found else None
+
+
+# ==========================================
+# INDEKS NrZam → wpisy forum (zastępuje pełny skan przy zimnym starcie)
+# ==========================================
+# Dokument {col}forum_index/{nrzam}: {"entries": {cel: {id, is_root, root, last_activity}}}
+# Stan indeksera {col}forum_index_meta/roots: {"roots": {str(root_post_id): {hw, pages, full_at, scan_from}},
+# "lease_owner", "lease_until", "updated_at"}.
+# Przebieg czyta z korzenia tylko strony, na których mogą być wpisy nowsze niż hw: od strony 1 do pierwszej
+# strony bez nowych (drzewko od najnowszych) oraz od ostatnio znanej ostatniej strony do końca (drzewko
+# od najstarszych). Raz na FORUM_INDEX_FULL_EVERY pełny przegląd — po FORUM_INDEX_MAX_PAGES stron na
+# przebieg, kontynuowany od scan_from, więc korzeń dłuższy niż limit też zostaje przeczytany do końca.
+# Jeden indekser na wdrożenie: przebieg robi tylko proces z dzierżawą (lease) w dokumencie stanu —
+# pozostałe procesy (obie apki, kilka replik) tylko sprawdzają dzierżawę.
+# Numery — gramatyka NrZam parsera puli (szturchacz_parser.nrzam_tokens). Brak numeru → auto_load robi skan.
+FORUM_INDEX_INTERVAL = 1800          # s — co ile indekser w tle dociąga nowe wpisy
+FORUM_INDEX_MAX_PAGES = 50           # stron jednego korzenia na przebieg
+FORUM_INDEX_FULL_EVERY = 24 * 3600   # s — co ile pełny przegląd korzenia (wpisy wstawione w środek drzewka)
+FORUM_INDEX_LEASE = 2 * FORUM_INDEX_INTERVAL
+_INDEXER_ID = f"{os.getpid()}-{random.getrandbits(32):08x}"  # właściciel dzierżawy (ten proces)
+_INDEXERS = {}                  # kolekcja indeksu -> wątek (jeden wątek na proces i prefiks)
+_INDEXERS_LOCK = threading.Lock()
+
+
+def _index_root_pages(root, state):
+    """Czyta strony korzenia potrzebne w tym przebiegu. Zwraca (wpisy, nowy stan, pełny przegląd?);
+    błąd którejkolwiek strony → (None, stary stan, False) — następny przebieg powtórzy te strony."""
+    base = _tree_payload(root_id=root)
+    try:
+        first, _err = _fetch_tree_page(base, 1)
+    except Exception as e:
+        _flog(f"INDEX: korzeń {root} strona 1: {e}", level="WARNING")
+        return None, state, False
+    if first is None:
+        return None, state, False
+    total = first.get("PagingInfo", {}).get("TotalPages", 1) or 1
+    hw = int(state.get("hw") or 0)
+    now = time.time()
+    pages = {1: first.get("PostList", [])}
+
+    def _read(n):
+        if n not in pages:
+            tree, err = _fetch_tree_page(base, n)
+            if tree is None:
+                raise RuntimeError(err)
+            pages[n] = tree.get("PostList") or []
+        return pages[n]
+
+    new = dict(state)
+    scan_from = int(state.get("scan_from") or 0)
+    full = bool(scan_from) or now - float(state.get("full_at") or 0) > FORUM_INDEX_FULL_EVERY
+    try:
+        _index_read_range(_read, full, new, total, hw, now)
+    except Exception as e:
+        _flog(f"INDEX: korzeń {root}: {e} — stan bez zmian", level="WARNING")
+        return None, state, False
+    new["pages"] = total
+    posts = [_parse_post(p) for n in sorted(pages) for p in pages[n]]
+    new["hw"] = max([hw] + [int(p.get("Id") or 0) for p in posts])
+    return posts, new, full
+
+
+def _index_read_range(read, full, new, total, hw, now):
+    """Wybór stron dla _index_root_pages (patrz opis sekcji); uzupełnia scan_from/full_at w new."""
+    if full:
+        # pełny przegląd, porcjami
+        start = max(int(new.get("scan_from") or 0), 1)
+        stop = min(total, start + FORUM_INDEX_MAX_PAGES - 1)
+        for n in range(start, stop + 1):
+            read(n)
+        new["scan_from"] = 0 if stop >= total else stop + 1
+        if not new["scan_from"]:
+            new["full_at"] = now
+    else:
+        # od najnowszych: strony od 1, dopóki niosą wpisy nowsze niż hw
+        n = 1
+        while n <= min(total, FORUM_INDEX_MAX_PAGES):
+            if not any(int(p.get("Id") or 0) > hw for p in read(n)):
+                break
+            n += 1
+        # od najstarszych: ostatnia znana strona (mogła się dopełnić) i nowe strony za nią
+        last = max(1, int(new.get("pages") or total))
+        for n in range(last, min(total, last + FORUM_INDEX_MAX_PAGES - 1) + 1):
+            read(n)
+
+
+def _index_take_lease(db, meta_ref):
+    """Dzierżawa indeksera w transakcji — True, gdy ten proces ma robić przebieg."""
+    from firebase_admin import firestore as _fs
+
+    @_fs.transactional
+    def _txn(transaction):
+        snap = meta_ref.get(transaction=transaction)
+        meta = (snap.to_dict() or {}) if snap.exists else {}
+        now = time.time()
+        if meta.get("lease_owner") not in (None, _INDEXER_ID) and meta.get("lease_until", 0) > now:
+            return False
+        transaction.set(meta_ref, {"lease_owner": _INDEXER_ID, "lease_until": now + FORUM_INDEX_LEASE}, merge=True)
+        return True
+
+    return _txn(db.transaction())
+
+
+def forum_index_refresh(db, col_fn):
+    """Jeden przebieg indeksera: z każdego korzenia FORUM_THREADS bierze wpisy bota nowsze niż
+    zapamiętany hw (tylko strony, na których mogą być — _index_root_pages), wyciąga numery zamówień
+    i dopisuje je do indeksu (get_all + jeden batch). Zwraca liczbę zaktualizowanych numerów."""
+    meta_ref = db.collection(col_fn("forum_index_meta")).document("roots")
+    roots_state = dict((meta_ref.get().to_dict() or {}).get("roots", {}))
+    found = {}  # nrzam -> {cel: {...}}
+    for root in sorted({info.get("post_id") for info in FORUM_THREADS.values() if info.get("post_id")}):
+        state = roots_state.get(str(root)) or {}
+        posts, roots_state[str(root)], full = _index_root_pages(root, state)
+        if not posts:
+            continue
+        root_hw = 0 if full else int(state.get("hw") or 0)
+        for post in posts:
+            pid = int(post.get("Id") or 0)
+            if pid <= root_hw or post.get("UserAddName") != FORUM_USER:
+                continue
+            text = _strip_html(post.get("Text", "") or "")
+            cel = _match_cel(root, text)
+            if not cel:
+                continue
+            for nrzam in szturchacz_parser.nrzam_tokens(text):
+                entry = found.setdefault(nrzam, {}).get(cel)
+                if entry is None or pid < entry["id"]:
+                    # Jak w skanie: pierwszy (najstarszy) wpis bota wskazuje podwątek casa
+                    found[nrzam][cel] = {
+                        "id": pid,
+                        "is_root": post.get("Do_Odpid") == 0 or post.get("Level") == 0,
+                        "root": root,
+                        "last_activity": max(post.get("DateAdd", ""), (entry or {}).get("last_activity", "")),
+                    }
+                else:
+                    entry["last_activity"] = max(entry["last_activity"], post.get("DateAdd", ""))
+
+    if found:
+        idx = db.collection(col_fn("forum_index"))
+        existing = {snap.id: (snap.to_dict() or {}).get("entries", {})
+                    for snap in db.get_all([idx.document(n) for n in found]) if snap.exists}
+        items = list(found.items())
+        for i in range(0, len(items), 400):
+            batch = db.batch()
+            for nrzam, cels in items[i:i + 400]:
+                old = existing.get(nrzam, {})
+                upd = {}
+                for cel, entry in cels.items():
+                    if cel in old:
+                        # Podwątek już znany — tylko świeższa aktywność
+                        upd[cel] = {"last_activity": max(entry["last_activity"], old[cel].get("last_activity", ""))}
+                    else:
+                        upd[cel] = entry
+                batch.set(idx.document(nrzam), {"entries": upd}, merge=True)
+            batch.commit()
+    from firebase_admin import firestore as _fs
+    meta_ref.set({"roots": roots_state, "updated_at": _fs.SERVER_TIMESTAMP}, merge=True)
+    _flog(f"INDEX: zaktualizowano {len(found)} numerów")
+    return len(found)
+
+
+def start_forum_indexer(db, col_fn, interval=FORUM_INDEX_INTERVAL):
+    """Uruchom wątek indeksera (raz na proces dla danej kolekcji indeksu); przebieg robi tylko
+    proces z dzierżawą (_index_take_lease). Wątek NIE dotyka session_state."""
+    key = col_fn("forum_index")
+    with _INDEXERS_LOCK:
+        th = _INDEXERS.get(key)
+        if th and th.is_alive():
+            return False
+
+        def _loop():
+            meta_ref = db.collection(col_fn("forum_index_meta")).document("roots")
+            while True:
+                try:
+                    if _index_take_lease(db, meta_ref):
+                        forum_index_refresh(db, col_fn)
+                except Exception as e:
+                    print(f"[FORUM_INDEX] błąd przebiegu: {e}")
+                time.sleep(interval)
+
+        th = threading.Thread(target=_loop, daemon=True, name=f"forum-indexer-{key}")
+        _INDEXERS[key] = th
+        th.start()
+        return True
+
+
+def forum_index_lookup(db, col_fn, numer_zamowienia, persist=True):
+    """Zimna ścieżka auto_load_forum_context: JEDEN odczyt indeksu zamiast skanu wszystkich korzeni.
+    Zwraca memory w formacie forum_memory (zapisywane jak przy skanie, persist=False — bez zapisu)
+    albo None; przy None wołający robi skan (indeks mógł nie dojść do numeru)."""
+    nrzam = str(numer_zamowienia)
+    snap = db.collection(col_fn("forum_index")).document(nrzam).get()
+    if not snap.exists:
+        return None
+    memory = {}
+    for cel, entry in ((snap.to_dict() or {}).get("entries") or {}).items():
+        if not entry.get("id"):
+            continue
+        memory[cel] = {"id": entry["id"], "new_subthread": entry.get("is_root", False), "co": f"index: {cel}"}
+        if not persist:
+            continue
+        try:
+            save_forum_memory(db, col_fn, nrzam, cel, entry["id"], f"index: {cel}")
+        except Exception:
+            pass
+    return memory or None
+
+
+# ==========================================
+# OUTBOX — trwała kolejka wpisów na forum (autopilot nie czeka na CreatePost)
+# ==========================================
+# Dokument {col}forum_outbox/{klucz}: klucz idempotencji = sha256(nrzam|cel|treść|dzień) — ten sam wpis
+# wrzucony dwa razy tego samego dnia (ponowione przeliczenie, podwójne kliknięcie) to JEDEN dokument
+# (create()); identyczna treść innego dnia (np. to samo przypomnienie) to nowy wpis.
+# Statusy: pending → sending (dzierżawa) → sent | failed (po FORUM_OUTBOX_MAX_ATTEMPTS).
+# next_attempt_at = kiedy wpis jest do wzięcia: pending — teraz albo po backoffie, sending — koniec
+# dzierżawy. Wysyłacz pyta tylko o wpisy z next_attempt_at <= teraz, więc czekające na backoff nie
+# zajmują miejsc w limicie, a pusta kolejka to jedno zapytanie bez transakcji.
+# WYMAGANY indeks złożony (Firestore → Indexes, kolekcja forum_outbox / test_forum_outbox):
+#   status ASC, next_attempt_at ASC. Bez niego zapytanie rzuca FailedPrecondition z linkiem do
+#   utworzenia indeksu — trafia do logu forum jako ERROR (panel autopilota: ostrzeżenia/błędy).
+# Po wysłaniu JEDNA transakcja: outbox=sent + forum_memory.forum_posts.{cel} + ew_phone_log (delegacje)
+# + case_update (flagi casa zależne od wpisu: last_action_source, woreczek telefonów) — wpis, który
+# skończy jako failed, niczego w casie nie ustawia. Nieudane: forum_outbox_failed / forum_outbox_retry.
+FORUM_OUTBOX_INTERVAL = 5        # s — co ile wysyłacz zagląda do kolejki
+FORUM_OUTBOX_LEASE = 120         # s — po tylu sekundach "sending" uznajemy, że wysyłacz padł
+FORUM_OUTBOX_MAX_ATTEMPTS = 6
+_OUTBOX_SENDERS = {}
+_OUTBOX_LOCK = threading.Lock()
+
+
+def forum_outbox_key(numer_zamowienia, cel, tresc, day=None):
+    """Klucz idempotencji wpisu — okno deduplikacji to dzień (czas polski)."""
+    if day is None:
+        day = (datetime.now(_TZ_PL) if _TZ_PL is not None else datetime.now()).strftime("%Y-%m-%d")
+    raw = f"{numer_zamowienia or ''}|{cel or ''}|{tresc or ''}|{day}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def forum_outbox_enqueue(db, col_fn, numer_zamowienia, cel, tresc, user_do=None, do_odp_id=None,
+                         user_od=None, ai_user=None, tytul=None, diamond=None, phone_log=None,
+                         case_update=None):
+    """Wrzuca wpis do kolejki. Zwraca (klucz, nowy?) — nowy=False, gdy identyczny wpis już czeka/poszedł.
+    diamond: argumenty log_diamond (bez forum_post_id) — diament logowany dopiero po wysłaniu.
+    phone_log: pola bazowe wpisu do ew_phone_log/delegacje (zlecil, grupa, bot, ...), gdy odbiorca = Telefoniści.
+    case_update: {"case_id", "fields", "timestamps": [pola]} — update ew_cases po dostarczeniu
+    (timestamps dostają SERVER_TIMESTAMP w chwili wysłania).
+    """
+    from firebase_admin import firestore as _fs
+    from google.api_core.exceptions import AlreadyExists
+    key = forum_outbox_key(numer_zamowienia, cel, tresc)
+    try:
+        db.collection(col_fn("forum_outbox")).document(key).create({
+            "status": "pending",
+            "numer_zamowienia": str(numer_zamowienia or ""),
+            "cel": cel,
+            "tresc": tresc,
+            "user_do": user_do,
+            "do_odp_id": do_odp_id,
+            "user_od": user_od,
+            "ai_user": ai_user,
+            "tytul": tytul,
+            "diamond": diamond,
+            "phone_log": phone_log,
+            "case_update": case_update,
+            "attempts": 0,
+            "next_attempt_at": time.time(),
+            "created_at": _fs.SERVER_TIMESTAMP,
+        })
+        _flog(f"OUTBOX: +{key[:8]} nrzam={numer_zamowienia}, cel={cel}")
+        return key, True
+    except AlreadyExists:
+        _flog(f"OUTBOX: duplikat {key[:8]} (nrzam={numer_zamowienia}, cel={cel}) — pomijam")
+        return key, False
+
+
+def _outbox_claim(db, ref):
+    """Dzierżawa wpisu w transakcji — dwa wysyłacze (dwie instancje apki) nie wyślą tego samego."""
+    from firebase_admin import firestore as _fs
+
+    @_fs.transactional
+    def _txn(transaction):
+        snap = ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        item = snap.to_dict() or {}
+        now = time.time()
+        status = item.get("status")
+        if status == "pending" and item.get("next_attempt_at", 0) <= now:
+            pass
+        elif status == "sending" and now - item.get("lease_at", 0) > FORUM_OUTBOX_LEASE:
+            item["_lease_expired"] = True  # poprzedni wysyłacz padł — wpis MÓGŁ już pójść
+        else:
+            return None
+        transaction.update(ref, {"status": "sending", "lease_at": now, "attempts": item.get("attempts", 0) + 1,
+                                 "next_attempt_at": now + FORUM_OUTBOX_LEASE})  # do wzięcia po dzierżawie
+        return item
+
+    return _txn(db.transaction())
+
+
+def _outbox_find_delivered(item):
+    """Po wygasłej dzierżawie: czy wpis już jest na forum? (CreatePost nie ma idempotencji)
+    Szuka wpisu bota z numerem zamówienia i początkiem treści w wątku celu."""
+    info = _get_thread_raw(item.get("cel")) or {}
+    if not info.get("post_id"):
+        return None
+    result = forum_read(root_id=info["post_id"], max_pages=3)
+    if not result.get("success"):
+        return None
+    head = _strip_html(item.get("tresc") or "")[:60]
+    for p in reversed(result["posts"]):
+        text = _strip_html(p.get("Text") or "")
+        if p.get("UserAddName") == FORUM_USER and head and head in text and item["numer_zamowienia"] in text:
+            return p.get("Id")
+    return None
+
+
+def _outbox_commit_sent(db, col_fn, ref, item, post_id, link):
+    """Jedna transakcja: outbox=sent + pamięć forum (jeśli cel jeszcze bez wpisu) + rejestr telefonów
+    + case_update (gdy case nadal istnieje)."""
+    from firebase_admin import firestore as _fs
+    from datetime import datetime as _dt
+    import pytz
+    nrzam = item.get("numer_zamowienia")
+    cel = item.get("cel")
+    now_pl = _dt.now(pytz.timezone("Europe/Warsaw"))
+    mem_ref = db.collection(col_fn("forum_memory")).document(str(nrzam)) if nrzam else None
+    tresc_skrot_mem = (item.get("tresc") or "")[:100]
+
+    phone_ref, phone_doc = None, None
+    user_do = str(item.get("user_do") or "")
+    if item.get("phone_log") is not None and nrzam and user_do.lower().startswith("telefoni"):
+        delegacje, phone_doc = phone_log_entry(db, col_fn, nrzam, item["phone_log"], user_do, post_id, link,
+                                               (item.get("tresc") or "")[:100])
+        phone_ref = delegacje.document(f"outbox_{ref.id}")
+
+    cu = item.get("case_update") or {}
+    case_ref = db.collection(col_fn("ew_cases")).document(cu["case_id"]) if cu.get("case_id") else None
+    case_fields = dict(cu.get("fields") or {}, **{k: _fs.SERVER_TIMESTAMP for k in cu.get("timestamps") or []})
+
+    @_fs.transactional
+    def _txn(transaction):
+        mem_snap = mem_ref.get(transaction=transaction) if mem_ref else None
+        case_snap = case_ref.get(transaction=transaction, field_paths=["status"]) if case_ref else None
+        transaction.update(ref, {"status": "sent", "post_id": post_id, "link": link or "",
+                                 "sent_at": _fs.SERVER_TIMESTAMP})
+        if mem_ref and cel and post_id:
+            entry = {"id": post_id, "data": now_pl.strftime("%Y-%m-%d %H:%M"),
+                     "co": tresc_skrot_mem, "new_subthread": USE_NEW_SUBTHREADS}
+            if not mem_snap.exists:
+                transaction.set(mem_ref, {"forum_posts": {cel: entry}})
+            elif cel not in ((mem_snap.to_dict() or {}).get("forum_posts") or {}):
+                transaction.update(mem_ref, {f"forum_posts.{cel}": entry})
+        if phone_ref is not None:
+            transaction.set(phone_ref, phone_doc)
+        # case usunięty w międzyczasie (czyszczenie kolejki) — wpis i tak jest wysłany
+        if case_snap is not None and case_snap.exists and case_fields:
+            transaction.update(case_ref, case_fields)
+
+    _txn(db.transaction())
+
+
+def _outbox_deliver(db, col_fn, ref, item):
+    """Wysyła jeden wpis. True = dostarczony (albo wykryty jako już dostarczony)."""
+    post_id, link = None, None
+    if item.get("_lease_expired"):
+        post_id = _outbox_find_delivered(item)
+        if post_id:
+            _flog(f"OUTBOX: {ref.id[:8]} już na forum (id={post_id}) — tylko zapis wyniku")
+
+    if not post_id:
+        memory = load_forum_memory(db, col_fn, item.get("numer_zamowienia")) if item.get("numer_zamowienia") else {}
+        result = forum_write_to_thread(
+            cel=item.get("cel"), tresc=item.get("tresc") or "", user_do=item.get("user_do"),
+            do_odp_id=item.get("do_odp_id"), forum_memory=memory, user_od=item.get("user_od"),
+            ai_user=item.get("ai_user"), tytul=item.get("tytul"),
+        )
+        if not result.get("success"):
+            attempts = item.get("attempts", 0) + 1
+            failed = attempts >= FORUM_OUTBOX_MAX_ATTEMPTS
+            ref.update({
+                "status": "failed" if failed else "pending",
+                "last_error": str(result.get("error", "?"))[:500],
+                "next_attempt_at": time.time() + min(600, 10 * (2 ** attempts)) * random.uniform(0.8, 1.2),
+            })
+            _flog(f"OUTBOX: {ref.id[:8]} błąd ({attempts}/{FORUM_OUTBOX_MAX_ATTEMPTS}): {result.get('error')}", level="WARNING")
+            return False
+        post_id, link = result.get("FORUM_ID"), result.get("link")
+
+    _outbox_commit_sent(db, col_fn, ref, item, post_id, link)
+
+    # Diament po wysłaniu (potrzebny forum_post_id); log_diamond sam deduplikuje
+    if item.get("diamond"):
+        try:
+            log_diamond(db=db, forum_post_id=post_id, **item["diamond"])
+        except Exception as e:
+            _flog(f"OUTBOX: diament {ref.id[:8]} nieudany: {e}", level="WARNING")
+    return True
+
+
+def forum_outbox_drain(db, col_fn, limit=50):
+    """Jeden przebieg wysyłacza: wpisy do wzięcia teraz (oczekujące po backoffie + porzucone z wygasłą
+    dzierżawą), najdłużej czekające pierwsze (next_attempt_at rosnąco; nowy wpis = czas dodania).
+    Wymaga indeksu złożonego status + next_attempt_at (opis sekcji)."""
+    from firebase_admin import firestore as _fs
+    col_ref = db.collection(col_fn("forum_outbox"))
+    try:
+        candidates = list(col_ref.where("status", "in", ["pending", "sending"])
+                          .where("next_attempt_at", "<=", time.time())
+                          .order_by("next_attempt_at", direction=_fs.Query.ASCENDING).limit(limit).stream())
+    except Exception as e:
+        _flog(f"OUTBOX: zapytanie kolejki nieudane (brak indeksu status+next_attempt_at?): {e}", level="ERROR")
+        return 0
+    sent = 0
+    for snap in candidates:
+        item = _outbox_claim(db, snap.reference)
+        if item is None:
+            continue
+        try:
+            if _outbox_deliver(db, col_fn, snap.reference, item):
+                sent += 1
+        except Exception as e:
+            # Dzierżawa wygaśnie — następny przebieg sprawdzi, czy wpis poszedł, zanim wyśle ponownie
+            print(f"[FORUM_OUTBOX] {snap.id[:8]}: {e}")
+    return sent
+
+
+def forum_outbox_failed(db, col_fn, limit=50):
+    """Wpisy, które wyczerpały FORUM_OUTBOX_MAX_ATTEMPTS — do panelu admina: [{"id", ...pola}]."""
+    snaps = (db.collection(col_fn("forum_outbox")).where("status", "==", "failed")
+             .limit(limit).stream())
+    return [dict(s.to_dict() or {}, id=s.id) for s in snaps]
+
+
+def forum_outbox_retry(db, col_fn, key):
+    """Nieudany wpis z powrotem do kolejki (od zera prób)."""
+    db.collection(col_fn("forum_outbox")).document(key).update({
+        "status": "pending", "attempts": 0, "next_attempt_at": time.time(), "last_error": None,
+    })
+
+
+def start_forum_outbox(db, col_fn, interval=FORUM_OUTBOX_INTERVAL):
+    """Wysyłacz w tle (raz na proces dla danej kolekcji outboxa). Wątek NIE dotyka session_state."""
+    key = col_fn("forum_outbox")
+    with _OUTBOX_LOCK:
+        th = _OUTBOX_SENDERS.get(key)
+        if th and th.is_alive():
+            return False
+
+        def _loop():
+            while True:
+                try:
+                    forum_outbox_drain(db, col_fn)
+                except Exception as e:
+                    print(f"[FORUM_OUTBOX] błąd przebiegu: {e}")
+                time.sleep(interval)
+
+        th = threading.Thread(target=_loop, daemon=True, name=f"forum-outbox-{key}")
+        _OUTBOX_SENDERS[key] = th
+        th.start()
+        return True
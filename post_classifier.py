@@ -0,0 +1,315 @@
+"""
+KLASYFIKATOR TREŚCI POSTÓW FORUM — wzorce w jednym miejscu, wynik pamiętany po hashu treści
+
+Używany przez:
+- forum_module.py — _validate_diamond_from_tresc(), _classify_typ_zlecenia(), _build_diamond_entry()
+  (wcześniej do 8 osobnych skanów regexami po tej samej treści przy każdym wywołaniu),
+- app.py — zakładka Telefony: filtr wpisów niebędących prośbą o telefon (przy każdym renderze,
+  po każdej delegacji).
+
+Jak działa:
+- każdy wzorzec (FEATURES) to osobny skompilowany regex, .search() jak dawniej w forum_module,
+- wynik dla danej treści liczony RAZ i pamiętany (memo po blake2b treści, ograniczone LRU) —
+  ta sama delegacja oglądana przy każdym rerunie Telefonów i walidowana przy diamencie nie jest
+  skanowana ponownie.
+- jednego sklejonego przebiegu NIE ma: alternacja wzorców w jednym regexie zwraca jedno
+  dopasowanie na pozycję (nakładające się cechy, np. "Kurier:" i "Kurier: UPS", wymagały
+  ponownego dopasowania na każdej pozycji), a zmierzony czas był taki sam jak osobnych
+  .search() — zysk daje memo, nie sklejanie.
+Wynik jest współdzielony z pamięcią (memo) — NIE modyfikować zwróconego słownika.
+
+Kontrola + benchmark:  python post_classifier.py [plik ...]
+(plik = jeden post na linię albo JSON lines z polem "tresc"). Najpierw sprawdza etykiety
+wzorcowe SAMPLE_GOLDEN i zgodność z dawną logiką forum_module (_legacy), potem mierzy
+dawną logikę / bez memo / z memo.
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+FEATURES = (
+    # 🟥 Wpisy niebędące prośbą o telefon — zmiana kanału, anulowanie delegacji, informacja
+    #    o zakończeniu telefonów (zakładka Telefony, filtr przy wyświetlaniu).
+    ("nie_telefon",
+     r"kana[łl] telefoniczny wyczerpany|przechodzimy na komunikacj[ęe] pisemn|"
+     r"anulowanie delegacji|telefon nie jest ju[żz] potrzebny|"
+     r"prosimy nie wykonywa[ćc] telefonu|pro[śs]ba o telefon[^\n]{0,20}nieaktualna"),
+    # Walidacja diamentu: prawdziwe zlecenie kuriera/etykiety zawsze zawiera "Zamówienie: NNN"
+    ("zamowienie", r'Zam[óo]wienie\s*[:=]\s*(\d+)'),
+    # Ekstrakcja — tolerancja [:=] (tag C# w ai_text używa "=", treść posta ":")
+    ("towar", r'TOWAR_TYP\s*[:=]\s*(KOLEKTOR|SKRZYNIA)'),
+    # v1.5.7e: łapie też samo "Schenker" (normalizacja do DBSCHENKER)
+    ("kurier", r'Kurier\s*[:=]\s*(UPS|FEDEX|(?:DB[\s_]?)?SCHENKER)'),
+    ("etykieta", r'(UPS_ETYKIETA_PUNKT|KURIER_OPCJA\s*[:=]\s*ETYKIETA_PUNKT)'),
+    ("kurier_slowo", r'(Kurier\s*[:=]|KURIER_PRZEWOZNIK)'),
+    # Stop-lista: bumpy/ponaglenia/eskalacje NIE są diamentami.
+    # UWAGA: celowo BEZ "etykiet" — etykieta UPS punkt JEST diamentem (decyzja EA).
+    ("stop", r'(bump|ponaglenie|eskalacja|dopyt|podbicie)'),
+    # v1.5.7e: typy NIE-diamentów ("anulowane") — frazy werdykt EA 1:1 (11.06.2026).
+    # zmiana: KOREKTA / zmiana terminu / nowy termin / przełożyć / zmienił datę /
+    #         aktualizacja zlecenia / notatk (werdykt EA: notatki idą do korekty)
+    ("zmiana",
+     r'(KOREKTA|zmiana\s+terminu|nowy\s+termin|prze[łl]o[żz]|zmieni[łl]\s+dat|aktualizacja\s+zlecenia|notatk)'),
+    # cofniete: WSTRZYMANIE / anulowanie / anulować / cofnięcie / rezygnacja
+    ("cofniete", r'(WSTRZYMA|anulowa|cofni[ęe]|rezygnacj)'),
+    # ponowienie: ponawiam / ponowienie / przypominam / brak odpowiedzi
+    ("ponowienie", r'(ponawiam|ponowieni|przypominam|brak\s+odpowiedzi)'),
+)
+
+# Skompilowane wzorce po nazwie cechy (jedyne miejsce — forum_module i app.py wołają classify())
+SINGLE = {name: re.compile(pat, re.IGNORECASE) for name, pat in FEATURES}
+
+# v1.5.7e — kolejność rozstrzygania typu (werdykt EA): zmiana → cofniete → ponowienie
+# → etykieta_ups_punkt → kurier → inne. Korekta terminu zawiera też "Anulować" (wygrywa
+# zmiana), treść etykiety zawiera też słowo KURIER (etykieta przed kurierem).
+_TYP_ORDER = (("zmiana", "zmiana"), ("cofniete", "cofniete"), ("ponowienie", "ponowienie"),
+              ("etykieta", "etykieta_ups_punkt"), ("kurier_slowo", "kurier"))
+NIE_DIAMENT_TYPY = ("zmiana", "cofniete", "ponowienie")
+
+MEMO_MAX = 4096  # wpisów — Telefony renderują te same delegacje przy każdym rerunie
+
+_MEMO = OrderedDict()   # blake2b(treść) -> wynik
+_MEMO_STATS = {"hits": 0, "misses": 0}
+_LOCK = threading.Lock()
+
+_EMPTY = {
+    "zamowienie": None, "towar": None, "kurier": None, "stop": False, "nie_telefon": False,
+    "typ": "inne", "diament": False, "cechy": frozenset(),
+}
+
+
+def _scan(text):
+    """{cecha: pierwsze dopasowanie} — osobne .search() każdego wzorca."""
+    return {name: m for name, rx in SINGLE.items() for m in [rx.search(text)] if m}
+
+
+def _build(found):
+    typ = next((label for name, label in _TYP_ORDER if name in found), "inne")
+    kurier = None
+    if "kurier" in found:
+        kurier = found["kurier"].group(1).upper().replace(" ", "").replace("_", "")
+        # v1.5.7e: samo "Schenker" normalizowane do DBSCHENKER
+        if kurier == "SCHENKER":
+            kurier = "DBSCHENKER"
+    towar = None
+    if "towar" in found:
+        towar = "Kolektor" if found["towar"].group(1).upper() == "KOLEKTOR" else "Skrzynia biegów"
+    return {
+        "zamowienie": found["zamowienie"].group(1) if "zamowienie" in found else None,
+        "towar": towar,
+        "kurier": kurier,
+        "stop": "stop" in found,
+        "nie_telefon": "nie_telefon" in found,
+        "typ": typ,
+        # v1.5.7d: diament = "Zamówienie: NNN" i brak słów ze stop-listy
+        "diament": "zamowienie" in found and "stop" not in found,
+        "cechy": frozenset(found),
+    }
+
+
+def classify(text):
+    """Cechy treści posta (wynik współdzielony — tylko do odczytu):
+    zamowienie (str|None), towar, kurier (znormalizowany), stop, nie_telefon, typ, diament, cechy.
+    """
+    if not text:
+        return _EMPTY
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _LOCK:
+        res = _MEMO.get(key)
+        if res is not None:
+            _MEMO.move_to_end(key)
+            _MEMO_STATS["hits"] += 1
+            return res
+        _MEMO_STATS["misses"] += 1
+    res = _build(_scan(text))
+    with _LOCK:
+        _MEMO[key] = res
+        while len(_MEMO) > MEMO_MAX:
+            _MEMO.popitem(last=False)
+    return res
+
+
+def memo_stats():
+    with _LOCK:
+        return dict(_MEMO_STATS, size=len(_MEMO))
+
+
+def clear():
+    with _LOCK:
+        _MEMO.clear()
+        _MEMO_STATS.update(hits=0, misses=0)
+
+
+# ==========================================
+# BENCHMARK (python post_classifier.py [plik ...])
+# ==========================================
+
+# Korpus wzorcowy — formy postów z AUTOS_KURIERZY / Telefonów (nr zamówień zanonimizowane).
+SAMPLE_POSTS = (
+    "Zamówienie: 380457\nKurier: UPS\nTOWAR_TYP: SKRZYNIA\nProsimy o zlecenie odbioru na jutro 8-16.",
+    "Zamówienie: 378646\nKURIER_OPCJA: ETYKIETA_PUNKT\nUPS_ETYKIETA_PUNKT — prosimy o etykietę do punktu.",
+    "Zamówienie: 374593\nKurier: UPS_ETYKIETA_PUNKT\nTOWAR_TYP=KOLEKTOR",
+    "Zamówienie: 381002\nKurier: DB Schenker\nTOWAR_TYP: SKRZYNIA\nAdres odbioru bez zmian.",
+    "Zamówienie: 381003\nKurier= Schenker\nPalette, Termin: Dienstag.",
+    "Zamówienie: 379911\nKOREKTA zlecenia — nowy termin odbioru 14.06. Anulować poprzedni termin.",
+    "Zamówienie: 379912\nWSTRZYMANIE odbioru — klient rezygnacja z wysyłki.",
+    "Zamówienie: 379913\nPonawiam prośbę o zlecenie kuriera, brak odpowiedzi od wczoraj.",
+    "Zamówienie: 379914\nPonaglenie: kurier nadal nie zlecony. Bump.",
+    "Zamówienie: 379915 eskalacja do EA — dopyt klienta o status.",
+    "Prośba o telefon do klienta — termin odbioru, numer w wsadzie.",
+    "Kanał telefoniczny wyczerpany, przechodzimy na komunikację pisemną.",
+    "Anulowanie delegacji — telefon nie jest już potrzebny, klient odpisał mailem.",
+    "Prosimy nie wykonywać telefonu, sprawa zamknięta.",
+    "Prośba o telefon z 12.06 nieaktualna.",
+    "Klient prosi o przełożenie odbioru, zmienił datę na piątek. Notatka w CRM.",
+    "KURIER_PRZEWOZNIK: FEDEX\nZamowienie=382120\nAktualizacja zlecenia",
+    "Dzień dobry, czy paczka już wyszła? Pozdrawiam",
+    "Zamówienie: 382200\nKurier: FEDEX\n" + "Opis uszkodzenia kolektora. " * 40,
+    "",
+)
+
+# Etykiety wzorcowe dla SAMPLE_POSTS (ta sama kolejność):
+# (typ, diament, zamowienie, kurier, towar, nie_telefon)
+SAMPLE_GOLDEN = (
+    ("kurier", True, "380457", "UPS", "Skrzynia biegów", False),
+    ("etykieta_ups_punkt", True, "378646", None, None, False),
+    ("etykieta_ups_punkt", True, "374593", "UPS", "Kolektor", False),
+    ("kurier", True, "381002", "DBSCHENKER", "Skrzynia biegów", False),
+    ("kurier", True, "381003", "DBSCHENKER", None, False),
+    ("zmiana", True, "379911", None, None, False),
+    ("cofniete", True, "379912", None, None, False),
+    ("ponowienie", True, "379913", None, None, False),
+    ("inne", False, "379914", None, None, False),
+    ("inne", False, "379915", None, None, False),
+    ("inne", False, None, None, None, False),
+    ("inne", False, None, None, None, True),
+    ("cofniete", False, None, None, None, True),
+    ("inne", False, None, None, None, True),
+    ("inne", False, None, None, None, True),
+    ("zmiana", False, None, None, None, False),
+    ("zmiana", True, "382120", None, None, False),
+    ("inne", False, None, None, None, False),
+    ("kurier", True, "382200", "FEDEX", None, False),
+    ("inne", False, None, None, None, False),
+)
+
+
+def _labels(res):
+    return (res["typ"], res["diament"], res["zamowienie"], res["kurier"], res["towar"],
+            res["nie_telefon"])
+
+
+# Dawna logika 1:1 (forum_module v1.5.7e: _validate_diamond_from_tresc, _classify_typ_zlecenia,
+# ekstrakcja w _build_diamond_entry; app.py: _NIE_TELEFON) — wzorce przepisane dosłownie,
+# NIE z FEATURES, żeby kontrola łapała rozjazd przy edycji FEATURES.
+_LEGACY = {name: re.compile(pat, re.IGNORECASE) for name, pat in (
+    ("stop", r'(bump|ponaglenie|eskalacja|dopyt|podbicie)'),
+    ("zamowienie", r'Zam[óo]wienie\s*[:=]\s*(\d+)'),
+    ("towar", r'TOWAR_TYP\s*[:=]\s*(KOLEKTOR|SKRZYNIA)'),
+    ("kurier", r'Kurier\s*[:=]\s*(UPS|FEDEX|(?:DB[\s_]?)?SCHENKER)'),
+    ("etykieta", r'(UPS_ETYKIETA_PUNKT|KURIER_OPCJA\s*[:=]\s*ETYKIETA_PUNKT)'),
+    ("kurier_slowo", r'(Kurier\s*[:=]|KURIER_PRZEWOZNIK)'),
+    ("zmiana", r'(KOREKTA|zmiana\s+terminu|nowy\s+termin|prze[łl]o[żz]|zmieni[łl]\s+dat|'
+               r'aktualizacja\s+zlecenia|notatk)'),
+    ("cofniete", r'(WSTRZYMA|anulowa|cofni[ęe]|rezygnacj)'),
+    ("ponowienie", r'(ponawiam|ponowieni|przypominam|brak\s+odpowiedzi)'),
+    ("nie_telefon", r"kana[łl] telefoniczny wyczerpany|przechodzimy na komunikacj[ęe] pisemn|"
+                    r"anulowanie delegacji|telefon nie jest ju[żz] potrzebny|"
+                    r"prosimy nie wykonywa[ćc] telefonu|pro[śs]ba o telefon[^\n]{0,20}nieaktualna"),
+)}
+
+
+def _legacy(text):
+    """Etykiety liczone dawną ścieżką (osobne regexy, ta sama kolejność rozstrzygania)."""
+    if not text:
+        return ("inne", False, None, None, None, False)
+    rx = _LEGACY
+    if rx["zmiana"].search(text):
+        typ = "zmiana"
+    elif rx["cofniete"].search(text):
+        typ = "cofniete"
+    elif rx["ponowienie"].search(text):
+        typ = "ponowienie"
+    elif rx["etykieta"].search(text):
+        typ = "etykieta_ups_punkt"
+    elif rx["kurier_slowo"].search(text):
+        typ = "kurier"
+    else:
+        typ = "inne"
+    m_nr = rx["zamowienie"].search(text)
+    diament = bool(m_nr) and not rx["stop"].search(text)
+    kurier = None
+    m = rx["kurier"].search(text)
+    if m:
+        kurier = m.group(1).upper().replace(" ", "").replace("_", "")
+        if kurier == "SCHENKER":
+            kurier = "DBSCHENKER"
+    towar = None
+    m = rx["towar"].search(text)
+    if m:
+        towar = "Kolektor" if m.group(1).upper() == "KOLEKTOR" else "Skrzynia biegów"
+    return (typ, diament, m_nr.group(1) if m_nr else None, kurier, towar,
+            bool(rx["nie_telefon"].search(text)))
+
+
+def _check(corpus):
+    """Etykiety wzorcowe + zgodność classify() z dawną logiką. Zwraca listę rozjazdów."""
+    bad = []
+    assert len(SAMPLE_GOLDEN) == len(SAMPLE_POSTS)
+    for text, want in zip(SAMPLE_POSTS, SAMPLE_GOLDEN):
+        for label, got in (("classify", _labels(classify(text))), ("legacy", _legacy(text))):
+            if got != want:
+                bad.append((label, text[:60], want, got))
+    for text in corpus:
+        got, want = _labels(classify(text)), _legacy(text)
+        if got != want:
+            bad.append(("corpus", text[:60], want, got))
+    return bad
+
+
+def _load_corpus(paths):
+    import json
+    posts = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.startswith("{"):
+                    try:
+                        line = str(json.loads(line).get("tresc") or "")
+                    except ValueError:
+                        pass
+                posts.append(line.replace("\\n", "\n"))
+    return posts
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    corpus = _load_corpus(sys.argv[1:]) or list(SAMPLE_POSTS)
+    print(f"Korpus: {len(corpus)} postów")
+    bad = _check(corpus)
+    for row in bad:
+        print("ROZJAZD", row)
+    if bad:
+        sys.exit(f"{len(bad)} rozjazdów etykiet — benchmark pominięty")
+    print(f"Etykiety: {len(SAMPLE_GOLDEN)} wzorcowych + korpus zgodne z dawną logiką")
+    clear()
+
+    def _bench(label, fn, rounds):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for t in corpus:
+                fn(t)
+        dt = time.perf_counter() - t0
+        print(f"{label:<28} {dt / (rounds * max(len(corpus), 1)) * 1e6:8.2f} µs/post")
+
+    rounds = max(1, 20000 // max(len(corpus), 1))
+    _bench("dawniej (forum_module)", _legacy, rounds)
+    _bench("bez memo", lambda t: _build(_scan(t)) if t else _EMPTY, rounds)
+    clear()
+    _bench("classify() z memo", classify, rounds)
+    print("memo:", memo_stats())
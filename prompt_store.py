@@ -0,0 +1,143 @@
+"""
+MAGAZYN PROMPTÓW — dysk + pamięć procesu, rewalidacja ETag / sha (stale-while-revalidate)
+
+Używany przez:
+- app.py          — get_remote_prompt() (Wieżowiec, autopilot)
+- app_vertex_ew.py — get_remote_prompt() (operator)
+
+Zasady:
+- prompt w pamięci/na dysku → zwracamy OD RAZU (start operatora nie czeka na GitHub),
+- po REVALIDATE_AFTER sekundach (albo gdy znany sha z listy GitHuba się różni) w tle idzie
+  warunkowe GET z If-None-Match — 304 kosztuje kilkaset bajtów zamiast ~290 KB,
+- blokujące pobranie tylko przy zimnym starcie (brak pamięci i dysku).
+sha = git blob sha treści (ten sam, który zwraca GitHub contents API).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+REVALIDATE_AFTER = 30.0  # s — po tym czasie kolejny odczyt odpala rewalidację w tle
+MIN_RECHECK = 5.0        # s — niezgodny sha nie rewaliduje częściej (CDN raw może chwilę trzymać starą wersję)
+FETCH_TIMEOUT = (5, 20)  # (connect, read)
+STORE_DIR = os.environ.get("PROMPT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "prompt_store")
+
+_MEM = {}           # url -> {"text", "etag", "sha", "checked"}
+_PENDING = set()    # url-e z trwającą rewalidacją
+_LOCK = threading.Lock()
+
+
+def blob_sha(text):
+    """Git blob sha treści — porównywalny z polem 'sha' z GitHub contents API."""
+    raw = text.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(raw) + raw).hexdigest()
+
+
+def _paths(url):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(STORE_DIR, f"{key}.txt"), os.path.join(STORE_DIR, f"{key}.json")
+
+
+def _load_disk(url):
+    txt_path, meta_path = _paths(url)
+    try:
+        with open(txt_path, encoding="utf-8") as f:
+            text = f.read()
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # checked=0 → pierwszy odczyt z dysku od razu rewaliduje w tle
+    return {"text": text, "etag": meta.get("etag", ""), "sha": meta.get("sha") or blob_sha(text), "checked": 0.0}
+
+
+def _save_disk(url, entry):
+    txt_path, meta_path = _paths(url)
+    try:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        for path, payload in ((txt_path, entry["text"]),
+                              (meta_path, json.dumps({"url": url, "etag": entry["etag"], "sha": entry["sha"]}))):
+            tmp = f"{path}.tmp{threading.get_ident()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+    except OSError as e:
+        print(f"[PROMPT_STORE] Zapis na dysk nieudany: {e}")
+
+
+def _fetch(url, etag=""):
+    """Warunkowe GET. Zwraca nowy wpis albo None przy 304 (bez zmian)."""
+    headers = {"If-None-Match": etag} if etag else {}
+    r = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    if r.status_code == 304:
+        return None
+    r.raise_for_status()
+    r.encoding = r.encoding or "utf-8"
+    text = r.text
+    return {"text": text, "etag": r.headers.get("ETag", ""), "sha": blob_sha(text), "checked": time.time()}
+
+
+def _revalidate(url):
+    try:
+        with _LOCK:
+            etag = (_MEM.get(url) or {}).get("etag", "")
+        fresh = _fetch(url, etag)
+        with _LOCK:
+            if fresh is None:
+                if url in _MEM:
+                    _MEM[url]["checked"] = time.time()
+            else:
+                changed = (_MEM.get(url) or {}).get("sha") != fresh["sha"]
+                _MEM[url] = fresh
+        if fresh is not None and changed:
+            _save_disk(url, fresh)
+            print(f"[PROMPT_STORE] Nowa wersja promptu ({fresh['sha'][:7]}): {url}")
+    except Exception as e:
+        # Zostaje stara wersja — spróbujemy przy następnym odczycie
+        print(f"[PROMPT_STORE] Rewalidacja nieudana ({url}): {e}")
+    finally:
+        with _LOCK:
+            _PENDING.discard(url)
+
+
+def _schedule_revalidate(url):
+    with _LOCK:
+        if url in _PENDING:
+            return
+        _PENDING.add(url)
+    threading.Thread(target=_revalidate, args=(url,), daemon=True, name="prompt-revalidate").start()
+
+
+def get(url, known_sha=None):
+    """Zwraca treść promptu. known_sha (z listy GitHuba) przyspiesza wykrycie nowej wersji.
+
+    Przy zimnym starcie pobiera synchronicznie i rzuca wyjątek, jeśli się nie uda.
+    """
+    with _LOCK:
+        entry = _MEM.get(url)
+    if entry is None:
+        entry = _load_disk(url)
+        if entry is None:
+            entry = _fetch(url)
+            _save_disk(url, entry)
+        with _LOCK:
+            entry = _MEM.setdefault(url, entry)
+
+    age = time.time() - entry["checked"]
+    if age > REVALIDATE_AFTER or (known_sha and known_sha != entry["sha"] and age > MIN_RECHECK):
+        _schedule_revalidate(url)
+    return entry["text"]
+
+
+def forget(url=None):
+    """Wyczyść pamięć (jeden url albo wszystko) — następny get() czyta z dysku i rewaliduje."""
+    with _LOCK:
+        if url is None:
+            _MEM.clear()
+        else:
+            _MEM.pop(url, None)
@@ -0,0 +1,286 @@
+"""
+PARSER PULI SZTURCHACZA — bloki per zamówienie jednym przebiegiem, wynik pamiętany po hashu
+
+Używany przez:
+- app.py — parse_szturchacz_blocks() (upsert puli, manifest, merge) i count_lines()
+  (zakładka Wsady liczy zamówienia kilka razy na render).
+- forum_module.py — nrzam_tokens() (indekser forum: numery zamówień we wpisach bota).
+
+Zamiast pętli po liniach z trzema re.search/re.match na każdą — dwa skompilowane przebiegi
+po całym tekście (NrZam + początki linii), które skaczą od nagłówka do nagłówka; bloki to
+wycinki tekstu między nagłówkami. Linie nagłówka (jak dawniej):
+- NrZam: XXXXX / NrZam XXXXX — gdziekolwiek w linii (ma pierwszeństwo),
+- ZN + cyfry na początku linii,
+- gołe 5-7 cyfr na początku linii, po nich spacja i dalsza treść (format tabeli szturchacza).
+Nagłówki z "NrZam" wskazujące słowa z _NIE_NUMERY (nagłówek tabeli) są zwykłą linią bloku.
+Tekst przed pierwszym nagłówkiem jest pomijany; brak nagłówków → cały tekst jako "_RAW_".
+
+API:
+- iter_blocks(text)  — generator (nrzam, blok) w kolejności tekstu (z powtórzeniami NrZam),
+- iter_blocks_lines(lines) — to samo ze strumienia linii (wczytywanie pliku kawałkami),
+- parse_blocks(text) — {nrzam: blok} (późniejszy blok nadpisuje, kolejność pierwszego wystąpienia),
+- count(text)        — liczba różnych NrZam bez składania bloków,
+- nrzam_tokens(text) — wszystkie numery zamówień w dowolnym tekście (np. wpis forum) — ta sama
+  gramatyka NrZam, ale w dowolnym miejscu linii (indeks forum w forum_module).
+Wyniki parse_blocks/count są pamiętane po hashu tekstu — słownik współdzielony, NIE modyfikować.
+
+Benchmark (syntetyczne pule 10k/50k zamówień, zgodność ze starym parserem):
+    python szturchacz_parser.py
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+# Białe znaki BEZ \n — dopasowanie nie może przeskoczyć do następnej linii
+_WS = r"[^\S\n]"
+# NrZam: XXX — gdziekolwiek w linii (ma pierwszeństwo przed formatami z początku linii)
+_RE_NRZAM = re.compile(rf"[Nn][Rr][Zz][Aa][Mm](?:{_WS}|:)+(\S+)")
+# ZN366000 / 366000 <reszta wiersza tabeli> — na początku linii; \n jako prefiks
+# pozwala sre szukać literału zamiast próbować ^ na każdej pozycji
+_LINE_HEAD = rf"{_WS}*(ZN\d+|\d{{5,7}}(?={_WS}+\S))"
+_RE_HEAD_FIRST = re.compile(_LINE_HEAD)
+_RE_HEAD_NEXT = re.compile(r"\n" + _LINE_HEAD)
+
+# Fałszywe trafienia "NrZam ..." (nagłówki tabeli) — linia zostaje w bieżącym bloku
+_NIE_NUMERY = frozenset(('data', 'zama', 'nr', 'nrzam', 'mail', 'tel', 'kraj'))
+# Numery w wolnym tekście: ZN + cyfry albo 5-8 cyfr jako osobny token
+_RE_NR_TOKEN = re.compile(r"(?<![\w])(ZN\d+)(?!\w)|(?<!\d)(\d{5,8})(?!\d)")
+
+MEMO_MAX = 8  # tekstów — pule bywają wielomegabajtowe, trzymamy tylko ostatnie
+_MEMO = OrderedDict()   # (tryb, blake2b(tekst)) -> wynik
+_LOCK = threading.Lock()
+
+
+def _headers(text):
+    """Nagłówki bloków: (pozycja początku linii, nrzam) rosnąco. nrzam może być "" (blok pomijany).
+
+    Dwa skompilowane przebiegi po całym tekście (NrZam + początki linii) scalone po pozycji —
+    dla linii z "NrZam" wygrywa NrZam (także gdy to fałszywy nagłówek tabeli: wtedy linia
+    jest zwykłą linią bloku, jak w starym parserze).
+    """
+    by_nrzam = {}
+    for m in _RE_NRZAM.finditer(text):
+        ls = text.rfind("\n", 0, m.start()) + 1
+        if ls not in by_nrzam:
+            cand = m.group(1).strip().rstrip(',').rstrip('|')
+            by_nrzam[ls] = None if cand.lower() in _NIE_NUMERY else cand
+    heads = []
+    m = _RE_HEAD_FIRST.match(text)
+    if m:
+        heads.append((0, m.group(1)))
+    heads.extend((m.start() + 1, m.group(1)) for m in _RE_HEAD_NEXT.finditer(text))
+
+    nz = iter(by_nrzam.items())
+    nz_cur = next(nz, None)
+    for ls, nr in heads:
+        while nz_cur is not None and nz_cur[0] <= ls:
+            if nz_cur[1] is not None:
+                yield nz_cur
+            if nz_cur[0] == ls:
+                nr = None  # linia z NrZam — początek linii się nie liczy
+            nz_cur = next(nz, None)
+        if nr is not None:
+            yield ls, nr
+    while nz_cur is not None:
+        if nz_cur[1] is not None:
+            yield nz_cur
+        nz_cur = next(nz, None)
+
+
+def iter_blocks(text):
+    """Generator (nrzam, blok) — bez list pośrednich; blok = linie od nagłówka do następnego."""
+    if not text:
+        return
+    prev_pos, prev_nr = None, None
+    for pos, nr in _headers(text):
+        if prev_nr:
+            yield prev_nr, text[prev_pos:pos - 1]
+        prev_pos, prev_nr = pos, nr
+    if prev_nr:
+        yield prev_nr, text[prev_pos:]
+
+
+def iter_blocks_lines(lines):
+    """Generator (nrzam, blok) ze strumienia linii (bez końcowego \n) — np. plik czytany kawałkami.
+    Te same reguły co iter_blocks; blok oddawany, gdy przyjdzie nagłówek następnego."""
+    cur_nr, cur = None, []
+    for line in lines:
+        m = _RE_NRZAM.search(line)
+        if m:
+            nr = m.group(1).strip().rstrip(',').rstrip('|')
+            if nr.lower() in _NIE_NUMERY:
+                nr = None
+        else:
+            m = _RE_HEAD_FIRST.match(line)
+            nr = m.group(1) if m else None
+        if nr is None:
+            cur.append(line)
+            continue
+        if cur_nr:
+            yield cur_nr, '\n'.join(cur)
+        cur_nr, cur = nr, [line]
+    if cur_nr:
+        yield cur_nr, '\n'.join(cur)
+
+
+def nrzam_tokens(text):
+    """Zbiór numerów zamówień w tekście: "NrZam: X" (jak nagłówek bloku, bez _NIE_NUMERY),
+    ZN + cyfry i gołe 5-8 cyfr — w dowolnym miejscu."""
+    out = set()
+    if not text:
+        return out
+    for m in _RE_NRZAM.finditer(text):
+        cand = m.group(1).strip().rstrip(',').rstrip('|')
+        if cand and cand.lower() not in _NIE_NUMERY:
+            out.add(cand)
+    for m in _RE_NR_TOKEN.finditer(text):
+        out.add(m.group(1) or m.group(2))
+    return out
+
+
+def _memo(mode, text, compute):
+    key = (mode, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    with _LOCK:
+        if key in _MEMO:
+            _MEMO.move_to_end(key)
+            return _MEMO[key]
+    res = compute(text)
+    with _LOCK:
+        _MEMO[key] = res
+        while len(_MEMO) > MEMO_MAX:
+            _MEMO.popitem(last=False)
+    return res
+
+
+def _parse(text):
+    blocks = dict(iter_blocks(text))
+    # Jeśli parser nie znalazł bloków, zwróć cały tekst jako jeden blok
+    if not blocks and text.strip():
+        blocks["_RAW_"] = text.strip()
+    return blocks
+
+
+def _count(text):
+    return len({nr for _, nr in _headers(text) if nr})
+
+
+def parse_blocks(text):
+    """{NrZam: tekst bloku} — jak dawny parse_szturchacz_blocks (wynik współdzielony)."""
+    if not text or not text.strip():
+        return {}
+    return _memo("blocks", text, _parse)
+
+
+def count(text):
+    """Liczba różnych NrZam w tekście (bez "_RAW_"), bez składania bloków."""
+    if not text or not text.strip():
+        return 0
+    return _memo("count", text, _count)
+
+
+def clear():
+    with _LOCK:
+        _MEMO.clear()
+
+
+# ==========================================
+# BENCHMARK (python szturchacz_parser.py)
+# ==========================================
+
+def _legacy_parse(text):
+    """Stary parse_szturchacz_blocks z app.py (linia po linii, trzy regexy) — wzorzec zgodności."""
+    if not text or not text.strip():
+        return {}
+    blocks = {}
+    current_block = []
+    current_nr = None
+    for line in text.split('\n'):
+        stripped = line.strip()
+        nr_match = re.search(r'NrZam[:\s]+(\S+)', line, re.IGNORECASE)
+        if not nr_match:
+            nr_match = re.match(r'^(ZN\d+)', stripped)
+        if not nr_match:
+            nr_match = re.match(r'^(\d{5,7})\s', stripped)
+        if nr_match:
+            if current_nr and current_block:
+                blocks[current_nr] = '\n'.join(current_block)
+            candidate = nr_match.group(1).strip().rstrip(',').rstrip('|')
+            if candidate.lower() in _NIE_NUMERY:
+                current_block.append(line)
+            else:
+                current_nr = candidate
+                current_block = [line]
+        else:
+            current_block.append(line)
+    if current_nr and current_block:
+        blocks[current_nr] = '\n'.join(current_block)
+    if not blocks and text.strip():
+        blocks["_RAW_"] = text.strip()
+    return blocks
+
+
+def _synthetic_pool(n_orders, seed=7):
+    """Pula w mieszanych formatach: tabela (gołe numery), NrZam:, ZN, nagłówki, duplikaty, śmieci."""
+    import random
+    rnd = random.Random(seed)
+    out = ["Data | NrZam | Kraj | Mail | Tel", "NrZam: data", ""]
+    for i in range(n_orders):
+        nr = 300000 + rnd.randrange(700000) if rnd.random() < 0.97 else 300000 + i  # ~3% powtórzeń
+        kind = rnd.random()
+        if kind < 0.6:
+            out.append(f"{nr}\t2026-06-{rnd.randint(1, 28):02d}\tDE\tklient{i}@example.com\t+49 151 {i:07d}")
+        elif kind < 0.85:
+            out.append(f"NrZam: {nr}, Kraj: FR")
+        else:
+            out.append(f"  ZN{nr} | UK |")
+        for _ in range(rnd.randint(1, 6)):
+            out.append(rnd.choice((
+                "  Status: oczekuje na zwrot kolektora",
+                "  List przewozowy: 1Z999AA10123456784",
+                "  2026-06-12 10:15 telefon — brak odpowiedzi",
+                "  Uwagi: klient prosi o kontakt mailowy",
+                "12345678 numer referencyjny",
+                "NrZam: data 366001 x",
+                "  366002",
+                "366003 \t",
+                "123456 NrZam: 777001, dopisek",
+                "NrZam:,",
+                "Uwagi\r",
+                "",
+            )))
+    return "\n".join(out)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    failed = False
+    for n in (10_000, 50_000):
+        pool = _synthetic_pool(n)
+        t0 = time.perf_counter()
+        old = _legacy_parse(pool)
+        t_old = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = _parse(pool)
+        t_new = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        cnt = _count(pool)
+        t_cnt = time.perf_counter() - t0
+        clear()
+        parse_blocks(pool)
+        t0 = time.perf_counter()
+        parse_blocks(pool)
+        t_memo = time.perf_counter() - t0
+        ok = (list(old.items()) == list(new.items()) and cnt == len([k for k in old if k != "_RAW_"])
+              and list(dict(iter_blocks_lines(pool.split("\n"))).items()) == list(new.items()))
+        failed |= not ok
+        mb = len(pool.encode("utf-8")) / 1e6
+        print(f"{n:>6} zamówień ({mb:.1f} MB, {len(new)} NrZam) — zgodność: {'OK' if ok else 'RÓŻNICE'}")
+        print(f"   stary parser   {t_old * 1000:8.1f} ms  ({mb / t_old:6.1f} MB/s)")
+        print(f"   iter_blocks    {t_new * 1000:8.1f} ms  ({mb / t_new:6.1f} MB/s)")
+        print(f"   count          {t_cnt * 1000:8.1f} ms")
+        print(f"   memo (hash)    {t_memo * 1000:8.1f} ms")
+    sys.exit(1 if failed else 0)
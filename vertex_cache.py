@@ -0,0 +1,151 @@
+"""
+WSPÓŁDZIELONY REJESTR CONTEXT CACHE (Vertex AI) — jeden na proces serwera
+
+Używany przez:
+- app_vertex_ew.py — get_or_create_cached_model() pyta rejestr zamiast trzymać nazwę cache w sesji.
+
+Klucz: (projekt GCP, model, sha256 PEŁNEGO promptu) — 14 operatorów na tym samym prompcie
+i projekcie dzieli jeden CachedContent (i jeden obiekt GenerativeModel).
+- licznik referencji = sesje (holderzy), które używały wpisu w ciągu ostatniego CACHE_TTL,
+- TTL odnawiany, gdy do wygaśnięcia zostało mniej niż RENEW_MARGIN,
+- tworzenie pod blokadą per klucz — równoległe sesje czekają na jeden create() zamiast robić swoje,
+- ostatnia sesja oddająca wpis (release(), wylogowanie) usuwa CachedContent w Vertex — nie płacimy
+  za przechowywanie do końca TTL; wpisy porzucone bez release() wygasają same po CACHE_TTL,
+- nieużywane (refs=0) i wygasłe wpisy są sprzątane przy kolejnym acquire().
+"""
+
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+from vertexai.generative_models import GenerativeModel
+from vertexai.preview import caching as vertex_caching
+
+CACHE_TTL = timedelta(minutes=60)
+RENEW_MARGIN = timedelta(minutes=10)
+
+_REGISTRY = {}           # klucz -> wpis (patrz _new_entry)
+_LOCK = threading.Lock()  # chroni _REGISTRY (krótko); create/update pod blokadą wpisu
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def cache_key(project, model_id, system_prompt):
+    """Klucz rejestru — hash całego promptu (bez kolizji na wspólnym początku)."""
+    digest = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    return (project, model_id, digest)
+
+
+def _new_entry():
+    return {
+        "lock": threading.Lock(),
+        "name": None,       # resource name CachedContent
+        "model": None,      # GenerativeModel.from_cached_content — współdzielony
+        "expire": None,     # datetime UTC
+        "holders": {},      # sesja -> ostatnie użycie (licznik referencji)
+    }
+
+
+def _sweep():
+    """Usuń wygasłe i nieużywane wpisy (pod _LOCK).
+    Sesja, która nie użyła wpisu dłużej niż CACHE_TTL (zamknięta karta), przestaje się liczyć.
+    """
+    now = _now()
+    for entry in _REGISTRY.values():
+        for h in [h for h, ts in entry["holders"].items() if now - ts > CACHE_TTL]:
+            entry["holders"].pop(h, None)
+    for key in [k for k, e in _REGISTRY.items()
+                if not e["holders"] and e["expire"] and e["expire"] <= now]:
+        _REGISTRY.pop(key, None)
+
+
+def acquire(project, model_id, system_prompt, holder):
+    """Zwraca współdzielony GenerativeModel z cache dla (projekt, model, prompt).
+
+    holder — identyfikator sesji (liczony raz, niezależnie od liczby wywołań).
+    Rzuca wyjątek, jeśli cache nie da się utworzyć — wołający przechodzi na zwykły model.
+    """
+    key = cache_key(project, model_id, system_prompt)
+    with _LOCK:
+        _sweep()
+        entry = _REGISTRY.get(key)
+        if entry is None:
+            entry = _REGISTRY[key] = _new_entry()
+
+    with entry["lock"]:
+        now = _now()
+        if entry["name"] and entry["expire"] and entry["expire"] > now:
+            if entry["expire"] - now < RENEW_MARGIN:
+                # Odnów TTL zanim wygaśnie — nie tracimy cache w środku rozmowy
+                try:
+                    cc = vertex_caching.CachedContent(cached_content_name=entry["name"])
+                    cc.update(ttl=CACHE_TTL)
+                    entry["expire"] = now + CACHE_TTL
+                except Exception as e:
+                    print(f"[VERTEX_CACHE] Odnowienie TTL nieudane ({model_id}): {e}")
+                    entry["name"] = None
+        else:
+            entry["name"] = None
+
+        if not entry["name"]:
+            cc = vertex_caching.CachedContent.create(
+                model_name=model_id,
+                system_instruction=system_prompt,
+                contents=[],  # pusty — cachujemy tylko system prompt
+                ttl=CACHE_TTL,
+                display_name=f"ew-{key[2][:12]}",
+            )
+            entry["name"] = cc.name
+            entry["model"] = GenerativeModel.from_cached_content(cached_content=cc)
+            entry["expire"] = now + CACHE_TTL
+            print(f"[VERTEX_CACHE] Nowy cache {project}/{model_id} ({key[2][:12]})")
+
+        entry["holders"][holder] = now
+        return entry["model"]
+
+
+def invalidate(project, model_id, system_prompt):
+    """Wyrzuć wpis (np. Vertex zgłosił, że cache nie istnieje) — następny acquire() utworzy nowy."""
+    key = cache_key(project, model_id, system_prompt)
+    with _LOCK:
+        entry = _REGISTRY.get(key)
+    if entry:
+        with entry["lock"]:
+            entry["name"] = None
+            entry["model"] = None
+            entry["expire"] = None
+
+
+def _delete_cached_content(key, entry):
+    """Usuń CachedContent wpisu w Vertex i wpis z rejestru, jeśli nikt go już nie trzyma."""
+    with entry["lock"]:
+        if entry["holders"] or not entry["name"]:
+            return  # ktoś zdążył go ponownie wziąć albo już usunięty
+        name, entry["name"], entry["model"], entry["expire"] = entry["name"], None, None, None
+        try:
+            vertex_caching.CachedContent(cached_content_name=name).delete()
+            print(f"[VERTEX_CACHE] Usunięto cache {name}")
+        except Exception as e:
+            print(f"[VERTEX_CACHE] Usunięcie cache nieudane ({name}): {e}")  # wygaśnie po TTL
+    with _LOCK:
+        if _REGISTRY.get(key) is entry and not entry["holders"] and not entry["name"]:
+            _REGISTRY.pop(key, None)
+
+
+def release(holder):
+    """Zdejmij referencje sesji ze wszystkich wpisów; wpisy bez sesji tracą CachedContent."""
+    with _LOCK:
+        orphaned = [(key, entry) for key, entry in _REGISTRY.items()
+                    if entry["holders"].pop(holder, None) is not None and not entry["holders"]]
+        _sweep()
+    for key, entry in orphaned:
+        _delete_cached_content(key, entry)
+
+
+def stats():
+    """Podgląd rejestru: [(projekt, model, hash12, liczba sesji, wygasa)]."""
+    with _LOCK:
+        return [(k[0], k[1], k[2][:12], len(e["holders"]), e["expire"])
+                for k, e in _REGISTRY.items()]
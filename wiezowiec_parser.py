@@ -0,0 +1,356 @@
+"""
+PARSER WYJŚCIA WIEŻOWCA — jeden przebieg po liniach, tryb przyrostowy dla odpowiedzi strumieniowej
+
+Używany przez:
+- app.py — parse_wiezowiec_output() (cały tekst) i przeliczanie partii: odpowiedź modelu idzie
+  strumieniem (send_message(stream=True)), a parser składa casy w trakcie generowania.
+
+Zasady (identyczne z dawnym parserem w app.py):
+- "▬▬ OPERATORZY DE/FR/UK/PL/UKPL" ustawia grupę (UKPL → UK, sekcja legacy),
+- nagłówek casa: "[SCORE=123] 🔴 | ..." albo "🔴 [123] | ..." — tylko gdy grupa jest znana,
+- blok casa = niepuste linie do "---", "▬", "═══" albo kolejnego nagłówka,
+- "ALERT ... BRAK W SZTURCHACZU" pomija wszystko do linii "═══".
+Wzorce skompilowane raz; linia trafia do regexa tylko, gdy przejdzie tani test prefiksu
+("[SCORE=", ikona, "▬").
+
+Zgodność + benchmark:  python wiezowiec_parser.py [plik ...]
+(plik = zapisane surowe odpowiedzi; "=== PARTIA" rozdziela partie jak w all_raw_outputs).
+"""
+
+import re
+
+_ICONS = "🔴🟡⚪📦"
+# Kolejność = kolejność sprawdzania (pierwszy pasujący wygrywa, jak w dawnym słowniku)
+_GRUPA_PATTERNS = (
+    ("DE", re.compile(r'▬+\s*OPERATORZY\s+DE')),
+    ("FR", re.compile(r'▬+\s*OPERATORZY\s+FR')),
+    # \b: "OPERATORZY UK" nie złapie "OPERATORZY UKPL" (po K jest P)
+    ("UK", re.compile(r'▬+\s*OPERATORZY\s+UK\b')),
+    ("PL", re.compile(r'▬+\s*OPERATORZY\s+PL\b')),
+    ("UKPL", re.compile(r'▬+\s*OPERATORZY\s+UKPL')),   # LEGACY → normalizowane do UK
+)
+_RE_SCORE = re.compile(rf'^\[SCORE=(\d+)\]\s*([{_ICONS}])\s*\|\s*(.*)')
+_RE_SCORE_ALT = re.compile(rf'^([{_ICONS}])\s*\[(\d+)\]\s*\|\s*(.*)')
+# Koniec bloku: kolejny nagłówek (luźniej — bez "|")
+_RE_SCORE_START = re.compile(rf'^(?:\[SCORE=\d+\]|[{_ICONS}]\s*\[\d+\])')
+_RE_NUMER = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'NrZam[:\s]+(\S+)', r'Nr\s*Zam[:\s]+(\S+)', r'(ZN\d+)', r'(ZW\d+[/]\d+)'))
+_RE_NUMER_TAB = re.compile(r'^\s*(\d{5,7})\s')
+_RE_NUMER_GOLY = re.compile(r'(\d{5,7})')
+_RE_INDEX = re.compile(r'Index:\s*(\S+)')
+_RE_LINDEXY = re.compile(r'lindexy[:\s]+(\S+)', re.IGNORECASE)
+
+_SCAN, _BLOCK, _ALERT = 0, 1, 2
+
+
+def _header(line):
+    """(score, ikona, label) z nagłówka casa albo None. line — już po strip()."""
+    if not line:
+        return None
+    c = line[0]
+    if c == "[":
+        m = _RE_SCORE.match(line)
+        if m:
+            return int(m.group(1)), m.group(2), m.group(3).strip()
+    elif c in _ICONS:
+        m = _RE_SCORE_ALT.match(line)
+        if m:
+            return int(m.group(2)), m.group(1), m.group(3).strip()
+    return None
+
+
+def _build_case(grupa, naglowek, score, icon, label, blok_lines):
+    pelna_linia = '\n'.join(blok_lines).strip()
+    if not pelna_linia:
+        return None
+
+    # Wyciągnij numer zamówienia
+    numer = None
+    for rx in _RE_NUMER:
+        m = rx.search(pelna_linia)
+        if m:
+            numer = m.group(1).strip().rstrip(',').rstrip('|')
+            break
+    # Fallback: gołe 5-7 cyfr na początku linii (format tabeli)
+    if not numer:
+        for bl in blok_lines:
+            m = _RE_NUMER_TAB.match(bl)
+            if m:
+                numer = m.group(1)
+                break
+    # Fallback 2: goły numer gdziekolwiek w nagłówku lub label
+    if not numer:
+        for src in (naglowek, label):
+            m = _RE_NUMER_GOLY.search(src)
+            if m:
+                numer = m.group(1)
+                break
+    if not numer:
+        return None
+
+    idx_m = _RE_INDEX.search(label)
+    index_handlowy = idx_m.group(1) if idx_m else ""
+    if not index_handlowy:
+        lindx_m = _RE_LINDEXY.search(pelna_linia)
+        if lindx_m:
+            index_handlowy = lindx_m.group(1)
+
+    return {
+        "numer_zamowienia": numer,
+        "score": score,
+        "priority_icon": icon,
+        "priority_label": label,
+        "grupa": grupa,
+        "index_handlowy": index_handlowy,
+        "pelna_linia_szturchacza": pelna_linia,
+        "naglowek_priorytetowy": naglowek,
+    }
+
+
+class IncrementalParser:
+    """Parser przyrostowy: feed(kawałek) zwraca casy domknięte w tym kawałku, close() — resztę.
+    Wszystkie casy (w kolejności) w .cases. Niepełna ostatnia linia czeka na kolejny kawałek."""
+
+    def __init__(self):
+        self.cases = []
+        self._buf = ""
+        self._state = _SCAN
+        self._grupa = None
+        self._cur = None        # (naglowek, score, icon, label) bieżącego casa
+        self._blok = []
+
+    def feed(self, chunk):
+        if not chunk:
+            return []
+        start = len(self.cases)
+        self._buf += chunk
+        *lines, self._buf = self._buf.split('\n')
+        for raw in lines:
+            self._line(raw)
+        return self.cases[start:]
+
+    def close(self):
+        start = len(self.cases)
+        self._line(self._buf)
+        self._buf = ""
+        if self._state == _BLOCK:
+            self._finish()
+        return self.cases[start:]
+
+    def _finish(self):
+        naglowek, score, icon, label = self._cur
+        case = _build_case(self._grupa, naglowek, score, icon, label, self._blok)
+        if case:
+            self.cases.append(case)
+        self._state, self._cur, self._blok = _SCAN, None, []
+
+    def _line(self, raw):
+        line = raw.strip()
+        if self._state == _BLOCK:
+            if (line == '---' or line.startswith('▬') or line.startswith('═══')
+                    or (line and (line[0] == "[" or line[0] in _ICONS) and _RE_SCORE_START.match(line))):
+                self._finish()  # linia kończąca blok idzie dalej jak zwykła
+            else:
+                if line:
+                    self._blok.append(raw)
+                return
+        elif self._state == _ALERT:
+            if not line.startswith('═══'):
+                return
+            self._state = _SCAN
+
+        if '▬' in line:
+            for grupa, rx in _GRUPA_PATTERNS:
+                if rx.search(line):
+                    # LEGACY: stary wsad z sekcją UKPL → traktujemy jako UK (PL wyodrębniona osobno)
+                    self._grupa = "UK" if grupa == "UKPL" else grupa
+                    break
+        head = _header(line)
+        if head and self._grupa:
+            score, icon, label = head
+            self._state, self._cur, self._blok = _BLOCK, (line, score, icon, label), []
+            return
+        if 'ALERT' in line and 'BRAK W SZTURCHACZU' in line:
+            self._state = _ALERT
+
+
+def parse(text):
+    """Casy z całej odpowiedzi Wieżowca (lista słowników, jak dawny parse_wiezowiec_output)."""
+    p = IncrementalParser()
+    p.feed(text)
+    p.close()
+    return p.cases
+
+
+# ==========================================
+# ZGODNOŚĆ + BENCHMARK (python wiezowiec_parser.py [plik ...])
+# ==========================================
+
+def _legacy_parse(text):
+    """Dawny parse_wiezowiec_output z app.py — wzorzec zgodności."""
+    cases = []
+    current_grupa = None
+    grupa_patterns = {
+        "DE": r'▬+\s*OPERATORZY\s+DE',
+        "FR": r'▬+\s*OPERATORZY\s+FR',
+        "UK": r'▬+\s*OPERATORZY\s+UK\b',
+        "PL": r'▬+\s*OPERATORZY\s+PL\b',
+        "UKPL": r'▬+\s*OPERATORZY\s+UKPL',
+    }
+    lines = text.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        for grupa, pattern in grupa_patterns.items():
+            if re.search(pattern, line):
+                current_grupa = "UK" if grupa == "UKPL" else grupa
+                break
+        score_match = re.match(r'^\[SCORE=(\d+)\]\s*([🔴🟡⚪📦])\s*\|\s*(.*)', line)
+        if not score_match:
+            score_match = re.match(r'^([🔴🟡⚪📦])\s*\[(\d+)\]\s*\|\s*(.*)', line)
+            if score_match:
+                icon = score_match.group(1)
+                score = int(score_match.group(2))
+                label = score_match.group(3).strip()
+        else:
+            score = int(score_match.group(1))
+            icon = score_match.group(2)
+            label = score_match.group(3).strip()
+        if score_match and current_grupa:
+            naglowek = line
+            i += 1
+            blok_lines = []
+            while i < len(lines):
+                nl = lines[i].strip()
+                if nl == '---' or nl.startswith('▬') or nl.startswith('═══'):
+                    break
+                if re.match(r'^\[SCORE=\d+\]', nl) or re.match(r'^[🔴🟡⚪📦]\s*\[\d+\]', nl):
+                    break
+                if nl:
+                    blok_lines.append(lines[i])
+                i += 1
+            pelna_linia = '\n'.join(blok_lines).strip()
+            numer = None
+            for p in [r'NrZam[:\s]+(\S+)', r'Nr\s*Zam[:\s]+(\S+)', r'(ZN\d+)', r'(ZW\d+[/]\d+)']:
+                m = re.search(p, pelna_linia, re.IGNORECASE)
+                if m:
+                    numer = m.group(1).strip().rstrip(',').rstrip('|')
+                    break
+            if not numer:
+                for bl in blok_lines:
+                    m = re.match(r'^\s*(\d{5,7})\s', bl)
+                    if m:
+                        numer = m.group(1)
+                        break
+            if not numer:
+                for src in [naglowek, label]:
+                    m = re.search(r'(\d{5,7})', src)
+                    if m:
+                        numer = m.group(1)
+                        break
+            idx_m = re.search(r'Index:\s*(\S+)', label)
+            index_handlowy = idx_m.group(1) if idx_m else ""
+            if not index_handlowy:
+                lindx_m = re.search(r'lindexy[:\s]+(\S+)', pelna_linia, re.IGNORECASE)
+                if lindx_m:
+                    index_handlowy = lindx_m.group(1)
+            if pelna_linia and numer:
+                cases.append({
+                    "numer_zamowienia": numer,
+                    "score": score,
+                    "priority_icon": icon,
+                    "priority_label": label,
+                    "grupa": current_grupa,
+                    "index_handlowy": index_handlowy,
+                    "pelna_linia_szturchacza": pelna_linia,
+                    "naglowek_priorytetowy": naglowek,
+                })
+            continue
+        if 'ALERT' in line and 'BRAK W SZTURCHACZU' in line:
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith('═══'):
+                i += 1
+            continue
+        i += 1
+    return cases
+
+
+def _synthetic_output(n_cases, seed=11):
+    """Odpowiedź w kształcie Wieżowca: sekcje grup, oba formaty nagłówka, ALERT-y, legacy UKPL."""
+    import random
+    rnd = random.Random(seed)
+    out = ["Raport priorytetów", "[SCORE=999] 🔴 | bez grupy — pomijany", "366999 x", ""]
+    grupy = ["DE", "FR", "UKPL", "UK", "PL"]
+    per = max(1, n_cases // len(grupy))
+    n = 0
+    for g in grupy:
+        out.append(f"▬▬▬▬▬▬ OPERATORZY {g} ▬▬▬▬▬▬")
+        for _ in range(per):
+            n += 1
+            nr = 300000 + rnd.randrange(700000)
+            icon = rnd.choice("🔴🟡⚪📦")
+            if rnd.random() < 0.7:
+                out.append(f"[SCORE={rnd.randint(0, 999)}] {icon} | PZ{rnd.randint(1, 9)} Index: IX{n} | opis")
+            else:
+                out.append(f"{icon} [{rnd.randint(0, 999)}] | opis {nr}")
+            kind = rnd.random()
+            if kind < 0.5:
+                out.append(f"{nr}\t2026-06-01\t{g}\tklient@example.com  lindexy: L{n}")
+            elif kind < 0.8:
+                out.append(f"NrZam: {nr}, C#:PZ3;NEXT=12.06")
+            elif kind < 0.9:
+                out.append(f"  Nr Zam: ZW{nr}/2")
+            else:
+                out.append("  (brak numeru w bloku)")
+            for _ in range(rnd.randint(0, 3)):
+                out.append(rnd.choice(("   punktacja: +40 kolektor", "", "  uwagi: telefon nieodebrany")))
+            r = rnd.random()
+            if r < 0.3:
+                out.append("---")
+            elif r < 0.35:
+                out.append("⚠️ ALERT: 366123 BRAK W SZTURCHACZU")
+                out.append("[SCORE=500] 🔴 | w alercie — pomijany")
+                out.append("═══════════")
+    return "\n".join(out)
+
+
+def _chunked(text, rnd):
+    pos = 0
+    while pos < len(text):
+        step = rnd.randint(1, 400)
+        yield text[pos:pos + step]
+        pos += step
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    corpus = []
+    for path in sys.argv[1:]:
+        with open(path, encoding="utf-8") as f:
+            corpus.extend(p for p in re.split(r'^=== PARTIA[^\n]*\n', f.read(), flags=re.M) if p.strip())
+    if not corpus:
+        corpus = [_synthetic_output(n) for n in (60, 600, 6000)]
+
+    rnd = random.Random(3)
+    bad = 0
+    for text in corpus:
+        want = _legacy_parse(text)
+        stream = IncrementalParser()
+        got_stream = []
+        for chunk in _chunked(text, rnd):
+            got_stream.extend(stream.feed(chunk))
+        got_stream.extend(stream.close())
+        if parse(text) != want or got_stream != want:
+            bad += 1
+    print(f"Korpus: {len(corpus)} odpowiedzi, {sum(len(_legacy_parse(t)) for t in corpus)} casów, "
+          f"niezgodności (całość/strumień): {bad}")
+
+    for label, fn in (("stary parser", _legacy_parse), ("wiezowiec_parser", parse)):
+        t0 = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        print(f"{label:<18} {(time.perf_counter() - t0) * 1000:8.1f} ms")
+    sys.exit(1 if bad else 0)